@@ -1,4 +1,6 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Header, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
@@ -7,9 +9,12 @@ import os
 import json
 import shutil
 import time
+import uuid
+import asyncio
 from datetime import datetime
 import ipfshttpclient
 from web3 import Web3
+from web3.exceptions import ContractLogicError, TimeExhausted
 import uvicorn
 import sys
 from dotenv import load_dotenv, find_dotenv, set_key
@@ -17,12 +22,52 @@ from dotenv import load_dotenv, find_dotenv, set_key
 # Add the current directory to the path so Python can find our local modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+# Load .env before importing our modules, they read their settings at import time
+load_dotenv()
+
 # Import our local modules
-from utils.contract import get_contract, mock_token_counter
-from utils.ipfs import upload_to_ipfs, get_ipfs_url
+from utils.contract import (
+    MockContract, get_issued_token_id, wait_for_receipt, fetch_certificate, is_lean_contract,
+    issue_certificate_function, update_certificate_function, TransactionReverted,
+    sign_transaction, resend_transaction, TransactionDropped, is_revoked
+)
+from utils.shards import get_shard_registry
+from utils.ipfs import upload_to_ipfs, get_ipfs_url, resolve_token_uri, resolve_token_uris, IpfsUploadError, metadata_cache
+from utils.singleflight import read_flight
+from utils.admin import require_admin
+from utils.profiling import ProfilingMiddleware, track_thread, list_profiles, get_profile_path
+from utils.events import certificate_events
+from utils.issuance import ISSUANCE_DEDUP, issuance_index, issuance_key, request_fingerprint
+from utils.jobs import job_queue, job_to_api, Stage, RetryPolicy, PermanentJobError
+from utils.stats import certificate_stats
+from utils.admission import (
+    AdmissionControlMiddleware, ClientRateLimiter, ConcurrencyLimiter, ipfs_stage, rpc_stage, get_client_id
+)
 
 app = FastAPI(title="NFT Certificate API")
 
+# Admission control for write endpoints: per-client rate limit plus a
+# concurrency cap with a bounded wait queue per endpoint. Added before CORS so
+# 429/503 responses still carry CORS headers.
+write_rate_limiter = ClientRateLimiter()
+write_limiters = {
+    "create_certificate": ConcurrencyLimiter("create_certificate"),
+    "update_certificate": ConcurrencyLimiter("update_certificate"),
+    "revoke_certificate": ConcurrencyLimiter("revoke_certificate"),
+}
+app.add_middleware(
+    AdmissionControlMiddleware,
+    rules=[
+        ("POST", r"/api/certificates", write_limiters["create_certificate"]),
+        ("PUT", r"/api/certificates/[^/]+", write_limiters["update_certificate"]),
+        ("DELETE", r"/api/certificates/[^/]+", write_limiters["revoke_certificate"]),
+    ],
+    rate_limiter=write_rate_limiter,
+)
+
+# Opt-in request profiling (X-Profile: 1 with X-Admin-Token, or PROFILE_SAMPLE_RATE)
+app.add_middleware(ProfilingMiddleware)
+
 # Set up CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -40,6 +85,45 @@ print(f"Uploads directory: {UPLOADS_DIR}")
 # Mount static files directory
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
+@app.on_event("startup")
+async def start_simulator():
+    """
+    Start the latency-injecting chain and IPFS simulator in-process when USE_SIMULATOR is set
+    """
+    if os.getenv("USE_SIMULATOR", "False").lower() in ("true", "1", "t", "yes"):
+        from utils.simulator import start_in_process
+        start_in_process()
+
+@app.on_event("startup")
+async def start_issuance_index():
+    """
+    Keep the duplicate-issuance index current and build it from existing certificates
+    """
+    certificate_events.add_listener(issuance_index.on_certificate_event)
+    # Watch the chain from the start rather than from the first subscriber, so
+    # certificates revoked outside this API leave the index (and the statistics)
+    certificate_events.ensure_watcher()
+    asyncio.get_running_loop().create_task(rebuild_issuance_index())
+
+@app.on_event("startup")
+async def start_certificate_stats():
+    """
+    Keep the certificate statistics current and build them from existing certificates
+    """
+    certificate_events.add_listener(certificate_stats.on_certificate_event)
+    asyncio.get_running_loop().create_task(rebuild_certificate_stats())
+
+@app.on_event("startup")
+async def start_job_workers():
+    """
+    Start the issuance job workers; unfinished jobs from a previous run are picked up again
+    """
+    job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_queue.stop()
+
 # Models
 class CertificateCreate(BaseModel):
     recipient_name: str
@@ -49,7 +133,9 @@ class CertificateCreate(BaseModel):
     description: str
 
 class CertificateResponse(BaseModel):
-    id: int
+    id: str
+    token_id: int
+    shard: str
     recipient_name: str
     recipient_address: str
     course_name: str
@@ -64,23 +150,201 @@ class TokenUriMetadata(BaseModel):
     image: str
     attributes: List[dict]
 
+def save_upload(upload: UploadFile, file_path: str):
+    """
+    Copy an uploaded file to disk (blocking, run in the threadpool)
+    """
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(upload.file, buffer)
+
 # Endpoints
 @app.get("/")
 def read_root():
     return {"message": "NFT Certificate API is running"}
 
-@app.post("/api/certificates", response_model=CertificateResponse)
+# Issuance pipeline, run by the job queue. Each stage is checkpointed, so a
+# job interrupted by a crash resumes at the stage it was in.
+async def upload_image_stage(payload, state):
+    if not os.path.exists(payload["image_path"]):
+        raise PermanentJobError(f"Uploaded image {payload['image_path']} is gone")
+    print(f"Uploading image to IPFS: {payload['image_path']}")
+    image_ipfs_hash = await upload_to_ipfs(payload["image_path"])
+    image_url = get_ipfs_url(image_ipfs_hash)
+    print(f"Image IPFS URL: {image_url}")
+    return {"image_url": image_url}
+
+async def upload_metadata_stage(payload, state):
+    certificate_data = CertificateCreate(**payload["certificate"])
+    
+    # Create metadata for NFT
+    metadata = {
+        "name": f"Certificate: {certificate_data.course_name}",
+        "description": certificate_data.description,
+        "image": state["image_url"],
+        "attributes": [
+            {"trait_type": "Recipient Name", "value": certificate_data.recipient_name},
+            {"trait_type": "Course Name", "value": certificate_data.course_name},
+            {"trait_type": "Issue Date", "value": certificate_data.issue_date}
+        ]
+    }
+    
+    # Upload metadata to IPFS
+    # Jobs queued before upload IDs existed only carry the timestamp
+    upload_id = payload.get("upload_id") or payload["timestamp"]
+    metadata_file = os.path.join(UPLOADS_DIR, f"{upload_id}_metadata.json")
+    with open(metadata_file, "w") as f:
+        json.dump(metadata, f)
+    
+    print("Uploading metadata to IPFS...")
+    metadata_ipfs_hash = await upload_to_ipfs(metadata_file)
+    token_uri = get_ipfs_url(metadata_ipfs_hash)
+    print(f"Metadata URI: {token_uri}")
+    return {"token_uri": token_uri}
+
+async def issue_stage(payload, state):
+    certificate_data = CertificateCreate(**payload["certificate"])
+    
+    if "raw_transaction" in state:
+        # An earlier attempt signed the mint and may have sent it: send that same
+        # transaction again instead of a new one, which could mint a second token
+        shard = get_shard_registry().get(state["shard"])
+        contract = await rpc_stage.run(shard.get_contract)
+        try:
+            await rpc_stage.run(
+                shard.track_call, resend_transaction, contract,
+                Web3.to_bytes(hexstr=state["transaction_hash"]), Web3.to_bytes(hexstr=state["raw_transaction"]),
+                state["nonce"]
+            )
+            print(f"Transaction hash: {state['transaction_hash']} (resent)")
+            return {}
+        except TransactionDropped as e:
+            # That transaction can never be mined now, so a new one is safe
+            print(f"{str(e)}, signing a new one")
+    
+    # A retry after an ambiguous failure must not mint a second token
+    if ISSUANCE_DEDUP:
+        existing = issuance_index.lookup(
+            issuance_key(certificate_data.recipient_address, certificate_data.course_name, certificate_data.issue_date)
+        )
+        if existing is not None:
+            print(f"Certificate already issued as {existing['id']}, skipping transaction")
+            return {"result": existing}
+    
+    # Pick the shard (chain, contract, signer) this certificate is minted on
+    shard = get_shard_registry().route(payload.get("issuer"))
+    contract = await rpc_stage.run(shard.get_contract)
+    
+    # Issue certificate via smart contract
+    print(f"Issuing certificate via contract on shard {shard.name}...")
+    try:
+        issue = issue_certificate_function(
+            contract,
+            certificate_data.recipient_address,
+            certificate_data.recipient_name,
+            certificate_data.course_name,
+            certificate_data.description,
+            state["token_uri"]
+        )
+    except ValueError as e:
+        # Invalid arguments, e.g. a lean contract given a token URI that isn't an IPFS CIDv0
+        raise PermanentJobError(str(e))
+    try:
+        # Signing to sending is serialized per shard, so concurrent jobs get consecutive nonces
+        async with shard.send_lock:
+            signed = await rpc_stage.run(shard.track_call, sign_transaction, contract, issue, shard.private_key)
+            if signed is None:
+                # The node signs (development accounts), so the hash is only known once sent
+                tx_hash = await rpc_stage.run(shard.track_call, issue.transact)
+            else:
+                # Checkpoint the hash first: a retry then resends this transaction or confirms it
+                tx_hash, raw_transaction, nonce = signed
+                await job_queue.save_progress({
+                    "shard": shard.name,
+                    "transaction_hash": tx_hash.hex(),
+                    "raw_transaction": raw_transaction.hex(),
+                    "nonce": nonce,
+                })
+                await rpc_stage.run(shard.track_call, contract.w3.eth.send_raw_transaction, raw_transaction)
+    except ContractLogicError as e:
+        # Reverted by the contract, retrying won't help
+        raise PermanentJobError(str(e))
+    
+    print(f"Transaction hash: {tx_hash.hex()}")
+    return {"shard": shard.name, "transaction_hash": tx_hash.hex()}
+
+async def confirm_stage(payload, state):
+    if "result" in state:
+        # issue_stage found the certificate already issued
+        return {}
+    certificate_data = CertificateCreate(**payload["certificate"])
+    shard = get_shard_registry().get(state["shard"])
+    contract = await rpc_stage.run(shard.get_contract)
+    
+    # Read the minted token ID from the transaction (receipt event on a real chain)
+    try:
+        token_id = await rpc_stage.run(
+            shard.track_call, get_issued_token_id, contract, Web3.to_bytes(hexstr=state["transaction_hash"])
+        )
+    except TransactionReverted as e:
+        # Mined without minting, waiting longer won't change that
+        raise PermanentJobError(str(e))
+    print(f"Certificate issued with token ID: {token_id} on shard {shard.name}")
+    
+    certificate = {
+        "id": await rpc_stage.run(shard.certificate_id, token_id),
+        "token_id": token_id,
+        "shard": shard.name,
+        "recipient_name": certificate_data.recipient_name,
+        "recipient_address": certificate_data.recipient_address,
+        "course_name": certificate_data.course_name,
+        "issue_date": certificate_data.issue_date,
+        "description": certificate_data.description,
+        "token_uri": state["token_uri"],
+        "transaction_hash": state["transaction_hash"]
+    }
+    issuance_index.record(
+        issuance_key(certificate_data.recipient_address, certificate_data.course_name, certificate_data.issue_date),
+        certificate
+    )
+    certificate_stats.record_issued(certificate["id"], certificate_data.course_name, issuer=payload.get("issuer"))
+    return {"result": certificate}
+
+job_queue.register("issue_certificate", [
+    Stage("upload_image", upload_image_stage, RetryPolicy(max_attempts=5, base_delay=2, max_delay=60)),
+    Stage("upload_metadata", upload_metadata_stage, RetryPolicy(max_attempts=5, base_delay=2, max_delay=60)),
+    # Few retries: a transaction that timed out may still have been mined
+    Stage("issue", issue_stage, RetryPolicy(max_attempts=3, base_delay=5, max_delay=60)),
+    Stage("confirm", confirm_stage, RetryPolicy(max_attempts=10, base_delay=3, max_delay=120)),
+])
+
+@app.post("/api/certificates", status_code=202)
 async def create_certificate(
+    request: Request,
+    response: Response,
     recipient_name: str = Form(...),
     recipient_address: str = Form(...),
     course_name: str = Form(...),
     issue_date: str = Form(...),
     description: str = Form(...),
-    image: UploadFile = File(...)
+    image: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None)
 ):
+    """
+    Queue a certificate for issuance. Returns 202 with the job to poll at
+    /api/jobs/{id}, or 200 with the certificate if it was already issued.
+    """
     try:
         print(f"Received certificate creation request for: {recipient_name}")
         
+        # Reject a bad address now rather than as a failed job after the IPFS uploads.
+        # Mixed case must be a valid EIP-55 checksum, which catches typos.
+        hex_digits = recipient_address[2:]
+        if not Web3.is_address(recipient_address) or (
+            not hex_digits.islower() and not hex_digits.isupper() and not Web3.is_checksum_address(recipient_address)
+        ):
+            raise HTTPException(status_code=422, detail=f"Invalid recipient address: {recipient_address}")
+        recipient_address = Web3.to_checksum_address(recipient_address)
+        
         # Create a certificate_data object to maintain code consistency
         certificate_data = CertificateCreate(
             recipient_name=recipient_name,
@@ -89,105 +353,166 @@ async def create_certificate(
             issue_date=issue_date,
             description=description
         )
+        key = issuance_key(recipient_address, course_name, issue_date)
         
-        # Save image temporarily
-        timestamp = int(time.time())
-        file_path = os.path.join(UPLOADS_DIR, f"{timestamp}_{image.filename}")
-        print(f"Saving image to: {file_path}")
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
-        
-        # Upload image to IPFS
-        print("Uploading image to IPFS...")
-        image_ipfs_hash = await upload_to_ipfs(file_path)
-        image_url = get_ipfs_url(image_ipfs_hash)
-        print(f"Image IPFS URL: {image_url}")
-        
-        # Create metadata for NFT
-        metadata = {
-            "name": f"Certificate: {certificate_data.course_name}",
-            "description": certificate_data.description,
-            "image": image_url,
-            "attributes": [
-                {"trait_type": "Recipient Name", "value": certificate_data.recipient_name},
-                {"trait_type": "Course Name", "value": certificate_data.course_name},
-                {"trait_type": "Issue Date", "value": certificate_data.issue_date}
-            ]
-        }
-        
-        # Upload metadata to IPFS
-        metadata_file = os.path.join(UPLOADS_DIR, f"{timestamp}_metadata.json")
-        with open(metadata_file, "w") as f:
-            json.dump(metadata, f)
-        
-        print("Uploading metadata to IPFS...")
-        metadata_ipfs_hash = await upload_to_ipfs(metadata_file)
-        token_uri = get_ipfs_url(metadata_ipfs_hash)
-        print(f"Metadata URI: {token_uri}")
-        
-        # Get contract instance
-        print("Getting contract instance...")
-        contract = get_contract()
-        
-        # Issue certificate via smart contract
-        print("Issuing certificate via contract...")
-        tx_hash = contract.functions.issueCertificate(
-            certificate_data.recipient_address,
-            certificate_data.recipient_name,
-            certificate_data.course_name,
-            certificate_data.description,
-            token_uri
-        ).transact()
-        
-        print(f"Transaction hash: {tx_hash}")
+        if ISSUANCE_DEDUP:
+            existing = issuance_index.lookup(key)
+            if existing is not None:
+                print(f"Duplicate issuance request, returning existing certificate {existing['id']}")
+                return JSONResponse(existing, headers={"X-Duplicate-Of": str(existing["id"])})
         
-        # Get the updated token counter after transaction
-        # The mock contract increments the counter before creating the token
-        from utils.contract import mock_token_counter
-        token_id = mock_token_counter  # This should now be the ID of the newly created token
+        # Save image; the job only references the file, so it must be on disk before we answer
+        # Unique per request: requests in the same millisecond must not share files
+        upload_id = uuid.uuid4().hex
+        file_path = os.path.join(UPLOADS_DIR, f"{upload_id}_{os.path.basename(image.filename)}")
+        print(f"Saving image to: {file_path}")
+        await run_in_threadpool(track_thread(save_upload), image, file_path)
         
-        print(f"Using token ID: {token_id}")
+        # A retried request (same Idempotency-Key) or an identical request still
+        # being processed gets the existing job back
+        job, created = await job_queue.submit(
+            "issue_certificate",
+            {
+                "certificate": certificate_data.dict(),
+                "image_path": file_path,
+                "upload_id": upload_id,
+                # Routes the certificate under SHARD_ROUTING=issuer
+                "issuer": get_client_id(request.scope)
+            },
+            idempotency_key=idempotency_key,
+            fingerprint=request_fingerprint(**certificate_data.dict()),
+            dedup_key="|".join(key) if ISSUANCE_DEDUP else None
+        )
+        if not created:
+            # The existing job has its own image; only remove the one saved for this request
+            if job["payload"]["image_path"] != file_path:
+                os.remove(file_path)
+            if idempotency_key and job["idempotency_key"] == idempotency_key:
+                if job["fingerprint"] != request_fingerprint(**certificate_data.dict()):
+                    raise HTTPException(status_code=422, detail=f"Idempotency-Key {idempotency_key} was already used for a different request")
+                response.headers["Idempotent-Replayed"] = "true"
+            print(f"Returning existing job {job['id']}")
+        else:
+            print(f"Queued issuance job {job['id']}")
         
-        return {
-            "id": token_id,
-            "recipient_name": certificate_data.recipient_name,
-            "recipient_address": certificate_data.recipient_address,
-            "course_name": certificate_data.course_name,
-            "issue_date": certificate_data.issue_date,
-            "description": certificate_data.description,
-            "token_uri": token_uri,
-            "transaction_hash": tx_hash.hex() if hasattr(tx_hash, 'hex') else str(tx_hash)
-        }
+        response.headers["Location"] = f"/api/jobs/{job['id']}"
+        return job_to_api(job)
     
+    except HTTPException:
+        # Re-raise HTTP exceptions (including 429/503 from admission control)
+        raise
     except Exception as e:
         print(f"Error in create_certificate: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/certificates/{token_id}")
-async def get_certificate(token_id: int):
+@app.get("/api/jobs/stats")
+async def get_job_stats():
+    """
+    Get worker activity and job counts by status
+    """
+    return await run_in_threadpool(job_queue.stats)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Get the status of an issuance job; result holds the certificate once it succeeded
+    """
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job_to_api(job)
+
+@app.get("/api/certificates/stream")
+async def stream_certificate_events(
+    last_event_id: Optional[int] = Header(None),
+    lastEventId: Optional[int] = None
+):
+    """
+    Server-sent events feed of issued, updated and revoked certificates.
+    Reconnecting clients resume after the Last-Event-ID header (or ?lastEventId=).
+    """
+    resume_from = last_event_id if last_event_id is not None else lastEventId
+    
+    async def event_stream():
+        # Tell EventSource to wait 3s before reconnecting
+        yield "retry: 3000\n\n"
+        async for event in certificate_events.stream(resume_from):
+            if event is None:
+                # Heartbeat comment keeps proxies from closing the connection
+                yield ": keep-alive\n\n"
+                continue
+            yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/api/certificates/ws")
+async def certificate_events_websocket(websocket: WebSocket, lastEventId: Optional[int] = None):
+    """
+    WebSocket variant of the certificate event feed (JSON message per event)
+    """
+    await websocket.accept()
+    try:
+        async for event in certificate_events.stream(lastEventId):
+            if event is None:
+                await websocket.send_json({"type": "heartbeat"})
+                continue
+            await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+
+async def load_contract(shard):
+    """
+    Get a shard's contract, sharing one connection attempt between concurrent requests
+    """
+    return await read_flight.do(("contract", shard.name), rpc_stage.run, shard.get_contract)
+
+async def resolve_certificate_id(certificate_id: str):
+    """
+    Map a chain:contract:token ID (or a bare token ID on the default shard) to its shard
+    """
     try:
-        print(f"Fetching certificate with ID: {token_id}")
-        contract = get_contract()
+        # Checking the chain ID can mean connecting to the shard first
+        return await rpc_stage.run(get_shard_registry().resolve, certificate_id)
+    except (ValueError, KeyError) as e:
+        raise HTTPException(status_code=404, detail=f"Certificate with ID {certificate_id} not found: {str(e)}")
+
+def parse_block_identifier(block: str):
+    """
+    Turn a ?block= query value into a web3 block identifier
+    """
+    return int(block) if block.isdigit() else block
+
+def read_certificate(shard, contract, token_id, block_identifier="latest"):
+    """
+    Fetch a certificate and tag it with its global ID (blocking)
+    """
+    return shard.describe(fetch_certificate(contract, token_id, block_identifier))
+
+@app.get("/api/certificates/{certificate_id}")
+async def get_certificate(certificate_id: str, block: str = "latest"):
+    try:
+        print(f"Fetching certificate with ID: {certificate_id}")
+        shard, token_id = await resolve_certificate_id(certificate_id)
+        contract = await load_contract(shard)
+        block_identifier = parse_block_identifier(block)
         try:
-            certificate = contract.functions.getCertificateDetails(token_id).call()
-            owner = contract.functions.ownerOf(token_id).call()
-            token_uri = contract.functions.tokenURI(token_id).call()
+            # Identical concurrent reads (same token, same block tag) share one upstream call
+            certificate = await read_flight.do(
+                ("certificate", shard.name, token_id, block_identifier),
+                rpc_stage.run, read_certificate, shard, contract, token_id, block_identifier
+            )
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"Error getting certificate details from contract: {str(e)}")
-            raise HTTPException(status_code=404, detail=f"Certificate with ID {token_id} not found")
-        
-        return {
-            "id": token_id,
-            "recipient_name": certificate[0],
-            "course_name": certificate[1],
-            "issue_date": datetime.fromtimestamp(certificate[2]).strftime("%Y-%m-%d"),
-            "description": certificate[3],
-            "revoked": certificate[4],
-            "owner": owner,
-            "token_uri": token_uri
-        }
+            raise HTTPException(status_code=404, detail=f"Certificate with ID {certificate_id} not found")
+        return await complete_certificate(certificate)
     except HTTPException:
         # Re-raise HTTP exceptions
         raise
@@ -197,44 +522,168 @@ async def get_certificate(token_id: int):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/certificates/{certificate_id}/metadata")
+async def get_certificate_metadata(certificate_id: str):
+    """
+    Resolve a certificate's token URI to its metadata JSON
+    """
+    certificate = await get_certificate(certificate_id)
+    metadata = await resolve_token_uri(certificate["token_uri"])
+    if metadata is None:
+        raise HTTPException(status_code=404, detail=f"Metadata for certificate {certificate_id} could not be resolved")
+    return metadata
+
+def scan_certificates(shard, contract):
+    """
+    Read a shard's certificates from ID 1 upwards until the first missing token (blocking)
+    """
+    certificates = []
+    # In a real app, you would have a more efficient way to iterate through tokens
+    # For simplicity, we're using a range up to a reasonable max number
+    for token_id in range(1, 100):
+        try:
+            certificates.append(read_certificate(shard, contract, token_id))
+        except:
+            # Token does not exist, stop the loop
+            break
+    return certificates
+
+async def scan_shard(shard):
+    contract = await load_contract(shard)
+    certificates = await rpc_stage.run(scan_certificates, shard, contract)
+    # Fetch lean certificates' metadata a few at a time; the list can be long and the cache cold
+    token_uris = [certificate["token_uri"] for certificate in certificates if "metadata_digest" in certificate]
+    metadata = dict(zip(token_uris, await resolve_token_uris(token_uris)))
+    return [fill_from_metadata(certificate, metadata.get(certificate["token_uri"])) for certificate in certificates]
+
+async def scan_all_shards():
+    """
+    Scan every shard in parallel and merge the results in shard order.
+    A shard that can't be read is left out rather than failing the whole list.
+    """
+    shards = get_shard_registry().shards
+    results = await asyncio.gather(*(scan_shard(shard) for shard in shards), return_exceptions=True)
+    certificates = []
+    errors = []
+    for shard, result in zip(shards, results):
+        if isinstance(result, BaseException):
+            print(f"Error listing certificates on shard {shard.name}: {str(result)}")
+            errors.append(result)
+            continue
+        certificates.extend(result)
+    if errors and len(errors) == len(shards):
+        raise errors[0]
+    return certificates
+
 @app.get("/api/certificates")
 async def list_certificates():
     try:
-        contract = get_contract()
-        # Get total supply of tokens
-        # Note: This assumes the contract has a totalSupply function or similar
-        # You might need to implement custom logic to get all tokens
-        
-        certificates = []
-        # In a real app, you would have a more efficient way to iterate through tokens
-        # For simplicity, we're using a range up to a reasonable max number
-        for token_id in range(1, 100):
-            try:
-                certificate = contract.functions.getCertificateDetails(token_id).call()
-                owner = contract.functions.ownerOf(token_id).call()
-                token_uri = contract.functions.tokenURI(token_id).call()
-                
-                certificates.append({
-                    "id": token_id,
-                    "recipient_name": certificate[0],
-                    "course_name": certificate[1],
-                    "issue_date": datetime.fromtimestamp(certificate[2]).strftime("%Y-%m-%d"),
-                    "description": certificate[3],
-                    "revoked": certificate[4],
-                    "owner": owner,
-                    "token_uri": token_uri
-                })
-            except:
-                # Token does not exist, stop the loop
-                break
-                
-        return certificates
+        # Concurrent list requests share a single fan-out
+        return await read_flight.do(("list",), scan_all_shards)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.put("/api/certificates/{token_id}")
+def metadata_attribute(metadata, trait_type):
+    """
+    Value of one of the metadata attributes written at issuance
+    """
+    for attribute in (metadata or {}).get("attributes", []):
+        if attribute.get("trait_type") == trait_type:
+            return attribute.get("value")
+    return None
+
+def metadata_issue_date(metadata):
+    """
+    Issue date entered at issuance, stored in the metadata attributes
+    """
+    return metadata_attribute(metadata, "Issue Date")
+
+async def complete_certificate(certificate):
+    """
+    Fill in the fields a lean contract doesn't store from the certificate's
+    metadata. Metadata is cached, so this costs a gateway fetch only once per URI.
+    """
+    if "metadata_digest" not in certificate:
+        return certificate
+    return fill_from_metadata(certificate, await resolve_token_uri(certificate["token_uri"]))
+
+def fill_from_metadata(certificate, metadata):
+    """
+    complete_certificate() with the metadata already fetched. metadata_unavailable
+    tells clients the fields are empty because the metadata couldn't be
+    fetched, not because the certificate has none.
+    """
+    if "metadata_digest" not in certificate:
+        return certificate
+    return {
+        **certificate,
+        "recipient_name": metadata_attribute(metadata, "Recipient Name") or "",
+        "course_name": metadata_attribute(metadata, "Course Name") or "",
+        "description": (metadata or {}).get("description", ""),
+        "metadata_unavailable": metadata is None,
+    }
+
+async def rebuild_issuance_index():
+    """
+    Rebuild the duplicate-issuance index from the certificates on the contract
+    """
+    try:
+        certificates = await read_flight.do(("list",), scan_all_shards)
+        indexed = []
+        skipped = 0
+        for certificate in certificates:
+            if certificate["revoked"]:
+                continue
+            if certificate.get("metadata_unavailable"):
+                # Blank course and recipient would never match a request
+                skipped += 1
+                continue
+            # The contract stores the mint time; the date the issuer entered lives in the metadata
+            metadata = await resolve_token_uri(certificate["token_uri"])
+            indexed.append({
+                "id": certificate["id"],
+                "token_id": certificate["token_id"],
+                "shard": certificate["shard"],
+                "recipient_name": certificate["recipient_name"],
+                "recipient_address": certificate["owner"],
+                "course_name": certificate["course_name"],
+                "issue_date": metadata_issue_date(metadata) or certificate["issue_date"],
+                "description": certificate["description"],
+                "token_uri": certificate["token_uri"],
+                "transaction_hash": ""
+            })
+        issuance_index.rebuild(indexed)
+        if skipped:
+            print(f"Issuance index left out {skipped} certificates whose metadata couldn't be fetched")
+    except Exception as e:
+        print(f"Error rebuilding issuance index: {str(e)}")
+        import traceback
+        traceback.print_exc()
+
+async def rebuild_certificate_stats():
+    """
+    Recompute the certificate statistics from the contracts. Issuers come from
+    the issuance jobs still retained; older certificates count as "unknown".
+    """
+    try:
+        certificates = await read_flight.do(("list",), scan_all_shards)
+        jobs = await run_in_threadpool(job_queue.store.succeeded, "issue_certificate")
+        issuers = {result["id"]: payload.get("issuer") for payload, result in jobs if "id" in result}
+        # Without metadata a lean certificate's course is unknown; don't file it under ""
+        available = [certificate for certificate in certificates if not certificate.get("metadata_unavailable")]
+        if len(available) < len(certificates):
+            print(f"Certificate statistics left out {len(certificates) - len(available)} certificates whose metadata couldn't be fetched")
+        certificate_stats.rebuild(available, issuers)
+    except Exception as e:
+        print(f"Error rebuilding certificate stats: {str(e)}")
+        import traceback
+        traceback.print_exc()
+
+@app.put("/api/certificates/{certificate_id}")
 async def update_certificate(
-    token_id: int,
+    certificate_id: str,
     recipient_name: str = Form(...),
     recipient_address: str = Form(...),
     course_name: str = Form(...),
@@ -243,7 +692,8 @@ async def update_certificate(
     image: Optional[UploadFile] = File(None)
 ):
     try:
-        contract = get_contract()
+        shard, token_id = await resolve_certificate_id(certificate_id)
+        contract = await rpc_stage.run(shard.get_contract)
         
         # Create a certificate_data object
         certificate_data = CertificateCreate(
@@ -255,20 +705,28 @@ async def update_certificate(
         )
         
         # Get existing token URI
-        existing_token_uri = contract.functions.tokenURI(token_id).call()
+        existing_token_uri = await rpc_stage.run(contract.functions.tokenURI(token_id).call)
         token_uri = existing_token_uri
         
-        # If an image is provided, update the metadata
-        if image:
-            # Save image temporarily
-            timestamp = int(time.time())
-            file_path = f"uploads/{timestamp}_{image.filename}"
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(image.file, buffer)
-            
-            # Upload image to IPFS
-            image_ipfs_hash = await upload_to_ipfs(file_path)
-            image_url = get_ipfs_url(image_ipfs_hash)
+        # If an image is provided, update the metadata. A lean contract keeps the
+        # recipient, course and description only in the metadata, so it always needs new metadata.
+        if image or is_lean_contract(contract):
+            # Unique per request, so concurrent updates never overwrite each other's files
+            upload_id = uuid.uuid4().hex
+            if image:
+                # Save image temporarily
+                file_path = os.path.join(UPLOADS_DIR, f"{upload_id}_{os.path.basename(image.filename)}")
+                await run_in_threadpool(track_thread(save_upload), image, file_path)
+                
+                # Upload image to IPFS
+                image_ipfs_hash = await upload_to_ipfs(file_path)
+                image_url = get_ipfs_url(image_ipfs_hash)
+            else:
+                # Keep the current image; without it the new metadata would drop the image
+                existing_metadata = await resolve_token_uri(existing_token_uri)
+                if not existing_metadata or not existing_metadata.get("image"):
+                    raise HTTPException(status_code=502, detail=f"Could not read the current metadata at {existing_token_uri}")
+                image_url = existing_metadata["image"]
             
             # Create metadata for NFT
             metadata = {
@@ -283,7 +741,7 @@ async def update_certificate(
             }
             
             # Upload metadata to IPFS
-            metadata_file = f"uploads/{timestamp}_metadata.json"
+            metadata_file = os.path.join(UPLOADS_DIR, f"{upload_id}_metadata.json")
             with open(metadata_file, "w") as f:
                 json.dump(metadata, f)
             
@@ -292,19 +750,28 @@ async def update_certificate(
         
         # Update certificate
         # Note: This depends on your contract having an updateCertificate function
-        tx_hash = contract.functions.updateCertificate(
-            token_id,
-            certificate_data.recipient_name,
-            certificate_data.course_name,
-            certificate_data.description,
-            token_uri
-        ).transact()
+        try:
+            update = update_certificate_function(
+                contract,
+                token_id,
+                certificate_data.recipient_name,
+                certificate_data.course_name,
+                certificate_data.description,
+                token_uri
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        # The signer's nonce is taken from the node while sending; serialize with other sends
+        async with shard.send_lock:
+            tx_hash = await rpc_stage.run(shard.track_call, update.transact)
         
         # Wait for transaction receipt
-        tx_receipt = Web3().eth.wait_for_transaction_receipt(tx_hash)
+        tx_receipt = await rpc_stage.run(shard.track_call, wait_for_receipt, contract, tx_hash)
         
-        return {
-            "id": token_id,
+        certificate = {
+            "id": await rpc_stage.run(shard.certificate_id, token_id),
+            "token_id": token_id,
+            "shard": shard.name,
             "recipient_name": certificate_data.recipient_name,
             "recipient_address": certificate_data.recipient_address,
             "course_name": certificate_data.course_name,
@@ -313,32 +780,67 @@ async def update_certificate(
             "token_uri": token_uri,
             "transaction_hash": tx_hash.hex() if hasattr(tx_hash, 'hex') else str(tx_hash)
         }
+        # A revocation mined right after the update must not be undone in the index or stats
+        if not await rpc_stage.run(is_revoked, contract, token_id):
+            # Re-index under the updated recipient, course and date
+            issuance_index.record(
+                issuance_key(certificate_data.recipient_address, certificate_data.course_name, certificate_data.issue_date),
+                certificate
+            )
+            certificate_stats.record_updated(certificate["id"], certificate_data.course_name)
+        return certificate
         
+    except HTTPException:
+        raise
+    except IpfsUploadError as e:
+        raise HTTPException(status_code=502, detail=f"IPFS upload failed: {str(e)}")
+    except (TransactionReverted, ContractLogicError) as e:
+        # e.g. the certificate was revoked; nothing was changed on-chain
+        raise HTTPException(status_code=409, detail=f"Update reverted: {str(e)}")
+    except TimeExhausted as e:
+        raise HTTPException(status_code=502, detail=f"Transaction not mined: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.delete("/api/certificates/{token_id}")
-async def revoke_certificate(token_id: int):
+@app.delete("/api/certificates/{certificate_id}")
+async def revoke_certificate(certificate_id: str):
     try:
-        contract = get_contract()
+        shard, token_id = await resolve_certificate_id(certificate_id)
+        contract = await rpc_stage.run(shard.get_contract)
         
         # Revoke the certificate
-        tx_hash = contract.functions.revokeCertificate(token_id).transact()
+        async with shard.send_lock:
+            tx_hash = await rpc_stage.run(shard.track_call, contract.functions.revokeCertificate(token_id).transact)
         
         # Wait for transaction receipt
-        tx_receipt = Web3().eth.wait_for_transaction_receipt(tx_hash)
+        tx_receipt = await rpc_stage.run(shard.track_call, wait_for_receipt, contract, tx_hash)
+        revoked_id = await rpc_stage.run(shard.certificate_id, token_id)
+        # The certificate can be issued again straight away
+        issuance_index.forget(revoked_id)
+        certificate_stats.record_revoked(revoked_id)
         
-        return {"message": f"Certificate {token_id} revoked successfully"}
+        return {"message": f"Certificate {certificate_id} revoked successfully"}
+    except HTTPException:
+        raise
+    except (TransactionReverted, ContractLogicError) as e:
+        # e.g. the certificate was already revoked
+        raise HTTPException(status_code=409, detail=f"Revocation reverted: {str(e)}")
+    except TimeExhausted as e:
+        raise HTTPException(status_code=502, detail=f"Transaction not mined: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/network")
 async def get_network_info():
     try:
-        web3 = Web3(Web3.HTTPProvider(os.getenv("NETWORK_RPC_URL", "http://localhost:8545")))
+        # Reuse the default shard's pooled connection and cached chain ID
+        shard = get_shard_registry().default
+        contract = await load_contract(shard)
+        if isinstance(contract, MockContract):
+            raise RuntimeError("Using the mock contract")
         
         # Get network ID
-        network_id = web3.eth.chain_id
+        network_id = await rpc_stage.run(shard.get_chain_id)
         
         # Map network ID to name
         networks = {
@@ -360,8 +862,8 @@ async def get_network_info():
         return {
             "networkId": network_id,
             "networkName": network_name,
-            "contractAddress": os.getenv("CONTRACT_ADDRESS", ""),
-            "rpcUrl": os.getenv("NETWORK_RPC_URL", "http://localhost:8545")
+            "contractAddress": shard.contract_address,
+            "rpcUrl": shard.rpc_urls[0]
         }
     except Exception as e:
         # For development, return mock data
@@ -372,6 +874,108 @@ async def get_network_info():
             "rpcUrl": "http://localhost:8545"
         }
 
+@app.get("/api/network/rpc")
+async def get_rpc_pool_stats(shard: Optional[str] = None):
+    """
+    Get per-endpoint latency, error rate and health for a shard's RPC pool (default shard unless ?shard=)
+    """
+    from utils.rpc_pool import get_rpc_pool
+    
+    registry = get_shard_registry()
+    if shard is not None and shard not in registry.by_name:
+        raise HTTPException(status_code=404, detail=f"Shard {shard} not found")
+    target = registry.get(shard) if shard is not None else registry.default
+    if target.mock:
+        # No pool (and no health probes) behind a mock contract
+        return {"mock": True, "endpoints": [], "writeEndpoint": None, "hedgedRequests": 0, "hedgeWins": 0, "failovers": 0}
+    return get_rpc_pool(target.rpc_urls).stats()
+
+@app.get("/api/shards")
+async def get_shards():
+    """
+    Get the shard registry: routing policy, and per shard its chain, contract and pending writes
+    """
+    return get_shard_registry().stats()
+
+@app.get("/api/events/stats")
+async def get_event_feed_stats():
+    """
+    Get subscriber count and history size of the certificate event feed
+    """
+    return certificate_events.stats()
+
+@app.get("/api/admission/stats")
+async def get_admission_stats():
+    """
+    Get rate limiter, per-endpoint and per-stage concurrency statistics
+    """
+    return {
+        "rateLimit": write_rate_limiter.stats(),
+        "endpoints": {name: limiter.stats() for name, limiter in write_limiters.items()},
+        "stages": {"ipfs": ipfs_stage.stats(), "rpc": rpc_stage.stats()},
+    }
+
+@app.get("/api/singleflight/stats")
+async def get_singleflight_stats():
+    """
+    Get upstream calls made and saved by request coalescing on the read path
+    """
+    return read_flight.stats()
+
+@app.get("/api/metadata/stats")
+async def get_metadata_cache_stats():
+    """
+    Get size and hit counts of the IPFS metadata cache
+    """
+    return metadata_cache.stats()
+
+@app.get("/api/issuance/stats")
+async def get_issuance_index_stats():
+    """
+    Get size and hit counts of the duplicate-issuance index
+    """
+    return issuance_index.stats()
+
+@app.post("/api/admin/issuance-index/rebuild", dependencies=[Depends(require_admin)])
+async def rebuild_issuance_index_endpoint():
+    """
+    Rebuild the duplicate-issuance index from the contract
+    """
+    await rebuild_issuance_index()
+    return issuance_index.stats()
+
+@app.get("/api/stats")
+async def get_certificate_stats():
+    """
+    Get certificate totals, revocations, per-course and per-issuer counts and recent issuance rates
+    """
+    return certificate_stats.snapshot()
+
+@app.post("/api/admin/stats/rebuild", dependencies=[Depends(require_admin)])
+async def rebuild_certificate_stats_endpoint():
+    """
+    Recompute the certificate statistics from the contracts
+    """
+    await rebuild_certificate_stats()
+    return certificate_stats.snapshot()
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def get_profiles():
+    """
+    List recent request profiles, newest first
+    """
+    return list_profiles()
+
+@app.get("/api/admin/profiles/{name}", dependencies=[Depends(require_admin)])
+async def download_profile(name: str):
+    """
+    Download a request profile (.speedscope.json opens in https://www.speedscope.app)
+    """
+    path = get_profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile {name} not found")
+    return FileResponse(path, filename=name)
+
 @app.get("/api/settings")
 async def get_settings():
     """
@@ -0,0 +1,35 @@
+import asyncio
+
+from utils import admission
+from utils.admission import ConcurrencyLimiter, Overloaded, get_client_id
+
+
+def scope(api_key=None):
+    headers = [(b"x-api-key", api_key.encode())] if api_key else []
+    return {"type": "http", "headers": headers, "client": ("203.0.113.7", 5000)}
+
+
+def test_client_id_trusts_only_configured_api_keys(monkeypatch):
+    monkeypatch.setattr(admission, "API_KEYS", {"partner-key"})
+    assert get_client_id(scope("partner-key")) == "key:partner-key"
+    # Unknown keys would let a client reset its rate limit at will
+    assert get_client_id(scope("made-up")) == "ip:203.0.113.7"
+    assert get_client_id(scope()) == "ip:203.0.113.7"
+
+
+def test_concurrency_limiter_rejects_same_tick_overflow():
+    limiter = ConcurrencyLimiter("test", limit=4, max_queue=16, queue_timeout=5)
+
+    async def request():
+        started = await limiter.acquire()
+        await asyncio.sleep(0.01)
+        limiter.release(started)
+
+    async def run():
+        return await asyncio.gather(*(request() for _ in range(25)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    rejected = [result for result in results if isinstance(result, Overloaded)]
+    assert len(rejected) == 5
+    assert all(result.status_code == 503 for result in rejected)
+    assert (limiter.admitted, limiter.rejected, limiter.active, limiter.waiting) == (20, 5, 0, 0)
@@ -0,0 +1,46 @@
+import asyncio
+
+from utils.events import CertificateEventBroker
+
+
+def make_broker():
+    broker = CertificateEventBroker()
+    # No chain watcher: events are published by the test
+    broker.ensure_watcher = lambda: None
+    return broker
+
+
+def test_stale_last_event_id_gets_reset_then_new_events():
+    async def run():
+        broker = make_broker()
+        broker.publish("issued", 1)
+        broker.publish("issued", 2)
+        # Id from before a restart, ahead of everything this broker published
+        stream = broker.stream(last_event_id=500)
+        reset = await stream.__anext__()
+        broker.publish("revoked", 1)
+        event = await asyncio.wait_for(stream.__anext__(), 2)
+        await stream.aclose()
+        return reset, event
+
+    reset, event = asyncio.run(run())
+    assert reset["type"] == "reset"
+    assert reset["id"] == 2
+    assert (event["type"], event["id"]) == ("revoked", 3)
+
+
+def test_resume_replays_missed_events_once():
+    async def run():
+        broker = make_broker()
+        for token_id in (1, 2, 3):
+            broker.publish("issued", token_id)
+        stream = broker.stream(last_event_id=1)
+        replayed = [await stream.__anext__(), await stream.__anext__()]
+        broker.publish("revoked", 2)
+        event = await asyncio.wait_for(stream.__anext__(), 2)
+        await stream.aclose()
+        return replayed, event
+
+    replayed, event = asyncio.run(run())
+    assert [e["id"] for e in replayed] == [2, 3]
+    assert event["id"] == 4
@@ -0,0 +1,36 @@
+import time
+import asyncio
+
+import pytest
+
+from utils import ipfs
+from utils.admission import ConcurrencyLimiter, Overloaded
+from utils.ipfs import MetadataCache, get_from_ipfs, resolve_token_uris
+
+
+@pytest.fixture
+def slow_gateway(monkeypatch):
+    # Fresh stage and cache per test, with a gateway taking 10 ms per document
+    monkeypatch.setattr(ipfs, "ipfs_stage", ConcurrencyLimiter("IPFS", 4, max_queue=16, queue_timeout=5))
+    monkeypatch.setattr(ipfs, "metadata_cache", MetadataCache())
+
+    def fetch(ipfs_hash):
+        time.sleep(0.01)
+        return {"name": ipfs_hash}
+
+    monkeypatch.setattr(ipfs, "fetch_ipfs_json", fetch)
+
+
+def test_resolve_token_uris_waits_for_slots_on_a_cold_cache(slow_gateway):
+    uris = [f"ipfs://Qm{index}" for index in range(60)]
+    results = asyncio.run(resolve_token_uris(uris))
+    assert [result["name"] for result in results] == [f"Qm{index}" for index in range(60)]
+
+
+def test_get_from_ipfs_raises_overloaded_when_the_stage_is_full(slow_gateway):
+    async def run():
+        return await asyncio.gather(*(get_from_ipfs(f"Qm{index}") for index in range(60)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert sum(isinstance(result, Overloaded) for result in results) == 40
+    assert None not in results
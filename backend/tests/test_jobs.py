@@ -0,0 +1,222 @@
+import time
+import asyncio
+
+import pytest
+
+from utils.jobs import JobQueue, JobStore, Stage, RetryPolicy, PermanentJobError, QUEUED, RUNNING, SUCCEEDED, FAILED
+
+
+class Flaky(Exception):
+    pass
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.db"))
+
+
+def make_queue(store, lease_seconds=60):
+    return JobQueue(store=store, workers=1, poll_interval=0.01, lease_seconds=lease_seconds)
+
+
+def run_once(queue):
+    """
+    Claim the next due job as this queue's worker would and advance it
+    """
+    job = queue.store.claim(queue.owner, queue.lease_seconds)
+    assert job is not None
+    asyncio.run(queue._advance(job))
+    return queue.store.get(job["id"])
+
+
+def make_due(store):
+    store.connect().execute("UPDATE jobs SET next_run_at = 0")
+
+
+def take_over(store, job_id, owner="other-worker"):
+    # What a worker that claimed the job after our lease expired leaves behind
+    store.connect().execute("UPDATE jobs SET lease_owner = ? WHERE id = ?", (owner, job_id))
+
+
+def test_job_resumes_at_checkpointed_stage_after_crash(store):
+    calls = []
+
+    async def upload(payload, state):
+        calls.append("upload")
+        return {"uri": "ipfs://Qm1"}
+
+    async def crash(payload, state):
+        calls.append("crash")
+        # The process dies mid-stage: nothing after this runs
+        raise asyncio.CancelledError()
+
+    async def mint(payload, state):
+        calls.append("mint")
+        return {"result": {"uri": state["uri"], "name": payload["name"]}}
+
+    crashed = make_queue(store, lease_seconds=0.05)
+    crashed.register("issue", [Stage("upload", upload), Stage("mint", crash)])
+    job, _ = asyncio.run(crashed.submit("issue", {"name": "Alice"}))
+    with pytest.raises(asyncio.CancelledError):
+        run_once(crashed)
+    stored = store.get(job["id"])
+    assert (stored["status"], stored["stage"], stored["state"]) == (RUNNING, "mint", {"uri": "ipfs://Qm1"})
+
+    # Another worker picks the job up once the dead worker's lease runs out
+    restarted = make_queue(store)
+    restarted.register("issue", [Stage("upload", upload), Stage("mint", mint)])
+    assert store.claim(restarted.owner, 60) is None
+    time.sleep(0.1)
+    finished = run_once(restarted)
+    assert finished["status"] == SUCCEEDED
+    assert finished["result"] == {"uri": "ipfs://Qm1", "name": "Alice"}
+    assert calls == ["upload", "crash", "mint"]
+
+
+def test_expired_lease_is_taken_over_and_old_owner_is_fenced(store):
+    job, _ = store.create("issue", {}, "upload")
+    assert store.claim("worker-a", 0.05)["id"] == job["id"]
+    assert store.claim("worker-b", 60) is None
+    time.sleep(0.1)
+    assert store.claim("worker-b", 60)["id"] == job["id"]
+    # The old owner can no longer move the job
+    assert not store.checkpoint(job["id"], "worker-a", "mint", {"stale": True}, 60)
+    assert not store.succeed(job["id"], "worker-a", {}, {"stale": True})
+    assert store.checkpoint(job["id"], "worker-b", "mint", {}, 60)
+    assert store.get(job["id"])["stage"] == "mint"
+
+
+def test_advance_stops_when_the_lease_is_lost_between_stages(store):
+    queue = make_queue(store)
+    calls = []
+
+    async def upload(payload, state):
+        take_over(store, job["id"])
+        return {"uri": "ipfs://Qm1"}
+
+    async def mint(payload, state):
+        calls.append("mint")
+        return {"result": {}}
+
+    queue.register("issue", [Stage("upload", upload), Stage("mint", mint)])
+    job, _ = asyncio.run(queue.submit("issue", {}))
+    stored = run_once(queue)
+    assert calls == []
+    assert (stored["status"], stored["stage"], stored["state"]) == (RUNNING, "upload", {})
+    assert stored["lease_owner"] == "other-worker"
+
+
+def test_save_progress_survives_a_failed_attempt(store):
+    queue = make_queue(store)
+    seen = []
+
+    async def send(payload, state):
+        seen.append(dict(state))
+        if "tx" not in state:
+            await queue.save_progress({"tx": "0xabc"})
+            raise Flaky("node went away")
+        return {"result": {"tx": state["tx"]}}
+
+    queue.register("issue", [Stage("send", send, RetryPolicy(base_delay=0))])
+    job, _ = asyncio.run(queue.submit("issue", {}))
+    stored = run_once(queue)
+    assert (stored["status"], stored["attempts"], stored["state"]) == (QUEUED, 1, {"tx": "0xabc"})
+    make_due(store)
+    stored = run_once(queue)
+    assert stored["status"] == SUCCEEDED
+    assert stored["result"] == {"tx": "0xabc"}
+    assert seen == [{}, {"tx": "0xabc"}]
+
+
+def test_save_progress_raises_after_the_lease_is_lost(store):
+    queue = make_queue(store)
+    after = []
+
+    async def send(payload, state):
+        take_over(store, job["id"])
+        await queue.save_progress({"tx": "0xabc"})
+        after.append("sent")
+        return {"result": {}}
+
+    queue.register("issue", [Stage("send", send)])
+    job, _ = asyncio.run(queue.submit("issue", {}))
+    stored = run_once(queue)
+    # The stage stopped before sending, and the new owner's row was left alone
+    assert after == []
+    assert (stored["status"], stored["attempts"], stored["state"]) == (RUNNING, 0, {})
+    assert stored["lease_owner"] == "other-worker"
+
+
+def test_retry_later_backs_off_then_fails(store):
+    queue = make_queue(store)
+
+    async def send(payload, state):
+        raise Flaky("node went away")
+
+    queue.register("issue", [Stage("send", send, RetryPolicy(max_attempts=3, base_delay=10, max_delay=15))])
+    job, _ = asyncio.run(queue.submit("issue", {}))
+
+    before = time.time()
+    stored = run_once(queue)
+    assert (stored["status"], stored["attempts"], stored["error"]) == (QUEUED, 1, "send: node went away")
+    assert 5 <= stored["next_run_at"] - before <= 10.5
+    # Not due yet
+    assert store.claim(queue.owner, 60) is None
+
+    make_due(store)
+    before = time.time()
+    stored = run_once(queue)
+    assert stored["attempts"] == 2
+    assert 7.5 <= stored["next_run_at"] - before <= 15.5
+
+    make_due(store)
+    stored = run_once(queue)
+    assert (stored["status"], stored["attempts"]) == (FAILED, 3)
+
+
+def test_permanent_error_fails_without_retrying(store):
+    queue = make_queue(store)
+
+    async def send(payload, state):
+        raise PermanentJobError("reverted")
+
+    queue.register("issue", [Stage("send", send)])
+    asyncio.run(queue.submit("issue", {}))
+    stored = run_once(queue)
+    assert (stored["status"], stored["attempts"], stored["error"]) == (FAILED, 1, "send: reverted")
+
+
+def test_idempotency_key_replays_the_same_job(store):
+    queue = make_queue(store)
+
+    async def mint(payload, state):
+        return {"result": {"token": 1}}
+
+    queue.register("issue", [Stage("mint", mint)])
+    first, created = asyncio.run(queue.submit("issue", {"n": 1}, idempotency_key="key-1"))
+    assert created
+    again, created = asyncio.run(queue.submit("issue", {"n": 2}, idempotency_key="key-1"))
+    assert (again["id"], created) == (first["id"], False)
+
+    run_once(queue)
+    # Still the same job once it has finished, with its result
+    replay, created = asyncio.run(queue.submit("issue", {"n": 3}, idempotency_key="key-1"))
+    assert (replay["id"], created, replay["result"]) == (first["id"], False, {"token": 1})
+
+
+def test_dedup_key_joins_unfinished_jobs_only(store):
+    queue = make_queue(store)
+
+    async def mint(payload, state):
+        return {"result": {"token": 1}}
+
+    queue.register("issue", [Stage("mint", mint)])
+    first, created = asyncio.run(queue.submit("issue", {}, dedup_key="alice:course"))
+    assert created
+    duplicate, created = asyncio.run(queue.submit("issue", {}, dedup_key="alice:course"))
+    assert (duplicate["id"], created) == (first["id"], False)
+
+    run_once(queue)
+    # A finished job no longer absorbs new requests with the same key
+    second, created = asyncio.run(queue.submit("issue", {}, dedup_key="alice:course"))
+    assert created and second["id"] != first["id"]
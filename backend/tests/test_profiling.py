@@ -0,0 +1,37 @@
+import time
+from utils import profiling
+from utils.profiling import ProfileCapture
+
+
+class BusyProfile:
+    """
+    cProfile.Profile as it behaves on Python 3.12+ while another profiler is active
+    """
+    def enable(self):
+        raise ValueError("Another profiling tool is already active")
+
+
+def test_run_tracked_runs_unprofiled_when_profiler_is_busy(monkeypatch):
+    capture = ProfileCapture("test", mode="cprofile")
+    monkeypatch.setattr(profiling.cProfile, "Profile", BusyProfile)
+    assert capture.run_tracked(lambda a, b: a + b, 2, 3) == 5
+    assert capture.profiles == []
+
+
+def test_sampling_skips_event_streams(monkeypatch):
+    monkeypatch.setattr(profiling.random, "random", lambda: 0.0)
+    middleware = profiling.ProfilingMiddleware(None, sample_rate=1.0)
+    assert middleware.wants_profile({"path": "/api/stats", "headers": []})
+    assert not middleware.wants_profile({"path": "/api/certificates/stream", "headers": []})
+    assert not middleware.wants_profile({"path": "/api/stats", "headers": [(b"accept", b"text/event-stream")]})
+
+
+def test_sampler_stops_after_max_seconds():
+    capture = ProfileCapture("test", mode="sample", interval_ms=1, max_seconds=0.05)
+    capture.start()
+    time.sleep(0.3)
+    recorded = sum(len(samples) for samples, _ in capture.samples.values())
+    time.sleep(0.1)
+    assert capture.truncated
+    assert sum(len(samples) for samples, _ in capture.samples.values()) == recorded
+    capture.stop()
@@ -0,0 +1,140 @@
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from utils.rpc_pool import RpcPool
+
+
+class StubNode:
+    """
+    Local JSON-RPC endpoint answering every method with a fixed result,
+    after an optional delay or with HTTP 503 when failing
+    """
+    def __init__(self, name, delay=0.0, failing=False):
+        self.name = name
+        self.delay = delay
+        self.failing = failing
+        self.calls = []
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                node.calls.append(request["method"])
+                time.sleep(node.delay)
+                if node.failing:
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = json.dumps({"jsonrpc": "2.0", "id": request["id"], "result": node.name}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def nodes():
+    started = []
+
+    def start(*args, **kwargs):
+        node = StubNode(*args, **kwargs)
+        started.append(node)
+        return node
+
+    yield start
+    for node in started:
+        node.close()
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(*nodes):
+        # No background health probes, so only the test's requests reach the nodes
+        pool = RpcPool([node.url for node in nodes], health_interval=0)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def test_slow_read_is_hedged_and_fastest_answer_wins(nodes, make_pool):
+    slow = nodes("slow", delay=1.0)
+    fast = nodes("fast")
+    pool = make_pool(slow, fast)
+
+    started = time.monotonic()
+    response = pool.request("eth_blockNumber")
+
+    assert response["result"] == "fast"
+    assert time.monotonic() - started < 0.8
+    assert pool.hedged_requests == 1
+    assert pool.hedge_wins == 1
+
+
+def test_fast_read_is_not_hedged(nodes, make_pool):
+    pool = make_pool(nodes("a"), nodes("b"))
+
+    assert pool.request("eth_blockNumber")["result"] == "a"
+    assert pool.hedged_requests == 0
+
+
+def test_failed_read_fails_over_to_next_endpoint(nodes, make_pool):
+    broken = nodes("broken", failing=True)
+    healthy = nodes("healthy")
+    pool = make_pool(broken, healthy)
+
+    assert pool.request("eth_call", [{}, "latest"])["result"] == "healthy"
+    assert pool.failovers == 1
+    assert broken.calls == ["eth_call"]
+
+
+def test_writes_stay_pinned_to_one_endpoint(nodes, make_pool):
+    first = nodes("first", delay=0.2)
+    second = nodes("second")
+    pool = make_pool(first, second)
+
+    for _ in range(3):
+        # Pinned even though the other endpoint answers faster, and never hedged
+        assert pool.request("eth_sendTransaction", [{}])["result"] == "first"
+    assert pool.request("eth_getTransactionCount", ["0x0", "pending"])["result"] == "first"
+    assert second.calls == []
+    assert pool.hedged_requests == 0
+
+
+def test_writes_move_when_pinned_endpoint_becomes_unhealthy(nodes, make_pool):
+    first = nodes("first")
+    second = nodes("second")
+    pool = make_pool(first, second)
+    assert pool.request("eth_sendTransaction", [{}])["result"] == "first"
+
+    first.failing = True
+    for endpoint in pool.endpoints[:1]:
+        for _ in range(3):
+            endpoint.record_failure()
+
+    assert pool.request("eth_sendTransaction", [{}])["result"] == "second"
+    assert pool.stats()["writeEndpoint"] == second.url
@@ -0,0 +1,53 @@
+import pytest
+
+from utils.contract import (
+    connect_contract, issue_certificate_function, sign_transaction, wait_for_receipt,
+    get_issued_token_id, TransactionReverted,
+)
+from utils.ipfs import get_ipfs_url
+from utils.simulator import Simulator, SimulatedChain, SIM_CONTRACT_ADDRESS, SIM_PRIVATE_KEY, cid_v0
+
+RECIPIENT = "0x70997970C51812dc3A010C7d01b50e0d17dc79C8"
+
+
+@pytest.fixture
+def contract():
+    chain = SimulatedChain(block_time=0, contract_mode="lean")
+    simulator = Simulator(rpc_latencies_ms=[0], rpc_error_rate=0, rpc_port=0, ipfs_port=0, chain=chain).start()
+    # Same connection the backend makes: pooled HTTP provider, locally signed transactions
+    yield connect_contract(simulator.rpc_urls, SIM_CONTRACT_ADDRESS, SIM_PRIVATE_KEY, "lean")
+    simulator.stop()
+
+
+def send(contract, function):
+    tx_hash, raw_transaction, nonce = sign_transaction(contract, function, SIM_PRIVATE_KEY)
+    assert contract.w3.eth.send_raw_transaction(raw_transaction) == tx_hash
+    return tx_hash
+
+
+def test_signed_lean_mint_revoke_and_nonce_reuse(contract):
+    token_uri = get_ipfs_url(cid_v0(b'{"name": "Certificate: Solidity"}'))
+    mint = issue_certificate_function(contract, RECIPIENT, "Alice", "Solidity", "Completed", token_uri)
+    tx_hash, raw_transaction, nonce = sign_transaction(contract, mint, SIM_PRIVATE_KEY)
+    assert nonce == 0
+    contract.w3.eth.send_raw_transaction(raw_transaction)
+
+    assert wait_for_receipt(contract, tx_hash).status == 1
+    token_id = get_issued_token_id(contract, tx_hash)
+    assert token_id == 1
+    # The lean contract rebuilds the CIDv0 URI from the stored digest
+    assert contract.functions.tokenURI(token_id).call() == token_uri
+    assert contract.functions.ownerOf(token_id).call() == RECIPIENT
+
+    wait_for_receipt(contract, send(contract, contract.functions.revokeCertificate(token_id)))
+    assert contract.functions.isValid(token_id).call() is False
+    with pytest.raises(TransactionReverted):
+        wait_for_receipt(contract, send(contract, contract.functions.revokeCertificate(token_id)))
+
+    # A different transaction signed with the mint's nonce is refused, as is the mint itself again
+    account = contract.w3.eth.account.from_key(SIM_PRIVATE_KEY)
+    reused = account.sign_transaction(mint.build_transaction({"from": account.address, "nonce": nonce, "gas": 200000}))
+    with pytest.raises(ValueError, match="nonce too low"):
+        contract.w3.eth.send_raw_transaction(reused.rawTransaction)
+    with pytest.raises(ValueError, match="already known"):
+        contract.w3.eth.send_raw_transaction(raw_transaction)
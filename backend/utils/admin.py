@@ -0,0 +1,30 @@
+import os
+import hmac
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+# Token for admin-only features (profiling, maintenance endpoints). They stay
+# disabled while this is empty.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+def is_admin_token(token) -> bool:
+    """
+    Check a token against ADMIN_TOKEN in constant time
+    """
+    if not ADMIN_TOKEN or not token:
+        return False
+    if isinstance(token, bytes):
+        token = token.decode("latin-1")
+    return hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """
+    FastAPI dependency guarding admin endpoints with the X-Admin-Token header
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set ADMIN_TOKEN to enable them")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
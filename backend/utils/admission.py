@@ -0,0 +1,221 @@
+import os
+import re
+import math
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from utils.profiling import track_thread
+
+# Per-client token bucket for write endpoints
+WRITE_RATE_PER_MINUTE = float(os.getenv("WRITE_RATE_PER_MINUTE", "30"))
+WRITE_BURST = int(os.getenv("WRITE_BURST", "10"))
+# Per-endpoint concurrency with a bounded wait queue
+WRITE_MAX_CONCURRENCY = int(os.getenv("WRITE_MAX_CONCURRENCY", "8"))
+WRITE_MAX_QUEUE = int(os.getenv("WRITE_MAX_QUEUE", "32"))
+WRITE_QUEUE_TIMEOUT = float(os.getenv("WRITE_QUEUE_TIMEOUT", "10"))
+# Per-stage caps on outbound work
+IPFS_MAX_CONCURRENCY = int(os.getenv("IPFS_MAX_CONCURRENCY", "4"))
+RPC_MAX_CONCURRENCY = int(os.getenv("RPC_MAX_CONCURRENCY", "16"))
+STAGE_TIMEOUT = float(os.getenv("STAGE_TIMEOUT", "30"))
+# Upper bound on tracked clients so the bucket table can't grow without limit
+MAX_TRACKED_CLIENTS = 10000
+# Comma-separated API keys trusted to identify a client; any other X-API-Key is ignored
+API_KEYS = {key.strip() for key in os.getenv("API_KEYS", "").split(",") if key.strip()}
+
+
+class Overloaded(HTTPException):
+    """
+    Request rejected because a limit was hit; carries a Retry-After hint
+    """
+    def __init__(self, status_code, detail, retry_after):
+        retry_after = max(1, int(math.ceil(retry_after)))
+        super().__init__(status_code=status_code, detail=detail,
+                         headers={"Retry-After": str(retry_after)})
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def take(self):
+        """
+        Take one token; returns 0 on success or the seconds until one is available
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60
+
+
+class ClientRateLimiter:
+    """
+    One token bucket per API client (a configured X-API-Key, falling back to the client IP)
+    """
+    def __init__(self, rate_per_minute=WRITE_RATE_PER_MINUTE, burst=WRITE_BURST):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.buckets = OrderedDict()
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def check(self, client):
+        with self.lock:
+            bucket = self.buckets.pop(client, None) or TokenBucket(self.rate, self.burst)
+            self.buckets[client] = bucket
+            if len(self.buckets) > MAX_TRACKED_CLIENTS:
+                self.buckets.popitem(last=False)
+            wait = bucket.take()
+            if wait:
+                self.rejected += 1
+        if wait:
+            raise Overloaded(429, "Rate limit exceeded, slow down", wait)
+
+    def stats(self):
+        return {"ratePerMinute": self.rate * 60, "burst": self.burst,
+                "trackedClients": len(self.buckets), "rejected": self.rejected}
+
+
+class ConcurrencyLimiter:
+    """
+    Caps concurrent requests; extra requests wait in a bounded queue for at most
+    queue_timeout seconds, anything beyond that is rejected with 503 straight away
+    """
+    def __init__(self, name, limit=WRITE_MAX_CONCURRENCY, max_queue=WRITE_MAX_QUEUE,
+                 queue_timeout=WRITE_QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        # Created on first use so it binds to the server's event loop
+        self.semaphore = None
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.service_ewma = None
+
+    def retry_after(self):
+        # Rough time until a slot frees up for a request joining the queue now
+        service = self.service_ewma or 1.0
+        return service * (self.waiting + 1) / max(1, self.limit)
+
+    async def acquire(self):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.limit)
+        # Counted here rather than read off the semaphore, so requests arriving in
+        # the same tick (before any of them holds a slot) still see each other
+        if self.active + self.waiting >= self.limit + self.max_queue:
+            self.rejected += 1
+            raise Overloaded(503, f"{self.name} is overloaded, try again later", self.retry_after())
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise Overloaded(503, f"{self.name} is overloaded, try again later", self.retry_after())
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.admitted += 1
+        return time.monotonic()
+
+    def release(self, started):
+        elapsed = time.monotonic() - started
+        self.service_ewma = elapsed if self.service_ewma is None else 0.8 * self.service_ewma + 0.2 * elapsed
+        self.active -= 1
+        self.semaphore.release()
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run a blocking call in the threadpool while holding a slot
+        """
+        started = await self.acquire()
+        try:
+            return await run_in_threadpool(track_thread(fn), *args, **kwargs)
+        finally:
+            self.release(started)
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "maxQueue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timedOut": self.timed_out,
+            "avgServiceSeconds": round(self.service_ewma, 3) if self.service_ewma is not None else None,
+        }
+
+
+# Outbound stages shared by every endpoint
+ipfs_stage = ConcurrencyLimiter("IPFS", IPFS_MAX_CONCURRENCY, max_queue=4 * IPFS_MAX_CONCURRENCY,
+                                queue_timeout=STAGE_TIMEOUT)
+rpc_stage = ConcurrencyLimiter("RPC", RPC_MAX_CONCURRENCY, max_queue=4 * RPC_MAX_CONCURRENCY,
+                               queue_timeout=STAGE_TIMEOUT)
+
+
+def get_client_id(scope):
+    """
+    Client identity for rate limits, shard pinning and statistics. Only keys
+    listed in API_KEYS are trusted, so a client can't dodge its rate limit or
+    pose as another issuer by sending made-up keys.
+    """
+    headers = dict(scope.get("headers") or [])
+    api_key = headers.get(b"x-api-key", b"").decode("latin-1")
+    if api_key in API_KEYS:
+        return "key:" + api_key
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware applying rate limits and concurrency limits to selected routes.
+
+    rules is a list of (method, path regex, ConcurrencyLimiter). Requests are
+    rejected before their body is read, so an overloaded server answers fast.
+    """
+    def __init__(self, app, rules, rate_limiter):
+        self.app = app
+        self.rules = [(method, re.compile(pattern), limiter) for method, pattern, limiter in rules]
+        self.rate_limiter = rate_limiter
+
+    def match(self, scope):
+        for method, pattern, limiter in self.rules:
+            if scope["method"] == method and pattern.fullmatch(scope["path"]):
+                return limiter
+        return None
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.match(scope) if scope["type"] == "http" else None
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            self.rate_limiter.check(get_client_id(scope))
+            started = await limiter.acquire()
+        except Overloaded as e:
+            response = JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(started)
@@ -1,15 +1,41 @@
 import json
 import os
 from web3 import Web3
+from web3.exceptions import TransactionNotFound, ContractLogicError
+from web3.middleware import construct_sign_and_send_raw_middleware
 import random
 import time
 from datetime import datetime
 import traceback
+import threading
 
-# Mock storage for certificates
-mock_certificates = {}
-mock_token_uris = {}
-mock_token_counter = 0  # Will increment to 1 on first use
+from utils.rpc_pool import get_rpc_pool, PooledHTTPProvider
+from utils.events import publish_certificate_event
+
+# Chain ID and address reported for the mock contract
+MOCK_CHAIN_ID = 1337
+MOCK_CONTRACT_ADDRESS = "0x5FbDB2315678afecb367f032d93F642f64180aa3"
+
+class MockLedger:
+    """
+    In-memory storage behind a MockContract, one per shard
+    """
+    def __init__(self):
+        self.certificates = {}
+        self.token_uris = {}
+        self.token_counter = 0  # Will increment to 1 on first use
+        self.transactions = {}  # tx hash -> token ID, stands in for receipts
+        self.lock = threading.Lock()  # transactions may run in threadpool workers
+
+# Mock storage for certificates, by shard name
+mock_ledgers = {}
+mock_ledgers_lock = threading.Lock()
+
+def get_mock_ledger(name="default"):
+    with mock_ledgers_lock:
+        if name not in mock_ledgers:
+            mock_ledgers[name] = MockLedger()
+        return mock_ledgers[name]
 
 # Load environment variables
 try:
@@ -28,37 +54,73 @@ USE_MOCK_CONTRACT = os.getenv("USE_MOCK_CONTRACT", "True").lower() in ("true", "
 NETWORK_RPC_URL = os.getenv("NETWORK_RPC_URL", "http://localhost:8545")
 CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS", "")
 PRIVATE_KEY = os.getenv("PRIVATE_KEY", "")
+# Comma-separated list of RPC endpoints; when unset NETWORK_RPC_URL is used alone
+NETWORK_RPC_URLS = os.getenv("NETWORK_RPC_URLS", "")
+# Set to False in production so a broken network raises instead of silently using MockContract
+ALLOW_MOCK_FALLBACK = os.getenv("ALLOW_MOCK_FALLBACK", "False").lower() in ("true", "1", "t", "yes")
+# "full" (CertificateNFT) or "lean" (CertificateNFTLean, only a metadata digest is stored on-chain)
+CONTRACT_MODE = os.getenv("CONTRACT_MODE", "full")
 
 # Path to contract ABI file (adjust as needed)
 CONTRACT_ABI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
                                 "../frontend/src/artifacts/contracts/CertificateNFT.sol/CertificateNFT.json")
+LEAN_CONTRACT_ABI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      "../frontend/src/artifacts/contracts/CertificateNFTLean.sol/CertificateNFTLean.json")
 
-def get_web3():
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+def reload_settings():
+    """
+    Re-read the contract settings from the environment (the settings page updates it)
+    """
+    global USE_MOCK_CONTRACT, NETWORK_RPC_URL, NETWORK_RPC_URLS, CONTRACT_ADDRESS, PRIVATE_KEY, ALLOW_MOCK_FALLBACK
+    global CONTRACT_MODE
+    USE_MOCK_CONTRACT = os.getenv("USE_MOCK_CONTRACT", "True").lower() in ("true", "1", "t", "yes")
+    NETWORK_RPC_URL = os.getenv("NETWORK_RPC_URL", "http://localhost:8545")
+    NETWORK_RPC_URLS = os.getenv("NETWORK_RPC_URLS", "")
+    CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS", "")
+    PRIVATE_KEY = os.getenv("PRIVATE_KEY", "")
+    ALLOW_MOCK_FALLBACK = os.getenv("ALLOW_MOCK_FALLBACK", "False").lower() in ("true", "1", "t", "yes")
+    CONTRACT_MODE = os.getenv("CONTRACT_MODE", "full")
+
+def get_rpc_urls():
+    """
+    Get the list of HTTP RPC endpoints to pool
+    """
+    urls = [url.strip() for url in NETWORK_RPC_URLS.split(",") if url.strip()]
+    return urls or [NETWORK_RPC_URL]
+
+def get_web3(rpc_urls=None):
     """
     Get a Web3 instance connected to the specified network
     """
+    rpc_urls = rpc_urls or get_rpc_urls()
     try:
         # Create a web3 connection - Use the WebsocketProvider if the URL starts with ws://
-        if NETWORK_RPC_URL.startswith('ws'):
-            return Web3(Web3.WebsocketProvider(NETWORK_RPC_URL))
+        if rpc_urls[0].startswith('ws'):
+            return Web3(Web3.WebsocketProvider(rpc_urls[0]))
         else:
-            return Web3(Web3.HTTPProvider(NETWORK_RPC_URL))
+            # HTTP endpoints go through the shared pool for failover and hedged reads
+            return Web3(PooledHTTPProvider(get_rpc_pool(rpc_urls)))
     except Exception as e:
         print(f"Web3 connection error: {str(e)}")
         traceback.print_exc()
         return None
 
-def get_contract_abi():
+def get_contract_abi(mode="full"):
     """
-    Get the contract ABI from the compiled contract
+    Get the contract ABI from the compiled contract ("full" or "lean")
     """
+    abi_path = LEAN_CONTRACT_ABI_PATH if mode == "lean" else CONTRACT_ABI_PATH
     try:
-        with open(CONTRACT_ABI_PATH, 'r') as f:
+        with open(abi_path, 'r') as f:
             contract_json = json.load(f)
             return contract_json["abi"]
     except Exception as e:
-        print(f"Error loading contract ABI from {CONTRACT_ABI_PATH}: {str(e)}")
+        print(f"Error loading contract ABI from {abi_path}: {str(e)}")
         traceback.print_exc()
+        if mode == "lean":
+            return LEAN_CONTRACT_ABI
         # Return a minimal ABI for development
         return [
             {
@@ -74,15 +136,49 @@ def get_contract_abi():
                 "stateMutability": "nonpayable",
                 "type": "function"
             },
+            {
+                "inputs": [
+                    {"internalType": "uint256", "name": "tokenId", "type": "uint256"},
+                    {"internalType": "string", "name": "recipientName", "type": "string"},
+                    {"internalType": "string", "name": "courseName", "type": "string"},
+                    {"internalType": "string", "name": "description", "type": "string"},
+                    {"internalType": "string", "name": "tokenURI", "type": "string"}
+                ],
+                "name": "updateCertificate",
+                "outputs": [],
+                "stateMutability": "nonpayable",
+                "type": "function"
+            },
+            {
+                "inputs": [{"internalType": "uint256", "name": "tokenId", "type": "uint256"}],
+                "name": "revokeCertificate",
+                "outputs": [],
+                "stateMutability": "nonpayable",
+                "type": "function"
+            },
+            {
+                "inputs": [{"internalType": "uint256", "name": "tokenId", "type": "uint256"}],
+                "name": "isValid",
+                "outputs": [{"internalType": "bool", "name": "", "type": "bool"}],
+                "stateMutability": "view",
+                "type": "function"
+            },
             {
                 "inputs": [{"internalType": "uint256", "name": "tokenId", "type": "uint256"}],
                 "name": "getCertificateDetails",
                 "outputs": [
-                    {"internalType": "string", "name": "", "type": "string"},
-                    {"internalType": "string", "name": "", "type": "string"},
-                    {"internalType": "uint256", "name": "", "type": "uint256"},
-                    {"internalType": "string", "name": "", "type": "string"},
-                    {"internalType": "bool", "name": "", "type": "bool"}
+                    {
+                        "components": [
+                            {"internalType": "string", "name": "recipientName", "type": "string"},
+                            {"internalType": "string", "name": "courseName", "type": "string"},
+                            {"internalType": "uint256", "name": "issueDate", "type": "uint256"},
+                            {"internalType": "string", "name": "description", "type": "string"},
+                            {"internalType": "bool", "name": "revoked", "type": "bool"}
+                        ],
+                        "internalType": "struct CertificateNFT.CertificateDetails",
+                        "name": "",
+                        "type": "tuple"
+                    }
                 ],
                 "stateMutability": "view",
                 "type": "function"
@@ -100,62 +196,216 @@ def get_contract_abi():
                 "outputs": [{"internalType": "address", "name": "", "type": "address"}],
                 "stateMutability": "view",
                 "type": "function"
+            },
+            {
+                "anonymous": False,
+                "inputs": [
+                    {"indexed": True, "internalType": "uint256", "name": "tokenId", "type": "uint256"},
+                    {"indexed": True, "internalType": "address", "name": "recipient", "type": "address"},
+                    {"indexed": False, "internalType": "string", "name": "recipientName", "type": "string"},
+                    {"indexed": False, "internalType": "string", "name": "courseName", "type": "string"},
+                    {"indexed": False, "internalType": "uint256", "name": "issueDate", "type": "uint256"}
+                ],
+                "name": "CertificateIssued",
+                "type": "event"
+            },
+            {
+                "anonymous": False,
+                "inputs": [{"indexed": True, "internalType": "uint256", "name": "tokenId", "type": "uint256"}],
+                "name": "CertificateUpdated",
+                "type": "event"
+            },
+            {
+                "anonymous": False,
+                "inputs": [{"indexed": True, "internalType": "uint256", "name": "tokenId", "type": "uint256"}],
+                "name": "CertificateRevoked",
+                "type": "event"
             }
         ]
 
+# Minimal CertificateNFTLean ABI for development, used when the compiled contract is missing
+LEAN_CONTRACT_ABI = [
+    {
+        "inputs": [
+            {"internalType": "address", "name": "to", "type": "address"},
+            {"internalType": "bytes32", "name": "metadataDigest", "type": "bytes32"}
+        ],
+        "name": "issueCertificate",
+        "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [
+            {"internalType": "uint256", "name": "tokenId", "type": "uint256"},
+            {"internalType": "bytes32", "name": "metadataDigest", "type": "bytes32"}
+        ],
+        "name": "updateCertificate",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [{"internalType": "uint256", "name": "tokenId", "type": "uint256"}],
+        "name": "revokeCertificate",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [{"internalType": "uint256", "name": "tokenId", "type": "uint256"}],
+        "name": "isValid",
+        "outputs": [{"internalType": "bool", "name": "", "type": "bool"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [{"internalType": "uint256", "name": "tokenId", "type": "uint256"}],
+        "name": "getCertificateDetails",
+        "outputs": [
+            {
+                "components": [
+                    {"internalType": "bytes32", "name": "metadataDigest", "type": "bytes32"},
+                    {"internalType": "uint64", "name": "issueDate", "type": "uint64"},
+                    {"internalType": "bool", "name": "revoked", "type": "bool"}
+                ],
+                "internalType": "struct CertificateNFTLean.CertificateDetails",
+                "name": "",
+                "type": "tuple"
+            }
+        ],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [{"internalType": "uint256", "name": "tokenId", "type": "uint256"}],
+        "name": "tokenURI",
+        "outputs": [{"internalType": "string", "name": "", "type": "string"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [{"internalType": "uint256", "name": "tokenId", "type": "uint256"}],
+        "name": "ownerOf",
+        "outputs": [{"internalType": "address", "name": "", "type": "address"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": True, "internalType": "uint256", "name": "tokenId", "type": "uint256"},
+            {"indexed": True, "internalType": "address", "name": "recipient", "type": "address"},
+            {"indexed": False, "internalType": "bytes32", "name": "metadataDigest", "type": "bytes32"},
+            {"indexed": False, "internalType": "uint256", "name": "issueDate", "type": "uint256"}
+        ],
+        "name": "CertificateIssued",
+        "type": "event"
+    },
+    {
+        "anonymous": False,
+        "inputs": [{"indexed": True, "internalType": "uint256", "name": "tokenId", "type": "uint256"}],
+        "name": "CertificateUpdated",
+        "type": "event"
+    },
+    {
+        "anonymous": False,
+        "inputs": [{"indexed": True, "internalType": "uint256", "name": "tokenId", "type": "uint256"}],
+        "name": "CertificateRevoked",
+        "type": "event"
+    }
+]
+
 def get_contract_address():
     """
     Get the contract address from environment or config
     """
     return CONTRACT_ADDRESS
 
+def certificate_id(chain_id, contract_address, token_id):
+    """
+    Globally unique certificate ID: chain:contract:token
+    """
+    return f"{chain_id}:{contract_address.lower()}:{token_id}"
+
+def parse_certificate_id(value):
+    """
+    Split a chain:contract:token ID into (chain ID, lowercase address, token ID).
+    Raises ValueError for anything else.
+    """
+    parts = str(value).split(":")
+    if len(parts) != 3 or not Web3.is_address(parts[1]):
+        raise ValueError(f"Invalid certificate ID: {value}")
+    return int(parts[0]), parts[1].lower(), int(parts[2])
+
 class MockContract:
     """
     Mock contract for development when real blockchain is not available
     """
-    def __init__(self):
+    def __init__(self, ledger=None, address=MOCK_CONTRACT_ADDRESS, chain_id=MOCK_CHAIN_ID):
         self.functions = self
+        self.ledger = ledger or get_mock_ledger()
+        self.address = address
+        self.chain_id = chain_id
+    
+    def certificate_id(self, token_id):
+        return certificate_id(self.chain_id, self.address, token_id)
         
     def issueCertificate(self, to, recipientName, courseName, description, tokenURI):
-        global mock_token_counter
+        ledger = self.ledger
+        contract = self
         
         class Transactor:
             def transact(self_tx):
-                global mock_token_counter
-                mock_token_counter += 1  # Increment first, so we start from 1
-                token_id = mock_token_counter
-                
-                # Store certificate data
-                mock_certificates[token_id] = {
-                    "recipientName": recipientName,
-                    "courseName": courseName,
-                    "issueDate": int(time.time()),  # Use current time
-                    "description": description,
-                    "revoked": False,
-                    "owner": to
-                }
-                
-                # Store token URI
-                mock_token_uris[token_id] = tokenURI
+                with ledger.lock:
+                    ledger.token_counter += 1  # Increment first, so we start from 1
+                    token_id = ledger.token_counter
+                    
+                    # Store certificate data
+                    ledger.certificates[token_id] = {
+                        "recipientName": recipientName,
+                        "courseName": courseName,
+                        "issueDate": int(time.time()),  # Use current time
+                        "description": description,
+                        "revoked": False,
+                        "owner": to
+                    }
+                    
+                    # Store token URI
+                    ledger.token_uris[token_id] = tokenURI
                 
                 print(f"Mock certificate created with ID: {token_id}")
-                print(f"Mock certificates available: {list(mock_certificates.keys())}")
+                print(f"Mock certificates available: {list(ledger.certificates.keys())}")
                 
                 # Return a mock transaction hash
-                return Web3.to_bytes(hexstr=f"0x{''.join(random.choices('0123456789abcdef', k=64))}")
+                tx_hash = Web3.to_bytes(hexstr=f"0x{''.join(random.choices('0123456789abcdef', k=64))}")
+                ledger.transactions[tx_hash] = token_id
+                publish_certificate_event(
+                    "issued",
+                    token_id,
+                    certificate_id=contract.certificate_id(token_id),
+                    recipient=to,
+                    recipientName=recipientName,
+                    courseName=courseName,
+                    issueDate=ledger.certificates[token_id]["issueDate"],
+                    transactionHash=tx_hash.hex()
+                )
+                return tx_hash
                 
         return Transactor()
     
     def getCertificateDetails(self, token_id):
+        ledger = self.ledger
+        
         class Caller:
             def call(self):
                 print(f"Getting mock certificate details for ID: {token_id}")
-                print(f"Available certificates: {list(mock_certificates.keys())}")
+                print(f"Available certificates: {list(ledger.certificates.keys())}")
                 
-                if token_id not in mock_certificates:
+                if token_id not in ledger.certificates:
                     raise Exception(f"Certificate with ID {token_id} does not exist")
                     
-                cert = mock_certificates[token_id]
+                cert = ledger.certificates[token_id]
                 return [
                     cert["recipientName"],
                     cert["courseName"],
@@ -167,34 +417,44 @@ class MockContract:
         return Caller()
     
     def ownerOf(self, token_id):
+        ledger = self.ledger
+        
         class Caller:
             def call(self):
-                if token_id not in mock_certificates:
+                if token_id not in ledger.certificates:
                     raise Exception(f"Certificate with ID {token_id} does not exist")
                 
-                return mock_certificates[token_id]["owner"]
+                return ledger.certificates[token_id]["owner"]
                 
         return Caller()
     
     def tokenURI(self, token_id):
+        ledger = self.ledger
+        
         class Caller:
             def call(self):
-                if token_id not in mock_token_uris:
+                if token_id not in ledger.token_uris:
                     raise Exception(f"Token URI for ID {token_id} does not exist")
                 
-                return mock_token_uris[token_id]
+                return ledger.token_uris[token_id]
                 
         return Caller()
     
     def updateCertificate(self, token_id, recipientName, courseName, description, tokenURI):
+        ledger = self.ledger
+        contract = self
+        
         class Transactor:
             def transact(self_tx):
-                if token_id not in mock_certificates:
+                if token_id not in ledger.certificates:
                     raise Exception(f"Certificate with ID {token_id} does not exist")
+                if ledger.certificates[token_id]["revoked"]:
+                    # Same revert as the contract's require()
+                    raise ContractLogicError("execution reverted: Certificate is revoked")
                 
                 # Update certificate data
-                mock_certificates[token_id] = {
-                    **mock_certificates[token_id],
+                ledger.certificates[token_id] = {
+                    **ledger.certificates[token_id],
                     "recipientName": recipientName,
                     "courseName": courseName,
                     "description": description,
@@ -202,58 +462,68 @@ class MockContract:
                 
                 # Update token URI if provided
                 if tokenURI:
-                    mock_token_uris[token_id] = tokenURI
+                    ledger.token_uris[token_id] = tokenURI
                     
                 # Return a mock transaction hash
-                return Web3.to_bytes(hexstr=f"0x{''.join(random.choices('0123456789abcdef', k=64))}")
+                tx_hash = Web3.to_bytes(hexstr=f"0x{''.join(random.choices('0123456789abcdef', k=64))}")
+                publish_certificate_event("updated", token_id, certificate_id=contract.certificate_id(token_id),
+                                          transactionHash=tx_hash.hex())
+                return tx_hash
                 
         return Transactor()
         
     def revokeCertificate(self, token_id):
+        ledger = self.ledger
+        contract = self
+        
         class Transactor:
             def transact(self_tx):
-                if token_id not in mock_certificates:
+                if token_id not in ledger.certificates:
                     raise Exception(f"Certificate with ID {token_id} does not exist")
+                if ledger.certificates[token_id]["revoked"]:
+                    raise ContractLogicError("execution reverted: Certificate already revoked")
                 
                 # Mark certificate as revoked
-                mock_certificates[token_id]["revoked"] = True
+                ledger.certificates[token_id]["revoked"] = True
                 
                 # Return a mock transaction hash
-                return Web3.to_bytes(hexstr=f"0x{''.join(random.choices('0123456789abcdef', k=64))}")
+                tx_hash = Web3.to_bytes(hexstr=f"0x{''.join(random.choices('0123456789abcdef', k=64))}")
+                publish_certificate_event("revoked", token_id, certificate_id=contract.certificate_id(token_id),
+                                          transactionHash=tx_hash.hex())
+                return tx_hash
                 
         return Transactor()
 
-def get_contract():
+def fallback_to_mock(reason, **mock_options):
     """
-    Get a contract instance with the current account set as the default account
+    Return a MockContract after a connection problem, or raise if fallback is disabled
     """
-    # Reload settings from env to ensure latest values are used
-    global USE_MOCK_CONTRACT, NETWORK_RPC_URL, CONTRACT_ADDRESS, PRIVATE_KEY
-    USE_MOCK_CONTRACT = os.getenv("USE_MOCK_CONTRACT", "True").lower() in ("true", "1", "t", "yes")
-    NETWORK_RPC_URL = os.getenv("NETWORK_RPC_URL", "http://localhost:8545")
-    CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS", "")
-    PRIVATE_KEY = os.getenv("PRIVATE_KEY", "")
-    
-    if USE_MOCK_CONTRACT:
-        print("Using mock contract...")
-        return MockContract()
-        
-    web3 = get_web3()
+    if not ALLOW_MOCK_FALLBACK:
+        raise RuntimeError(f"{reason} (mock fallback disabled)")
+    print(f"{reason}. Using mock contract...")
+    return MockContract(**mock_options)
+
+def connect_contract(rpc_urls, contract_address, private_key="", contract_mode="full", **mock_options):
+    """
+    Connect to a deployed contract with the signer's account as the default
+    account. mock_options are passed on to the MockContract used as fallback.
+    """
+    web3 = get_web3(rpc_urls)
     if web3 is None:
-        print("Web3 connection failed. Using mock contract...")
-        return MockContract()
+        return fallback_to_mock("Web3 connection failed", **mock_options)
     
     # Check connection
     try:
         print(f"Connected to network with chain ID: {web3.eth.chain_id}")
     except Exception as e:
-        print(f"Error connecting to network: {str(e)}")
-        return MockContract()
+        return fallback_to_mock(f"Error connecting to network: {str(e)}", **mock_options)
     
     # Set up the account to use for transactions
     try:
-        if PRIVATE_KEY:
-            account = web3.eth.account.from_key(PRIVATE_KEY)
+        if private_key:
+            account = web3.eth.account.from_key(private_key)
+            # Sign locally and send raw transactions, the node doesn't know this key
+            web3.middleware_onion.add(construct_sign_and_send_raw_middleware(account))
             web3.eth.default_account = account.address
             print(f"Using account from private key: {account.address}")
         else:
@@ -261,24 +531,196 @@ def get_contract():
             web3.eth.default_account = web3.eth.accounts[0]
             print(f"Using first available account: {web3.eth.default_account}")
     except Exception as e:
-        print(f"Failed to set default account: {str(e)}")
-        return MockContract()
+        return fallback_to_mock(f"Failed to set default account: {str(e)}", **mock_options)
     
     # Get the contract
-    contract_address = get_contract_address()
     if not contract_address or not web3.is_address(contract_address):
-        print(f"Invalid contract address: {contract_address}. Using mock contract...")
-        return MockContract()
+        return fallback_to_mock(f"Invalid contract address: {contract_address}", **mock_options)
     
     try:
-        abi = get_contract_abi()
-        contract = web3.eth.contract(address=contract_address, abi=abi)
+        abi = get_contract_abi(contract_mode)
+        contract = web3.eth.contract(address=Web3.to_checksum_address(contract_address), abi=abi)
         print(f"Successfully loaded contract at {contract_address}")
         return contract
     except Exception as e:
-        print(f"Error creating contract instance: {str(e)}")
         traceback.print_exc()
-        return MockContract()
+        return fallback_to_mock(f"Error creating contract instance: {str(e)}", **mock_options)
+
+def get_contract():
+    """
+    Get the contract of the default shard (the CONTRACT_ADDRESS deployment
+    unless SHARDS says otherwise)
+    """
+    from utils.shards import get_shard_registry
+    
+    return get_shard_registry().default.get_contract()
+
+class TransactionReverted(Exception):
+    """
+    Raised when a transaction was mined but reverted (receipt status 0), or had no effect
+    """
+    pass
+
+def wait_for_receipt(contract, tx_hash):
+    """
+    Wait for a transaction to be mined; mock transactions are final immediately.
+    Raises TransactionReverted if the transaction was mined but reverted.
+    """
+    if isinstance(contract, MockContract):
+        return None
+    receipt = contract.w3.eth.wait_for_transaction_receipt(tx_hash)
+    if receipt.status == 0:
+        raise TransactionReverted(f"Transaction {tx_hash.hex()} reverted")
+    return receipt
+
+class TransactionDropped(Exception):
+    """
+    Raised when a signed transaction can no longer be mined because its nonce was used by another one
+    """
+    pass
+
+def sign_transaction(contract, function, private_key):
+    """
+    Build and sign a contract call with the signer's pending nonce. Returns
+    (tx_hash, raw_transaction, nonce), so the hash is known before anything is
+    sent, or None when the node holds the account (no private key) or the
+    contract is a mock.
+    """
+    if isinstance(contract, MockContract) or not private_key:
+        return None
+    web3 = contract.w3
+    account = web3.eth.account.from_key(private_key)
+    nonce = web3.eth.get_transaction_count(account.address, "pending")
+    transaction = function.build_transaction({"from": account.address, "nonce": nonce})
+    signed = account.sign_transaction(transaction)
+    return signed.hash, signed.rawTransaction, nonce
+
+def resend_transaction(contract, tx_hash, raw_transaction, nonce):
+    """
+    Send a signed transaction again after an interrupted attempt, unless the
+    node already has it. The resent copy has the same nonce, so at most one
+    of them is ever mined.
+    """
+    web3 = contract.w3
+    try:
+        web3.eth.get_transaction(tx_hash)
+        return
+    except TransactionNotFound:
+        pass
+    try:
+        web3.eth.send_raw_transaction(raw_transaction)
+    except ValueError as e:
+        try:
+            # Arrived at the node in the meantime
+            web3.eth.get_transaction(tx_hash)
+            return
+        except TransactionNotFound:
+            pass
+        sender = web3.eth.account.recover_transaction(raw_transaction)
+        if web3.eth.get_transaction_count(sender) > nonce:
+            raise TransactionDropped(f"Nonce {nonce} of transaction {tx_hash.hex()} was used by another transaction")
+        raise
+
+def get_issued_token_id(contract, tx_hash):
+    """
+    Get the token ID minted by an issueCertificate transaction. Raises
+    TransactionReverted if it reverted or minted nothing.
+    """
+    if isinstance(contract, MockContract):
+        return contract.ledger.transactions[tx_hash]
+    receipt = wait_for_receipt(contract, tx_hash)
+    events = contract.events.CertificateIssued().process_receipt(receipt)
+    if not events:
+        raise TransactionReverted(f"No CertificateIssued event in transaction {tx_hash.hex()}")
+    return events[0]["args"]["tokenId"]
+
+def is_lean_contract(contract):
+    """
+    Whether a contract is a CertificateNFTLean deployment (mock contracts never are)
+    """
+    if isinstance(contract, MockContract):
+        return False
+    return any(
+        item.get("type") == "function" and item.get("name") == "issueCertificate" and len(item["inputs"]) == 2
+        for item in contract.abi
+    )
+
+def is_revoked(contract, token_id):
+    """
+    Whether a certificate is revoked (blocking); the flag is the last detail in both layouts
+    """
+    return contract.functions.getCertificateDetails(token_id).call()[-1]
+
+def metadata_digest(token_uri):
+    """
+    The 32-byte digest a lean contract stores for an ipfs://Qm... token URI.
+    Raises ValueError for anything but a CIDv0, which the lean contract can't represent.
+    """
+    cid = token_uri.split("ipfs://", 1)[-1].split("/ipfs/", 1)[-1]
+    if len(cid) != 46 or not cid.startswith("Qm") or any(char not in BASE58_ALPHABET for char in cid):
+        raise ValueError(f"Lean contracts need an IPFS CIDv0 token URI, got {token_uri}")
+    number = 0
+    for char in cid:
+        number = number * 58 + BASE58_ALPHABET.index(char)
+    multihash = number.to_bytes(34, "big")
+    if multihash[:2] != b"\x12\x20":
+        raise ValueError(f"Unsupported multihash in {token_uri}")
+    return multihash[2:]
+
+def issue_certificate_function(contract, to, recipient_name, course_name, description, token_uri):
+    """
+    The issueCertificate call for the contract's layout, ready to transact
+    """
+    if is_lean_contract(contract):
+        return contract.functions.issueCertificate(to, metadata_digest(token_uri))
+    return contract.functions.issueCertificate(to, recipient_name, course_name, description, token_uri)
+
+def update_certificate_function(contract, token_id, recipient_name, course_name, description, token_uri):
+    """
+    The updateCertificate call for the contract's layout, ready to transact
+    """
+    if is_lean_contract(contract):
+        return contract.functions.updateCertificate(token_id, metadata_digest(token_uri))
+    return contract.functions.updateCertificate(token_id, recipient_name, course_name, description, token_uri)
+
+def fetch_certificate(contract, token_id, block_identifier="latest"):
+    """
+    Read a certificate's details, owner and token URI at the given block.
+    Lean contracts leave recipient_name, course_name and description empty,
+    they are filled in from the metadata.
+    """
+    # MockContract has no history, it always answers with the current state
+    call_kwargs = {} if isinstance(contract, MockContract) else {"block_identifier": block_identifier}
+    certificate = contract.functions.getCertificateDetails(token_id).call(**call_kwargs)
+    owner = contract.functions.ownerOf(token_id).call(**call_kwargs)
+    token_uri = contract.functions.tokenURI(token_id).call(**call_kwargs)
+    
+    if is_lean_contract(contract):
+        digest, issued_at, revoked = certificate
+        return {
+            "id": token_id,
+            "recipient_name": "",
+            "course_name": "",
+            "issue_date": datetime.fromtimestamp(issued_at).strftime("%Y-%m-%d"),
+            "issued_at": issued_at,
+            "description": "",
+            "revoked": revoked,
+            "owner": owner,
+            "token_uri": token_uri,
+            "metadata_digest": "0x" + bytes(digest).hex()
+        }
+    
+    return {
+        "id": token_id,
+        "recipient_name": certificate[0],
+        "course_name": certificate[1],
+        "issue_date": datetime.fromtimestamp(certificate[2]).strftime("%Y-%m-%d"),
+        "issued_at": certificate[2],
+        "description": certificate[3],
+        "revoked": certificate[4],
+        "owner": owner,
+        "token_uri": token_uri
+    }
 
 def deploy_contract():
     """
@@ -301,7 +743,7 @@ def deploy_contract():
     
     # Load the contract ABI and bytecode
     try:
-        with open(CONTRACT_ABI_PATH, 'r') as f:
+        with open(LEAN_CONTRACT_ABI_PATH if CONTRACT_MODE == "lean" else CONTRACT_ABI_PATH, 'r') as f:
             contract_json = json.load(f)
             contract_abi = contract_json["abi"]
             contract_bytecode = contract_json["bytecode"]
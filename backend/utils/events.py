@@ -0,0 +1,294 @@
+import os
+import asyncio
+import threading
+import time
+import traceback
+from collections import deque
+
+from web3 import Web3
+
+# How many past events are kept so reconnecting clients can resume
+EVENT_HISTORY_SIZE = int(os.getenv("EVENT_HISTORY_SIZE", "1000"))
+# Per-client buffer; a client that falls this far behind is disconnected and resumes later
+EVENT_CLIENT_QUEUE_SIZE = int(os.getenv("EVENT_CLIENT_QUEUE_SIZE", "256"))
+# Seconds between new-block checks when watching a real chain
+EVENT_POLL_INTERVAL = float(os.getenv("EVENT_POLL_INTERVAL", "2"))
+
+# Contract events and the feed event type each one maps to
+CHAIN_EVENTS = {
+    "CertificateIssued": "issued",
+    "CertificateUpdated": "updated",
+    "CertificateRevoked": "revoked",
+}
+
+
+class EventSubscription:
+    """
+    A single client's view of the feed
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=EVENT_CLIENT_QUEUE_SIZE)
+        self.overflowed = False
+        # Highest event id already sent from history, to skip duplicates in the queue
+        self.replayed_until = 0
+
+    def deliver(self, event):
+        # Runs on the subscriber's event loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class CertificateEventBroker:
+    """
+    Fans certificate events out to any number of clients.
+
+    Events are published once (by MockContract or by the single chain watcher)
+    and appended to a bounded history, so clients reconnecting with a
+    Last-Event-ID only receive what they missed.
+    """
+    def __init__(self, history_size=EVENT_HISTORY_SIZE):
+        self.history = deque(maxlen=history_size)
+        self.last_id = 0
+        self.subscriptions = set()
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.watcher = None
+
+    def publish(self, event_type, token_id, certificate_id=None, **data):
+        """
+        Record an event and push it to every subscriber (safe to call from any thread).
+        certificate_id is the global chain:contract:token ID of the certificate.
+        """
+        with self.lock:
+            self.last_id += 1
+            event = {
+                "id": self.last_id,
+                "type": event_type,
+                "tokenId": token_id,
+                "certificateId": certificate_id if certificate_id is not None else str(token_id),
+                "timestamp": int(time.time()),
+                "data": data,
+            }
+            self.history.append(event)
+            subscriptions = list(self.subscriptions)
+            listeners = list(self.listeners)
+
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # Subscriber's loop is closed
+                self.unsubscribe(subscription)
+
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"Event listener error: {str(e)}")
+                traceback.print_exc()
+        return event
+
+    def add_listener(self, listener):
+        """
+        Register a synchronous callback invoked for every published event
+        """
+        with self.lock:
+            self.listeners.append(listener)
+
+    def events_since(self, last_event_id):
+        """
+        Events after last_event_id, or None when the history no longer covers it
+        """
+        with self.lock:
+            if last_event_id > self.last_id:
+                # Id from before a restart
+                return None
+            events = [event for event in self.history if event["id"] > last_event_id]
+            oldest = self.history[0]["id"] if self.history else self.last_id + 1
+        if last_event_id < oldest - 1:
+            return None
+        return events
+
+    def subscribe(self, last_event_id=None):
+        """
+        Register a client and return (subscription, backlog).
+
+        backlog is the list of missed events to replay first, or None when the
+        client asked to resume from an id that is no longer available.
+        """
+        subscription = EventSubscription(asyncio.get_running_loop())
+        with self.lock:
+            self.subscriptions.add(subscription)
+        backlog = [] if last_event_id is None else self.events_since(last_event_id)
+        if backlog is None:
+            # The client reloads everything on reset; stream whatever comes after it.
+            # Its own id may be from before a restart and larger than anything we'll publish.
+            with self.lock:
+                subscription.replayed_until = self.last_id
+        elif backlog:
+            # Anything published while we were collecting the backlog is also queued
+            subscription.replayed_until = backlog[-1]["id"]
+        elif last_event_id:
+            subscription.replayed_until = last_event_id
+        self.ensure_watcher()
+        return subscription, backlog
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    async def stream(self, last_event_id=None, heartbeat=15):
+        """
+        Async generator of events for one client; yields None as a heartbeat.
+
+        A {"type": "reset"} event is yielded first when the client has to reload
+        its full list because the requested resume point is gone.
+        """
+        subscription, backlog = self.subscribe(last_event_id)
+        try:
+            if backlog is None:
+                yield {"id": subscription.replayed_until, "type": "reset", "tokenId": None,
+                       "timestamp": int(time.time()), "data": {}}
+            else:
+                for event in backlog:
+                    yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if subscription.overflowed:
+                    # Client can't keep up; it reconnects with its Last-Event-ID and replays from history
+                    print("Event subscriber fell behind, closing stream")
+                    return
+                if event["id"] <= subscription.replayed_until:
+                    continue
+                yield event
+        finally:
+            self.unsubscribe(subscription)
+
+    def ensure_watcher(self):
+        """
+        Start the single upstream chain watcher (covering every shard) unless it is already running
+        """
+        with self.lock:
+            if self.watcher is None or not self.watcher.is_alive():
+                self.watcher = ChainEventWatcher(self)
+                self.watcher.start()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "lastEventId": self.last_id,
+                "historySize": len(self.history),
+                "subscribers": len(self.subscriptions),
+            }
+
+
+class ChainEventWatcher(threading.Thread):
+    """
+    Polls new blocks on every shard for certificate events and publishes them
+    to the broker.
+
+    Works over both the pooled HTTP provider and the WebsocketProvider returned
+    by get_web3(); mock shards are skipped because MockContract publishes its
+    own events.
+    """
+    def __init__(self, broker, interval=EVENT_POLL_INTERVAL):
+        super().__init__(name="certificate-event-watcher", daemon=True)
+        self.broker = broker
+        self.interval = interval
+        self.stop_event = threading.Event()
+        # Last block seen, by shard name
+        self.last_blocks = {}
+
+    def run(self):
+        from utils.shards import get_shard_registry
+
+        while not self.stop_event.wait(self.interval):
+            try:
+                shards = get_shard_registry().shards
+            except Exception as e:
+                print(f"Event watcher error: {str(e)}")
+                traceback.print_exc()
+                continue
+            for shard in shards:
+                try:
+                    self.poll(shard)
+                except Exception as e:
+                    print(f"Event watcher error on shard {shard.name}: {str(e)}")
+                    traceback.print_exc()
+
+    def poll(self, shard):
+        import utils.contract
+        from utils.contract import MockContract
+
+        if utils.contract.USE_MOCK_CONTRACT or shard.mock:
+            return
+        contract = shard.get_contract()
+        if isinstance(contract, MockContract):
+            return
+
+        web3 = contract.w3
+        head = web3.eth.block_number
+        last_block = self.last_blocks.get(shard.name)
+        if last_block is None:
+            # Only new events; older state comes from GET /api/certificates
+            self.last_blocks[shard.name] = head
+            return
+        if head <= last_block:
+            return
+
+        topics = [Web3.keccak(text=event_signature(contract, name)).hex() for name in CHAIN_EVENTS]
+        logs = web3.eth.get_logs({
+            "address": contract.address,
+            "fromBlock": last_block + 1,
+            "toBlock": head,
+            "topics": [topics],
+        })
+        for log in logs:
+            self.publish_log(shard, contract, log)
+        self.last_blocks[shard.name] = head
+
+    def publish_log(self, shard, contract, log):
+        for name, event_type in CHAIN_EVENTS.items():
+            try:
+                decoded = getattr(contract.events, name)().process_log(log)
+            except Exception:
+                continue
+            # bytes32 values (the lean contract's metadataDigest) as hex, so events stay JSON
+            args = {key: "0x" + bytes(value).hex() if isinstance(value, bytes) else value
+                    for key, value in decoded["args"].items()}
+            token_id = args.pop("tokenId")
+            self.broker.publish(
+                event_type,
+                token_id,
+                certificate_id=shard.certificate_id(token_id),
+                blockNumber=decoded["blockNumber"],
+                transactionHash=decoded["transactionHash"].hex(),
+                **args,
+            )
+            return
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def event_signature(contract, name):
+    """
+    Canonical signature (e.g. "CertificateRevoked(uint256)") of a contract event
+    """
+    abi = next(item for item in contract.abi if item.get("type") == "event" and item.get("name") == name)
+    return f"{name}({','.join(arg['type'] for arg in abi['inputs'])})"
+
+
+# Shared broker for the whole app
+certificate_events = CertificateEventBroker()
+
+
+def publish_certificate_event(event_type, token_id, certificate_id=None, **data):
+    return certificate_events.publish(event_type, token_id, certificate_id, **data)
@@ -4,12 +4,18 @@ import os
 import requests
 from typing import Optional
 import json
+import asyncio
+import threading
 import traceback
+from collections import OrderedDict
+
+from utils.admission import ipfs_stage, Overloaded
+from utils.singleflight import read_flight
 
 # IPFS connection (adjust these settings as needed)
-IPFS_HOST = "127.0.0.1"
-IPFS_PORT = 5001
-IPFS_GATEWAY = "https://ipfs.io/ipfs/"
+IPFS_HOST = os.getenv("IPFS_HOST", "127.0.0.1")
+IPFS_PORT = int(os.getenv("IPFS_PORT", "5001"))
+IPFS_GATEWAY = os.getenv("IPFS_GATEWAY", "https://ipfs.io/ipfs/")
 
 # Alternative: Use Pinata, Infura, or other IPFS providers
 PINATA_API_KEY = os.getenv("PINATA_API_KEY", "")
@@ -17,7 +23,52 @@ PINATA_SECRET_KEY = os.getenv("PINATA_SECRET_KEY", "")
 USE_PINATA = PINATA_API_KEY and PINATA_SECRET_KEY
 
 # For development: use mock IPFS if true
-USE_MOCK_IPFS = True  # Set to False to use real IPFS
+USE_MOCK_IPFS = os.getenv("USE_MOCK_IPFS", "True").lower() in ("true", "1", "t", "yes")  # Set to False to use real IPFS
+
+# With real IPFS, a failed upload only turns into a mock hash when this is enabled
+ALLOW_MOCK_FALLBACK = os.getenv("ALLOW_MOCK_FALLBACK", "False").lower() in ("true", "1", "t", "yes")
+
+# Number of metadata documents kept in memory after they were fetched from the gateway
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "10000"))
+
+
+class MetadataCache:
+    """
+    LRU cache of metadata JSON by IPFS hash. IPFS content never changes under
+    its hash, so entries are only dropped to make room.
+    """
+    def __init__(self, max_size=METADATA_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, ipfs_hash):
+        with self.lock:
+            metadata = self.entries.get(ipfs_hash)
+            if metadata is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(ipfs_hash)
+            self.hits += 1
+            return metadata
+
+    def put(self, ipfs_hash, metadata):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[ipfs_hash] = metadata
+            self.entries.move_to_end(ipfs_hash)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "maxSize": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+metadata_cache = MetadataCache()
 
 def get_placeholder_url(ipfs_hash):
     """
@@ -29,65 +80,86 @@ def get_placeholder_url(ipfs_hash):
     else:
         return f"https://via.placeholder.com/400?text=Image:{filename}"
 
+class IpfsUploadError(Exception):
+    """
+    Raised when a file could not be stored on IPFS and no mock fallback is allowed
+    """
+
+def mock_fallback(file_path: str, reason: str) -> str:
+    """
+    Return a mock hash after an IPFS failure, or raise if fallback is disabled
+    """
+    if not ALLOW_MOCK_FALLBACK:
+        raise IpfsUploadError(reason)
+    print(f"{reason} (falling back to mock)")
+    return f"mock_ipfs_hash_{os.path.basename(file_path)}"
+
+def add_to_ipfs_daemon(file_path: str) -> str:
+    """
+    Add a file to the local IPFS daemon (blocking)
+    """
+    client = ipfshttpclient.connect(f'/ip4/{IPFS_HOST}/tcp/{IPFS_PORT}/http')
+    try:
+        with open(file_path, 'rb') as f:
+            result = client.add(f)
+        return result['Hash']
+    finally:
+        client.close()
+
 async def upload_to_ipfs(file_path: str) -> str:
     """
     Upload a file to IPFS and return the hash
     """
-    try:
-        if not os.path.exists(file_path):
-            print(f"File not found: {file_path}")
-            return f"mock_ipfs_hash_file_not_found_{os.path.basename(file_path)}"
-            
-        if USE_MOCK_IPFS:
-            print(f"Using mock IPFS for {file_path}")
-            return f"mock_ipfs_hash_{os.path.basename(file_path)}"
-            
-        if USE_PINATA:
-            return await upload_to_pinata(file_path)
+    if not os.path.exists(file_path):
+        # Never hand out a hash for content that was not stored
+        raise IpfsUploadError(f"File not found: {file_path}")
+        
+    if USE_MOCK_IPFS:
+        print(f"Using mock IPFS for {file_path}")
+        return f"mock_ipfs_hash_{os.path.basename(file_path)}"
         
-        try:
-            # Connect to local IPFS daemon
-            client = ipfshttpclient.connect(f'/ip4/{IPFS_HOST}/tcp/{IPFS_PORT}/http')
-            
-            # Read file and add to IPFS
-            with open(file_path, 'rb') as f:
-                result = client.add(f.read())
-                
-            # Return the hash of the file
-            return result['Hash']
-        except Exception as e:
-            # If IPFS daemon is not available, use a mock for development
-            print(f"IPFS Error (falling back to mock): {str(e)}")
-            traceback.print_exc()
-            return f"mock_ipfs_hash_{os.path.basename(file_path)}"
+    if USE_PINATA:
+        return await upload_to_pinata(file_path)
+    
+    try:
+        # Blocking client runs in the threadpool, capped by the IPFS stage limit
+        return await ipfs_stage.run(add_to_ipfs_daemon, file_path)
+    except Overloaded:
+        raise
     except Exception as e:
-        print(f"Error in upload_to_ipfs: {str(e)}")
         traceback.print_exc()
-        return f"mock_ipfs_hash_error_{os.path.basename(file_path)}"
+        return mock_fallback(file_path, f"IPFS Error: {str(e)}")
+
+def pin_file_to_pinata(file_path: str) -> str:
+    """
+    Upload a file to Pinata (blocking)
+    """
+    pinata_url = "https://api.pinata.cloud/pinning/pinFileToIPFS"
+    headers = {
+        'pinata_api_key': PINATA_API_KEY,
+        'pinata_secret_api_key': PINATA_SECRET_KEY
+    }
+    
+    with open(file_path, 'rb') as f:
+        files = {'file': (os.path.basename(file_path), f)}
+        response = requests.post(pinata_url, files=files, headers=headers, timeout=60)
+        
+    if response.status_code == 200:
+        return response.json()['IpfsHash']
+    else:
+        raise Exception(f"Pinata upload failed: {response.text}")
 
 async def upload_to_pinata(file_path: str) -> str:
     """
     Upload a file to Pinata IPFS service
     """
     try:
-        pinata_url = "https://api.pinata.cloud/pinning/pinFileToIPFS"
-        headers = {
-            'pinata_api_key': PINATA_API_KEY,
-            'pinata_secret_api_key': PINATA_SECRET_KEY
-        }
-        
-        with open(file_path, 'rb') as f:
-            files = {'file': (os.path.basename(file_path), f)}
-            response = requests.post(pinata_url, files=files, headers=headers)
-            
-        if response.status_code == 200:
-            return response.json()['IpfsHash']
-        else:
-            raise Exception(f"Pinata upload failed: {response.text}")
+        return await ipfs_stage.run(pin_file_to_pinata, file_path)
+    except Overloaded:
+        raise
     except Exception as e:
-        print(f"Pinata Error: {str(e)}")
         traceback.print_exc()
-        return f"mock_ipfs_hash_{os.path.basename(file_path)}"
+        return mock_fallback(file_path, f"Pinata Error: {str(e)}")
 
 def get_ipfs_url(ipfs_hash: str) -> str:
     """
@@ -98,34 +170,72 @@ def get_ipfs_url(ipfs_hash: str) -> str:
         return get_placeholder_url(ipfs_hash)
     return f"ipfs://{ipfs_hash}"
 
+def fetch_ipfs_json(ipfs_hash: str) -> Optional[dict]:
+    """
+    Fetch JSON from the IPFS gateway (blocking)
+    """
+    response = requests.get(f"{IPFS_GATEWAY}{ipfs_hash}", timeout=30)
+    if response.status_code == 200:
+        return response.json()
+    return None
+
 async def get_from_ipfs(ipfs_hash: str) -> Optional[dict]:
     """
-    Get JSON data from IPFS
+    Get JSON data from IPFS. Returns None if it can't be fetched; raises
+    Overloaded when the IPFS stage is full, so callers can back off.
     """
+    if ipfs_hash.startswith("mock_ipfs_hash_"):
+        # For mock IPFS, return a placeholder JSON
+        filename = ipfs_hash.replace("mock_ipfs_hash_", "")
+        return {
+            "name": f"Mock Certificate: {filename}",
+            "description": "This is a mock certificate for development purposes",
+            "image": get_placeholder_url(f"mock_ipfs_hash_image_{filename}"),
+            "attributes": [
+                {"trait_type": "Environment", "value": "Development"},
+                {"trait_type": "Type", "value": "Mock Certificate"}
+            ]
+        }
+        
+    metadata = metadata_cache.get(ipfs_hash)
+    if metadata is not None:
+        return metadata
     try:
-        if ipfs_hash.startswith("mock_ipfs_hash_"):
-            # For mock IPFS, return a placeholder JSON
-            filename = ipfs_hash.replace("mock_ipfs_hash_", "")
-            return {
-                "name": f"Mock Certificate: {filename}",
-                "description": "This is a mock certificate for development purposes",
-                "image": get_placeholder_url(f"mock_ipfs_hash_image_{filename}"),
-                "attributes": [
-                    {"trait_type": "Environment", "value": "Development"},
-                    {"trait_type": "Type", "value": "Mock Certificate"}
-                ]
-            }
-            
-        try:
-            # Try to get from IPFS gateway
-            response = requests.get(f"{IPFS_GATEWAY}{ipfs_hash}")
-            if response.status_code == 200:
-                return response.json()
-        except Exception as e:
-            print(f"Error fetching from IPFS: {str(e)}")
-            traceback.print_exc()
-            return None
+        # Try to get from IPFS gateway; concurrent requests for the same hash share one fetch
+        metadata = await read_flight.do(("metadata", ipfs_hash), ipfs_stage.run, fetch_ipfs_json, ipfs_hash)
+        if metadata is not None:
+            metadata_cache.put(ipfs_hash, metadata)
+        return metadata
+    except Overloaded:
+        raise
     except Exception as e:
-        print(f"Error in get_from_ipfs: {str(e)}")
+        print(f"Error fetching from IPFS: {str(e)}")
         traceback.print_exc()
-        return None 
\ No newline at end of file
+        return None
+
+async def resolve_token_uri(token_uri: str) -> Optional[dict]:
+    """
+    Resolve a token URI (ipfs://, gateway URL or mock placeholder) to its metadata JSON
+    """
+    if token_uri.startswith("ipfs://"):
+        return await get_from_ipfs(token_uri[len("ipfs://"):])
+    if "text=Metadata:" in token_uri:
+        # Placeholder URL produced by get_ipfs_url() for a mock hash
+        return await get_from_ipfs("mock_ipfs_hash_" + token_uri.split("text=Metadata:", 1)[1])
+    if "/ipfs/" in token_uri:
+        return await get_from_ipfs(token_uri.split("/ipfs/", 1)[1])
+    return None
+
+async def resolve_token_uris(token_uris):
+    """
+    resolve_token_uri() for many URIs. At most as many gateway fetches run at
+    once as the IPFS stage runs, so a cold cache waits here instead of
+    overflowing the stage's queue.
+    """
+    slots = asyncio.Semaphore(ipfs_stage.limit)
+
+    async def resolve(token_uri):
+        async with slots:
+            return await resolve_token_uri(token_uri)
+
+    return await asyncio.gather(*(resolve(token_uri) for token_uri in token_uris))
@@ -0,0 +1,127 @@
+import os
+import time
+import json
+import hashlib
+import threading
+from datetime import datetime
+
+# Return the existing certificate instead of minting the same (recipient, course, date) twice
+ISSUANCE_DEDUP = os.getenv("ISSUANCE_DEDUP", "True").lower() in ("true", "1", "t", "yes")
+
+
+def normalize_issue_date(value):
+    """
+    Normalize an issue date to YYYY-MM-DD; unix timestamps are accepted too.
+    Values that don't parse are compared as trimmed lowercase text.
+    """
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value).strftime("%Y-%m-%d")
+    text = str(value).strip()
+    for fmt in ("%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d"):
+        try:
+            return datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+    try:
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).strftime("%Y-%m-%d")
+    except ValueError:
+        return text.lower()
+
+
+def issuance_key(recipient_address, course_name, issue_date):
+    """
+    Normalized (recipient address, course name, issue date) identifying a certificate
+    """
+    return (
+        str(recipient_address).strip().lower(),
+        " ".join(str(course_name).split()).casefold(),
+        normalize_issue_date(issue_date),
+    )
+
+
+def request_fingerprint(**fields):
+    """
+    Stable hash of the request fields an Idempotency-Key is bound to
+    """
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+class IssuanceIndex:
+    """
+    Hash index of issued certificates keyed on issuance_key().
+
+    Each entry holds the certificate as returned by the create endpoint, so a
+    duplicate is answered from memory without touching IPFS or the chain.
+    Revoked certificates drop out of the index and can be issued again.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.token_keys = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.built_at = None
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+            return entry
+
+    def record(self, key, certificate):
+        """
+        Index a newly issued (or updated) certificate
+        """
+        with self.lock:
+            self._forget(certificate["id"])
+            self.entries[key] = certificate
+            self.token_keys[certificate["id"]] = key
+
+    def forget(self, token_id):
+        with self.lock:
+            self._forget(token_id)
+
+    def _forget(self, token_id):
+        key = self.token_keys.pop(token_id, None)
+        if key is not None:
+            self.entries.pop(key, None)
+
+    def rebuild(self, certificates):
+        """
+        Replace the index with existing certificates (dicts shaped like
+        fetch_certificate() output, with recipient_address and issue_date set)
+        """
+        entries = {}
+        token_keys = {}
+        for certificate in certificates:
+            if certificate.get("revoked"):
+                continue
+            key = issuance_key(certificate["recipient_address"], certificate["course_name"], certificate["issue_date"])
+            entries[key] = certificate
+            token_keys[certificate["id"]] = key
+        with self.lock:
+            self.entries = entries
+            self.token_keys = token_keys
+            self.built_at = time.time()
+        print(f"Issuance index rebuilt with {len(entries)} certificates")
+
+    def on_certificate_event(self, event):
+        """
+        Broker listener: certificates revoked outside this API leave the index
+        so they can be issued again. Revocations and updates made through the
+        API are applied by the endpoints themselves.
+        """
+        if event["type"] == "revoked":
+            self.forget(event["certificateId"])
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": ISSUANCE_DEDUP,
+                "certificates": len(self.entries),
+                "duplicateHits": self.hits,
+                "builtAt": self.built_at,
+            }
+
+
+issuance_index = IssuanceIndex()
@@ -0,0 +1,430 @@
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import asyncio
+import threading
+import traceback
+from contextvars import ContextVar
+
+from starlette.concurrency import run_in_threadpool
+
+# SQLite file holding queued and finished jobs
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "jobs.db"))
+# Jobs advanced concurrently by this process
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Seconds between checks for due jobs when nothing was enqueued in this process
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# A claimed job is taken over by another worker if its lease isn't renewed in time
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# Finished jobs (and their idempotency keys) are deleted after this long
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+# Job and live state of the stage running in the current task, for save_progress()
+current_stage = ContextVar("current_stage", default=None)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    idempotency_key TEXT UNIQUE,
+    fingerprint TEXT,
+    dedup_key TEXT,
+    next_run_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, next_run_at);
+CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs (dedup_key, status);
+"""
+
+
+class PermanentJobError(Exception):
+    """
+    Stage failure that retrying won't fix; the job fails straight away
+    """
+    pass
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with jitter, giving up after max_attempts tries of a stage
+    """
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempts):
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+
+class Stage:
+    """
+    One checkpointed step of a job.
+
+    fn(payload, state) is awaited and returns a dict merged into the job state,
+    which is persisted before the next stage starts. A stage may therefore run
+    again after a crash and should check state for work it already did;
+    JobQueue.save_progress() persists such work before the stage returns.
+    """
+    def __init__(self, name, fn, policy=None):
+        self.name = name
+        self.fn = fn
+        self.policy = policy or RetryPolicy()
+
+
+class JobStore:
+    """
+    SQLite persistence for jobs; every method is blocking
+    """
+    def __init__(self, path=JOB_DB_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = None
+
+    def connect(self):
+        if self.db is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(SCHEMA)
+            self.db = db
+        return self.db
+
+    def _load(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["state"] = json.loads(job["state"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def create(self, kind, payload, stage, idempotency_key=None, fingerprint=None, dedup_key=None):
+        """
+        Insert a queued job. Returns (job, created); when an unfinished job with
+        the same dedup_key, or any job with the same idempotency_key, already
+        exists that job is returned instead.
+        """
+        now = time.time()
+        with self.lock:
+            db = self.connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                existing = None
+                if idempotency_key:
+                    existing = db.execute("SELECT * FROM jobs WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+                if existing is None and dedup_key:
+                    existing = db.execute(
+                        "SELECT * FROM jobs WHERE dedup_key = ? AND status IN (?, ?) LIMIT 1",
+                        (dedup_key, QUEUED, RUNNING)
+                    ).fetchone()
+                if existing is not None:
+                    db.execute("COMMIT")
+                    return self._load(existing), False
+                job_id = uuid.uuid4().hex
+                db.execute(
+                    "INSERT INTO jobs (id, kind, status, stage, payload, idempotency_key, fingerprint, dedup_key,"
+                    " next_run_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, QUEUED, stage, json.dumps(payload), idempotency_key, fingerprint, dedup_key,
+                     now, now, now)
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return self.get(job_id), True
+
+    def get(self, job_id):
+        with self.lock:
+            return self._load(self.connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def claim(self, owner, lease_seconds):
+        """
+        Lease the next due job: queued ones, or running ones whose owner stopped renewing
+        """
+        now = time.time()
+        with self.lock:
+            db = self.connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT * FROM jobs WHERE (status = ? AND next_run_at <= ?) OR (status = ? AND lease_until < ?)"
+                    " ORDER BY next_run_at LIMIT 1",
+                    (QUEUED, now, RUNNING, now)
+                ).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE jobs SET status = ?, lease_owner = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                        (RUNNING, owner, now + lease_seconds, now, row["id"])
+                    )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        job = self._load(row)
+        if job is not None:
+            job["status"] = RUNNING
+        return job
+
+    def _update(self, job_id, owner, **fields):
+        # Only the current lease holder may move a job forward
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock:
+            cursor = self.connect().execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND lease_owner = ?",
+                list(fields.values()) + [job_id, owner]
+            )
+        return cursor.rowcount == 1
+
+    def renew(self, job_id, owner, lease_seconds):
+        return self._update(job_id, owner, lease_until=time.time() + lease_seconds)
+
+    def checkpoint(self, job_id, owner, stage, state, lease_seconds):
+        return self._update(job_id, owner, stage=stage, state=json.dumps(state), attempts=0,
+                            lease_until=time.time() + lease_seconds)
+
+    def save_state(self, job_id, owner, state, lease_seconds):
+        # Progress within the current stage; attempts keep counting
+        return self._update(job_id, owner, state=json.dumps(state), lease_until=time.time() + lease_seconds)
+
+    def retry_later(self, job_id, owner, attempts, error, delay):
+        return self._update(job_id, owner, status=QUEUED, attempts=attempts, error=error,
+                            next_run_at=time.time() + delay, lease_owner=None, lease_until=None)
+
+    def succeed(self, job_id, owner, state, result):
+        return self._update(job_id, owner, status=SUCCEEDED, stage=None, state=json.dumps(state),
+                            result=json.dumps(result), error=None, lease_owner=None, lease_until=None)
+
+    def fail(self, job_id, owner, attempts, error):
+        return self._update(job_id, owner, status=FAILED, attempts=attempts, error=error,
+                            lease_owner=None, lease_until=None)
+
+    def release(self, owner):
+        """
+        Hand this owner's running jobs back to the queue (graceful shutdown)
+        """
+        with self.lock:
+            self.connect().execute(
+                "UPDATE jobs SET status = ?, lease_owner = NULL, lease_until = NULL, next_run_at = ?"
+                " WHERE status = ? AND lease_owner = ?",
+                (QUEUED, time.time(), RUNNING, owner)
+            )
+
+    def prune(self, older_than):
+        with self.lock:
+            cursor = self.connect().execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (SUCCEEDED, FAILED, older_than)
+            )
+        return cursor.rowcount
+
+    def succeeded(self, kind):
+        """
+        Payloads and results of a kind's finished jobs still within retention
+        """
+        with self.lock:
+            rows = self.connect().execute(
+                "SELECT payload, result FROM jobs WHERE kind = ? AND status = ?", (kind, SUCCEEDED)
+            ).fetchall()
+        return [(json.loads(payload), json.loads(result)) for payload, result in rows if result is not None]
+
+    def counts(self):
+        with self.lock:
+            rows = self.connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+def job_to_api(job):
+    """
+    Public view of a job, as returned by GET /api/jobs/{id}
+    """
+    return {
+        "id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "attempts": job["attempts"],
+        "error": job["error"],
+        "result": job["result"],
+        "createdAt": job["created_at"],
+        "updatedAt": job["updated_at"],
+    }
+
+
+class JobQueue:
+    """
+    Durable job queue with a pool of async workers.
+
+    Jobs move through the stages registered for their kind; each finished
+    stage is checkpointed, so after a crash or restart a job resumes at the
+    stage it was in instead of starting over. Failed stages are retried
+    according to their RetryPolicy.
+    """
+    def __init__(self, store=None, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL,
+                 lease_seconds=JOB_LEASE_SECONDS):
+        self.store = store or JobStore()
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.kinds = {}
+        self.tasks = []
+        self.wakeup = None
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    def register(self, kind, stages):
+        self.kinds[kind] = stages
+
+    async def submit(self, kind, payload, idempotency_key=None, fingerprint=None, dedup_key=None):
+        """
+        Persist a new job and wake a worker; returns (job, created) like JobStore.create
+        """
+        job, created = await run_in_threadpool(
+            self.store.create, kind, payload, self.kinds[kind][0].name, idempotency_key, fingerprint, dedup_key
+        )
+        if created and self.wakeup is not None:
+            self.wakeup.set()
+        return job, created
+
+    async def get(self, job_id):
+        return await run_in_threadpool(self.store.get, job_id)
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self.tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        print(f"Started {self.workers} job workers ({self.store.path})")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await run_in_threadpool(self.store.release, self.owner)
+
+    async def _worker(self):
+        last_prune = 0
+        while True:
+            try:
+                job = await run_in_threadpool(self.store.claim, self.owner, self.lease_seconds)
+                if job is None:
+                    if time.time() - last_prune > 3600:
+                        last_prune = time.time()
+                        await run_in_threadpool(self.store.prune, time.time() - JOB_RETENTION_SECONDS)
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    self.wakeup.clear()
+                    continue
+                self.active += 1
+                try:
+                    await self._advance(job)
+                finally:
+                    self.active -= 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job worker error: {str(e)}")
+                traceback.print_exc()
+                await asyncio.sleep(self.poll_interval)
+
+    async def save_progress(self, updates):
+        """
+        Persist part of the running stage's work before the stage returns, e.g.
+        a transaction hash before the transaction is sent. A retry of the stage
+        finds updates in its state. Raises if the job's lease was lost, so the
+        stage stops before doing work its new owner will redo.
+        """
+        job, state = current_stage.get()
+        state.update(updates)
+        if not await run_in_threadpool(self.store.save_state, job["id"], self.owner, state, self.lease_seconds):
+            raise RuntimeError(f"Lost the lease on job {job['id']}")
+
+    async def _keep_lease(self, job_id):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await run_in_threadpool(self.store.renew, job_id, self.owner, self.lease_seconds)
+
+    async def _advance(self, job):
+        stages = self.kinds.get(job["kind"])
+        if stages is None:
+            await run_in_threadpool(self.store.fail, job["id"], self.owner, job["attempts"], f"Unknown job kind {job['kind']}")
+            return
+        names = [stage.name for stage in stages]
+        index = names.index(job["stage"])
+        state = job["state"]
+        lease = asyncio.get_running_loop().create_task(self._keep_lease(job["id"]))
+        try:
+            while index < len(stages):
+                stage = stages[index]
+                current_stage.set((job, state))
+                try:
+                    updates = await stage.fn(job["payload"], dict(state))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    attempts = job["attempts"] + 1
+                    error = f"{stage.name}: {str(e)}"
+                    if isinstance(e, PermanentJobError) or attempts >= stage.policy.max_attempts:
+                        print(f"Job {job['id']} failed in stage {stage.name} after {attempts} attempt(s): {str(e)}")
+                        self.failed += 1
+                        await run_in_threadpool(self.store.fail, job["id"], self.owner, attempts, error)
+                    else:
+                        delay = stage.policy.delay(attempts)
+                        print(f"Job {job['id']} stage {stage.name} failed (attempt {attempts}), retrying in {delay:.1f}s: {str(e)}")
+                        self.retried += 1
+                        await run_in_threadpool(self.store.retry_later, job["id"], self.owner, attempts, error, delay)
+                    return
+
+                state.update(updates or {})
+                index += 1
+                job["attempts"] = 0
+                if index == len(stages):
+                    # The last stage leaves the job's outcome under "result"
+                    self.completed += 1
+                    await run_in_threadpool(self.store.succeed, job["id"], self.owner, state, state.get("result"))
+                elif not await run_in_threadpool(self.store.checkpoint, job["id"], self.owner, names[index], state,
+                                                 self.lease_seconds):
+                    print(f"Lost the lease on job {job['id']}, leaving it to its new owner")
+                    return
+        finally:
+            lease.cancel()
+
+    def stats(self):
+        return {
+            "workers": len(self.tasks),
+            "active": self.active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "jobs": self.store.counts(),
+        }
+
+
+job_queue = JobQueue()
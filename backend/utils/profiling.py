@@ -0,0 +1,291 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import cProfile
+import pstats
+import threading
+import functools
+import traceback
+from contextvars import ContextVar
+
+from utils.admin import is_admin_token
+
+# Fraction of requests profiled without being asked (0 disables sampling)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# "sample" writes speedscope flamegraphs, "cprofile" writes pstats .prof files
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "profiles"))
+# Ring size: oldest captures are deleted beyond this
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+# A sampled capture stops recording after this long, so long-lived requests stay bounded
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "30"))
+# Long-lived streaming routes are never picked by PROFILE_SAMPLE_RATE (comma-separated paths)
+PROFILE_EXCLUDE_PATHS = [p.strip() for p in os.getenv("PROFILE_EXCLUDE_PATHS", "/api/certificates/stream").split(",") if p.strip()]
+
+# Capture attached to the request currently being handled, if any
+current_capture = ContextVar("current_capture", default=None)
+
+# Only one capture runs at a time: cProfile can't nest, and it bounds overhead
+_capture_lock = threading.Lock()
+
+
+class ProfileCapture:
+    """
+    Profile of a single request.
+
+    Covers the event loop thread for the duration of the request plus any
+    threadpool work started through track_thread(). Other requests running
+    on the event loop at the same time show up in its samples too.
+    """
+    def __init__(self, label, mode=PROFILE_MODE, interval_ms=PROFILE_INTERVAL_MS, max_seconds=PROFILE_MAX_SECONDS):
+        self.label = label
+        self.mode = mode
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", label).strip("-")[:80]
+        extension = ".prof" if mode == "cprofile" else ".speedscope.json"
+        self.name = f"{int(time.time() * 1000)}_{slug}{extension}"
+        self.interval = interval_ms / 1000.0
+        self.max_seconds = max_seconds
+        self.truncated = False
+        self.loop_thread = threading.get_ident()
+        self.threads = {self.loop_thread: threading.current_thread().name}
+        self.lock = threading.Lock()
+        self.started = None
+        self.duration_ms = None
+        # sample mode
+        self.frames = []
+        self.frame_index = {}
+        self.samples = {}
+        self.stop_event = threading.Event()
+        self.sampler = None
+        # cprofile mode
+        self.profiles = []
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            self.profiles.append(profile)
+            profile.enable()
+        else:
+            self.sampler = threading.Thread(target=self._sample_loop, name="request-profiler", daemon=True)
+            self.sampler.start()
+
+    def stop(self):
+        self.duration_ms = (time.perf_counter() - self.started) * 1000
+        if self.mode == "cprofile":
+            self.profiles[0].disable()
+        else:
+            self.stop_event.set()
+            self.sampler.join()
+
+    def run_tracked(self, fn, *args, **kwargs):
+        """
+        Run fn in the current (worker) thread with this capture covering it
+        """
+        thread_id = threading.get_ident()
+        with self.lock:
+            self.threads[thread_id] = threading.current_thread().name
+        profile = None
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12+ allows one active profiler per process ("Another
+                # profiling tool is already active"); the capture's own profile
+                # already sees this thread there, so run without a second one
+                profile = None
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.disable()
+                with self.lock:
+                    self.profiles.append(profile)
+            if thread_id != self.loop_thread:
+                with self.lock:
+                    self.threads.pop(thread_id, None)
+
+    def _frame_id(self, code):
+        key = (code.co_filename, code.co_name, code.co_firstlineno)
+        index = self.frame_index.get(key)
+        if index is None:
+            index = len(self.frames)
+            self.frame_index[key] = index
+            self.frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+        return index
+
+    def _sample_loop(self):
+        last = time.perf_counter()
+        while not self.stop_event.wait(self.interval):
+            now = time.perf_counter()
+            if self.max_seconds and now - self.started > self.max_seconds:
+                # Keep what we have; the rest of the request goes unrecorded
+                self.truncated = True
+                return
+            weight = (now - last) * 1000
+            last = now
+            with self.lock:
+                threads = dict(self.threads)
+            frames = sys._current_frames()
+            for thread_id, name in threads.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_id(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                samples, weights = self.samples.setdefault(name, ([], []))
+                samples.append(stack)
+                weights.append(weight)
+
+    def save(self, directory=PROFILE_DIR):
+        """
+        Write the capture into the ring directory and return its file name
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.name)
+        if self.mode == "cprofile":
+            stats = pstats.Stats(self.profiles[0])
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(path)
+        else:
+            name = f"{self.label} ({int(self.duration_ms)} ms)"
+            if self.truncated:
+                name += f" [first {self.max_seconds:g} s]"
+            document = {
+                "$schema": "https://www.speedscope.app/file-format-schema.json",
+                "name": name,
+                "exporter": "nft-certificate-api",
+                "activeProfileIndex": 0,
+                "shared": {"frames": self.frames},
+                "profiles": [
+                    {
+                        "type": "sampled",
+                        "name": thread_name,
+                        "unit": "milliseconds",
+                        "startValue": 0,
+                        "endValue": sum(weights),
+                        "samples": samples,
+                        "weights": weights,
+                    }
+                    for thread_name, (samples, weights) in self.samples.items()
+                ],
+            }
+            with open(path, "w") as f:
+                json.dump(document, f)
+        prune_profiles(directory)
+        return self.name
+
+
+def track_thread(fn):
+    """
+    Wrap a blocking callable about to be sent to the threadpool so the active
+    request profile (if any) covers it; returns fn untouched otherwise
+    """
+    capture = current_capture.get()
+    if capture is None:
+        return fn
+    return functools.partial(capture.run_tracked, fn)
+
+
+def list_profiles(directory=PROFILE_DIR):
+    """
+    Recent captures, newest first
+    """
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            profiles.append({"name": name, "size": os.path.getsize(path), "created": os.path.getmtime(path)})
+    return sorted(profiles, key=lambda p: p["created"], reverse=True)
+
+
+def prune_profiles(directory=PROFILE_DIR, max_files=PROFILE_MAX_FILES):
+    for profile in list_profiles(directory)[max_files:]:
+        try:
+            os.remove(os.path.join(directory, profile["name"]))
+        except OSError:
+            pass
+
+
+def get_profile_path(name, directory=PROFILE_DIR):
+    """
+    Path of a stored capture, or None if the name is not a file in the ring
+    """
+    if os.path.basename(name) != name:
+        return None
+    path = os.path.join(directory, name)
+    return path if os.path.isfile(path) else None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles a request when asked to by an admin
+    (X-Profile: 1 plus a valid X-Admin-Token) or when picked by
+    PROFILE_SAMPLE_RATE. The capture name is returned in X-Profile-Id.
+    Requests that aren't profiled only pay for a header scan.
+    """
+    def __init__(self, app, sample_rate=PROFILE_SAMPLE_RATE, exclude_paths=PROFILE_EXCLUDE_PATHS):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.exclude_paths = set(exclude_paths)
+
+    def wants_profile(self, scope):
+        requested = False
+        token = None
+        streaming = scope.get("path") in self.exclude_paths
+        for key, value in scope.get("headers") or []:
+            if key == b"x-profile":
+                requested = value not in (b"", b"0", b"false")
+            elif key == b"x-admin-token":
+                token = value
+            elif key == b"accept" and b"text/event-stream" in value:
+                streaming = True
+        # A sampled stream would hold the capture for the whole connection
+        if self.sample_rate and not streaming and random.random() < self.sample_rate:
+            return True
+        return requested and is_admin_token(token)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        if not _capture_lock.acquire(blocking=False):
+            # Another capture is running; serve this request unprofiled
+            await self.app(scope, receive, send)
+            return
+
+        capture = ProfileCapture(f"{scope['method']} {scope['path']}")
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                # The file is written once the request finishes, under this name
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", capture.name.encode("latin-1"))
+                ]
+            await send(message)
+
+        token = current_capture.set(capture)
+        capture.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            capture.stop()
+            current_capture.reset(token)
+            _capture_lock.release()
+            try:
+                capture.save()
+                print(f"Saved request profile: {capture.name}")
+            except Exception as e:
+                print(f"Error saving request profile: {str(e)}")
+                traceback.print_exc()
@@ -0,0 +1,350 @@
+import os
+import json
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from web3.providers.base import JSONBaseProvider
+
+# Pool tuning (all optional, see env.example)
+RPC_TIMEOUT = float(os.getenv("RPC_TIMEOUT", "10"))
+RPC_HEDGE_MIN_MS = float(os.getenv("RPC_HEDGE_MIN_MS", "50"))
+RPC_HEDGE_PERCENTILE = float(os.getenv("RPC_HEDGE_PERCENTILE", "95"))
+RPC_HEALTH_INTERVAL = float(os.getenv("RPC_HEALTH_INTERVAL", "5"))
+RPC_FAILURE_THRESHOLD = int(os.getenv("RPC_FAILURE_THRESHOLD", "3"))
+RPC_COOLDOWN = float(os.getenv("RPC_COOLDOWN", "30"))
+RPC_MAX_BLOCK_LAG = int(os.getenv("RPC_MAX_BLOCK_LAG", "5"))
+
+# Methods that must always hit the same node: they either send a transaction,
+# depend on accounts unlocked on that node, or feed the nonce for the next send.
+WRITE_METHODS = {
+    "eth_sendTransaction",
+    "eth_sendRawTransaction",
+    "eth_sign",
+    "eth_signTransaction",
+    "eth_signTypedData",
+    "eth_signTypedData_v4",
+    "personal_sign",
+    "personal_sendTransaction",
+    "eth_accounts",
+    "eth_getTransactionCount",
+}
+
+
+class RpcTransportError(Exception):
+    """
+    Raised when an endpoint could not produce a JSON-RPC response at all
+    (connection error, timeout, HTTP 429/5xx or an unparsable body)
+    """
+
+
+class RpcPoolError(Exception):
+    """
+    Raised when no endpoint in the pool could serve a request
+    """
+
+
+class RpcEndpoint:
+    """
+    A single JSON-RPC endpoint together with its latency and error statistics
+    """
+    def __init__(self, url, window=200):
+        self.url = url
+        self.session = requests.Session()
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.ewma_ms = None
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.lagging = False
+        self.last_block = None
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record_success(self, latency_ms):
+        with self.lock:
+            self.latencies.append(latency_ms)
+            self.outcomes.append(True)
+            self.ewma_ms = latency_ms if self.ewma_ms is None else 0.8 * self.ewma_ms + 0.2 * latency_ms
+            self.consecutive_failures = 0
+            self.unhealthy_until = 0.0
+
+    def record_failure(self):
+        with self.lock:
+            self.outcomes.append(False)
+            self.errors += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= RPC_FAILURE_THRESHOLD:
+                self.unhealthy_until = time.monotonic() + RPC_COOLDOWN
+
+    def is_healthy(self):
+        return not self.lagging and time.monotonic() >= self.unhealthy_until
+
+    def error_rate(self):
+        with self.lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    def percentile(self, pct):
+        with self.lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def hedge_delay(self):
+        """
+        Seconds to wait on this endpoint before sending a duplicate read elsewhere
+        """
+        p = self.percentile(RPC_HEDGE_PERCENTILE)
+        return max(RPC_HEDGE_MIN_MS, p if p is not None else RPC_HEDGE_MIN_MS) / 1000.0
+
+    def score(self):
+        """
+        Lower is better: smoothed latency, penalised by error rate and current load
+        """
+        if self.ewma_ms is not None:
+            latency = self.ewma_ms
+        else:
+            # Never answered: optimistic if untried, pessimistic if it has only failed
+            latency = RPC_TIMEOUT * 1000 if self.errors else RPC_HEDGE_MIN_MS
+        return latency * (1 + 4 * self.error_rate()) * (1 + 0.25 * self.in_flight)
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "healthy": self.is_healthy(),
+            "lagging": self.lagging,
+            "lastBlock": self.last_block,
+            "requests": self.requests,
+            "errors": self.errors,
+            "errorRate": round(self.error_rate(), 4),
+            "inFlight": self.in_flight,
+            "ewmaMs": round(self.ewma_ms, 2) if self.ewma_ms is not None else None,
+            "p50Ms": self.percentile(50),
+            "p95Ms": self.percentile(95),
+        }
+
+
+class RpcPool:
+    """
+    Routes JSON-RPC requests across several endpoints.
+
+    Reads go to the fastest healthy endpoint and are hedged: if no answer has
+    arrived after that endpoint's p95 latency, the same request is sent to the
+    next best endpoint and whichever answers first wins. Transport failures fail
+    over to the remaining endpoints. Writes (see WRITE_METHODS) are pinned to a
+    single endpoint so nonces and node-managed accounts stay consistent.
+    """
+    def __init__(self, urls, health_interval=RPC_HEALTH_INTERVAL):
+        if not urls:
+            raise ValueError("RpcPool needs at least one endpoint URL")
+        self.endpoints = [RpcEndpoint(url) for url in urls]
+        self.executor = ThreadPoolExecutor(max_workers=max(4, 4 * len(self.endpoints)),
+                                           thread_name_prefix="rpc-pool")
+        self.write_endpoint = None
+        self.request_counter = 0
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread = None
+        if health_interval and health_interval > 0:
+            self._health_thread = threading.Thread(target=self._health_loop, args=(health_interval,),
+                                                   name="rpc-pool-health", daemon=True)
+            self._health_thread.start()
+
+    def _next_id(self):
+        with self.lock:
+            self.request_counter += 1
+            return self.request_counter
+
+    def _send(self, endpoint, method, params):
+        payload = {"jsonrpc": "2.0", "method": method, "params": params or [], "id": self._next_id()}
+        with endpoint.lock:
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+        started = time.perf_counter()
+        try:
+            response = endpoint.session.post(endpoint.url, data=json.dumps(payload),
+                                             headers={"Content-Type": "application/json"},
+                                             timeout=RPC_TIMEOUT)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise RpcTransportError(f"{endpoint.url} returned HTTP {response.status_code}")
+            result = response.json()
+        except (requests.RequestException, ValueError, RpcTransportError) as e:
+            endpoint.record_failure()
+            if isinstance(e, RpcTransportError):
+                raise
+            raise RpcTransportError(f"{endpoint.url}: {str(e)}") from e
+        finally:
+            with endpoint.lock:
+                endpoint.in_flight -= 1
+        endpoint.record_success((time.perf_counter() - started) * 1000)
+        return result
+
+    def _read_candidates(self):
+        healthy = [ep for ep in self.endpoints if ep.is_healthy()]
+        # With nothing healthy we still try everything rather than fail outright
+        return sorted(healthy or self.endpoints, key=lambda ep: ep.score())
+
+    def get_write_endpoint(self):
+        with self.lock:
+            if self.write_endpoint is None or not self.write_endpoint.is_healthy():
+                # Prefer the first configured endpoint that is healthy and not currently failing
+                healthy = [ep for ep in self.endpoints if ep.is_healthy()]
+                healthy.sort(key=lambda ep: ep.consecutive_failures > 0)
+                chosen = healthy[0] if healthy else self.endpoints[0]
+                if chosen is not self.write_endpoint:
+                    print(f"RPC pool pinning writes to {chosen.url}")
+                self.write_endpoint = chosen
+            return self.write_endpoint
+
+    def request(self, method, params=None):
+        """
+        Send a JSON-RPC request through the pool and return the decoded response
+        """
+        if method in WRITE_METHODS:
+            return self._send(self.get_write_endpoint(), method, params)
+        return self._read(method, params)
+
+    def _read(self, method, params):
+        candidates = self._read_candidates()
+        pending = {}
+        errors = []
+        next_index = 0
+        hedged = False
+        deadline = None
+
+        while True:
+            if not pending:
+                if next_index >= len(candidates):
+                    raise RpcPoolError(f"All RPC endpoints failed for {method}: {'; '.join(errors)}")
+                if next_index > 0:
+                    with self.lock:
+                        self.failovers += 1
+                endpoint = candidates[next_index]
+                next_index += 1
+                pending[self.executor.submit(self._send, endpoint, method, params)] = endpoint
+                deadline = time.monotonic() + endpoint.hedge_delay()
+
+            can_hedge = not hedged and next_index < len(candidates)
+            timeout = max(0.0, deadline - time.monotonic()) if can_hedge else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # Primary is slower than its own p95: race a duplicate on the next endpoint
+                endpoint = candidates[next_index]
+                next_index += 1
+                hedged = True
+                with self.lock:
+                    self.hedged_requests += 1
+                pending[self.executor.submit(self._send, endpoint, method, params)] = endpoint
+                continue
+
+            for future in done:
+                endpoint = pending.pop(future)
+                try:
+                    result = future.result()
+                except RpcTransportError as e:
+                    errors.append(str(e))
+                    continue
+                if hedged and endpoint is not candidates[0]:
+                    with self.lock:
+                        self.hedge_wins += 1
+                return result
+
+    def check_health(self):
+        """
+        Probe every endpoint with eth_blockNumber and flag the ones lagging behind
+        """
+        for endpoint in self.endpoints:
+            try:
+                response = self._send(endpoint, "eth_blockNumber", [])
+                endpoint.last_block = int(response["result"], 16)
+            except Exception as e:
+                print(f"RPC health check failed for {endpoint.url}: {str(e)}")
+                endpoint.last_block = None
+
+        blocks = [ep.last_block for ep in self.endpoints if ep.last_block is not None]
+        head = max(blocks) if blocks else None
+        for endpoint in self.endpoints:
+            endpoint.lagging = (head is not None and endpoint.last_block is not None
+                                and head - endpoint.last_block > RPC_MAX_BLOCK_LAG)
+
+    def _health_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                print(f"RPC health loop error: {str(e)}")
+                traceback.print_exc()
+
+    def close(self):
+        self._stop.set()
+        self.executor.shutdown(wait=False)
+        for endpoint in self.endpoints:
+            endpoint.session.close()
+
+    def stats(self):
+        write_endpoint = self.write_endpoint
+        return {
+            "endpoints": [ep.stats() for ep in self.endpoints],
+            "writeEndpoint": write_endpoint.url if write_endpoint else None,
+            "hedgedRequests": self.hedged_requests,
+            "hedgeWins": self.hedge_wins,
+            "failovers": self.failovers,
+        }
+
+
+class PooledHTTPProvider(JSONBaseProvider):
+    """
+    web3 provider that sends every request through an RpcPool
+    """
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+        self.endpoint_uri = pool.endpoints[0].url
+
+    def make_request(self, method, params):
+        try:
+            return self.pool.request(method, params)
+        except (RpcPoolError, RpcTransportError) as e:
+            # web3 treats OSError as "not connected"
+            raise ConnectionError(str(e)) from e
+
+    def __str__(self):
+        return f"RPC pool connection {[ep.url for ep in self.pool.endpoints]}"
+
+
+# One pool per distinct endpoint list, so connections and statistics survive
+# across get_contract() calls
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_rpc_pool(urls):
+    """
+    Get (or create) the shared pool for the given endpoint URLs
+    """
+    key = tuple(urls)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            print(f"Creating RPC pool for endpoints: {list(key)}")
+            pool = RpcPool(list(key))
+            _pools[key] = pool
+        return pool
+
+
+def get_rpc_pools():
+    with _pools_lock:
+        return list(_pools.values())
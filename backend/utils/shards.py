@@ -0,0 +1,270 @@
+import os
+import json
+import hashlib
+import asyncio
+import itertools
+import threading
+
+from web3 import Web3
+
+import utils.contract
+from utils.contract import (
+    MockContract, MOCK_CHAIN_ID, MOCK_CONTRACT_ADDRESS, connect_contract, get_mock_ledger,
+    certificate_id, parse_certificate_id, reload_settings
+)
+
+# Shard definitions: a JSON list, or the path of a JSON file holding one. Each entry:
+# {"name", "rpcUrls", "contractAddress", "privateKey", "chainId", "issuers", "writable", "contractMode"}
+# When unset there is a single shard built from NETWORK_RPC_URL(S), CONTRACT_ADDRESS and PRIVATE_KEY.
+SHARDS = os.getenv("SHARDS", "")
+# How new certificates are spread over writable shards: round_robin, least_pending or issuer
+SHARD_ROUTING = os.getenv("SHARD_ROUTING", "round_robin")
+
+ROUTING_POLICIES = ("round_robin", "least_pending", "issuer")
+
+
+class Shard:
+    """
+    One issuance target: a contract deployment on a chain plus the signer used for it.
+
+    The contract (and its pooled Web3 connection) is created once and reused.
+    """
+    def __init__(self, name, rpc_urls, contract_address, private_key="", chain_id=None, issuers=(),
+                 writable=True, mock=False, contract_mode="full"):
+        self.name = name
+        self.rpc_urls = rpc_urls
+        self.contract_address = contract_address or self.mock_address()
+        self.private_key = private_key
+        self.chain_id = chain_id if chain_id is not None else (MOCK_CHAIN_ID if mock else None)
+        self.issuers = set(issuers)
+        self.writable = writable
+        self.mock = mock
+        self.contract_mode = contract_mode
+        self.contract = None
+        self.pending = 0
+        self.routed = 0
+        self.lock = threading.Lock()
+        # Held from signing a transaction until it is sent, so concurrent sends get consecutive nonces
+        self.send_lock = asyncio.Lock()
+
+    def mock_address(self):
+        # Mock shards need distinct addresses so their certificate IDs don't collide
+        if self.name == "default":
+            return MOCK_CONTRACT_ADDRESS
+        return Web3.to_checksum_address(Web3.keccak(text=f"mock-shard:{self.name}")[-20:])
+
+    def get_contract(self):
+        """
+        Get the shard's contract, connecting on first use (blocking)
+        """
+        with self.lock:
+            if self.contract is not None:
+                return self.contract
+            mock_options = {
+                "ledger": get_mock_ledger(self.name),
+                "address": self.contract_address,
+                "chain_id": self.chain_id or MOCK_CHAIN_ID,
+            }
+            if self.mock:
+                print(f"Using mock contract for shard {self.name}...")
+                self.contract = MockContract(**mock_options)
+                return self.contract
+            contract = connect_contract(
+                self.rpc_urls, self.contract_address, self.private_key, self.contract_mode, **mock_options
+            )
+            if isinstance(contract, MockContract):
+                # Fallback after a connection problem; try the network again next time
+                return contract
+            if self.chain_id is None:
+                self.chain_id = contract.w3.eth.chain_id
+            self.contract = contract
+            return contract
+
+    def get_chain_id(self):
+        if self.chain_id is None:
+            contract = self.get_contract()
+            if isinstance(contract, MockContract):
+                return contract.chain_id
+        return self.chain_id
+
+    def certificate_id(self, token_id):
+        return certificate_id(self.get_chain_id(), self.contract_address, token_id)
+
+    def describe(self, certificate):
+        """
+        Tag a fetch_certificate() result with its global ID and shard
+        """
+        return {
+            **certificate,
+            "id": self.certificate_id(certificate["id"]),
+            "token_id": certificate["id"],
+            "shard": self.name,
+        }
+
+    def track_call(self, fn, *args, **kwargs):
+        """
+        Run a blocking write-path call, counting it as pending on this shard
+        """
+        with self.lock:
+            self.pending += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "chainId": self.chain_id,
+            "contractAddress": self.contract_address,
+            "rpcUrls": self.rpc_urls,
+            "writable": self.writable,
+            "mock": self.mock,
+            "contractMode": self.contract_mode,
+            "connected": self.contract is not None,
+            "pending": self.pending,
+            "routed": self.routed,
+            "issuers": sorted(self.issuers),
+        }
+
+
+class ShardRegistry:
+    """
+    The set of shards plus the routing policy picking one for each new certificate
+    """
+    def __init__(self, shards, routing=SHARD_ROUTING):
+        if not shards:
+            raise ValueError("At least one shard is required")
+        if routing not in ROUTING_POLICIES:
+            raise ValueError(f"Unknown shard routing policy {routing}, expected one of {', '.join(ROUTING_POLICIES)}")
+        self.shards = shards
+        self.by_name = {shard.name: shard for shard in shards}
+        self.routing = routing
+        self.counter = itertools.count()
+
+    @property
+    def default(self):
+        return self.shards[0]
+
+    def get(self, name):
+        return self.by_name[name]
+
+    def route(self, issuer=None):
+        """
+        Pick the shard a new certificate is issued on
+        """
+        writable = [shard for shard in self.shards if shard.writable]
+        if not writable:
+            raise RuntimeError("No writable shard configured")
+        if self.routing == "issuer" and issuer is not None:
+            pinned = [shard for shard in writable if issuer in shard.issuers]
+            if pinned:
+                shard = pinned[0]
+            else:
+                # Rendezvous hashing keeps each issuer on one shard as shards come and go
+                shard = max(writable, key=lambda s: hashlib.sha256(f"{issuer}:{s.name}".encode()).digest())
+        else:
+            start = next(self.counter) % len(writable)
+            rotated = writable[start:] + writable[:start]
+            if self.routing == "least_pending":
+                # Ties go round-robin
+                shard = min(rotated, key=lambda s: s.pending)
+            else:
+                shard = rotated[0]
+        shard.routed += 1
+        return shard
+
+    def resolve(self, value):
+        """
+        Find the shard and token ID for a certificate ID. A bare token ID refers
+        to the default shard. Raises KeyError for IDs of unknown shards. May
+        connect to a shard to learn its chain ID (blocking).
+        """
+        value = str(value)
+        if value.isdigit():
+            return self.default, int(value)
+        chain_id, address, token_id = parse_certificate_id(value)
+        # The same address can hold an unrelated contract on another chain, so both must match
+        candidates = [
+            shard for shard in self.shards
+            if shard.contract_address.lower() == address and shard.get_chain_id() == chain_id
+        ]
+        if not candidates:
+            raise KeyError(f"No shard for certificate {value}")
+        return candidates[0], token_id
+
+    def stats(self):
+        return {"routing": self.routing, "shards": [shard.stats() for shard in self.shards]}
+
+
+def load_shard_config():
+    """
+    Read the SHARDS setting: inline JSON or the path of a JSON file
+    """
+    value = os.getenv("SHARDS", SHARDS).strip()
+    if not value:
+        return None
+    if not value.startswith("["):
+        with open(value, "r") as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+def build_shards():
+    config = load_shard_config()
+    mock = utils.contract.USE_MOCK_CONTRACT
+    if config is None:
+        return [Shard(
+            "default",
+            utils.contract.get_rpc_urls(),
+            utils.contract.CONTRACT_ADDRESS,
+            utils.contract.PRIVATE_KEY,
+            mock=mock,
+            contract_mode=utils.contract.CONTRACT_MODE,
+        )]
+    shards = []
+    for index, entry in enumerate(config):
+        rpc_urls = entry.get("rpcUrls") or utils.contract.get_rpc_urls()
+        if isinstance(rpc_urls, str):
+            rpc_urls = [url.strip() for url in rpc_urls.split(",") if url.strip()]
+        shards.append(Shard(
+            entry.get("name") or f"shard-{index}",
+            rpc_urls,
+            entry.get("contractAddress", ""),
+            entry.get("privateKey", utils.contract.PRIVATE_KEY),
+            chain_id=entry.get("chainId"),
+            issuers=entry.get("issuers", ()),
+            writable=entry.get("writable", True),
+            mock=mock,
+            contract_mode=entry.get("contractMode", utils.contract.CONTRACT_MODE),
+        ))
+    return shards
+
+
+_registry = None
+_registry_signature = None
+_registry_lock = threading.Lock()
+
+
+def get_shard_registry():
+    """
+    Get the shard registry, rebuilding it when the contract settings changed
+    """
+    global _registry, _registry_signature
+    reload_settings()
+    signature = (
+        os.getenv("SHARDS", SHARDS),
+        os.getenv("SHARD_ROUTING", SHARD_ROUTING),
+        utils.contract.USE_MOCK_CONTRACT,
+        tuple(utils.contract.get_rpc_urls()),
+        utils.contract.CONTRACT_ADDRESS,
+        utils.contract.PRIVATE_KEY,
+        utils.contract.CONTRACT_MODE,
+    )
+    with _registry_lock:
+        if _registry is None or signature != _registry_signature:
+            _registry = ShardRegistry(build_shards(), os.getenv("SHARD_ROUTING", SHARD_ROUTING))
+            _registry_signature = signature
+            print(f"Shard registry: {[shard.name for shard in _registry.shards]} ({_registry.routing})")
+        return _registry
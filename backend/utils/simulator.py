@@ -0,0 +1,778 @@
+import os
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+import traceback
+import email.parser
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from eth_abi import encode, decode
+from eth_account import Account
+from eth_account._utils.typed_transactions import TypedTransaction
+from hexbytes import HexBytes
+from web3 import Web3
+
+# Chain profile
+SIM_CHAIN_ID = int(os.getenv("SIM_CHAIN_ID", "31337"))
+SIM_BLOCK_TIME = float(os.getenv("SIM_BLOCK_TIME", "2"))
+SIM_BLOCK_GAS_LIMIT = int(os.getenv("SIM_BLOCK_GAS_LIMIT", "30000000"))
+SIM_MEMPOOL_SIZE = int(os.getenv("SIM_MEMPOOL_SIZE", "5000"))
+SIM_RECEIPT_DELAY = float(os.getenv("SIM_RECEIPT_DELAY", "0"))
+# Contract to run: "full" (CertificateNFT) or "lean" (CertificateNFTLean)
+SIM_CONTRACT_MODE = os.getenv("SIM_CONTRACT_MODE", "full")
+# RPC profile: median latency per node (comma-separated, one node each),
+# log-normal spread and the fraction of requests answered with HTTP 503
+SIM_RPC_LATENCY_MS = os.getenv("SIM_RPC_LATENCY_MS", "20")
+SIM_RPC_LATENCY_SIGMA = float(os.getenv("SIM_RPC_LATENCY_SIGMA", "0.5"))
+SIM_RPC_ERROR_RATE = float(os.getenv("SIM_RPC_ERROR_RATE", "0"))
+SIM_RPC_PORT = int(os.getenv("SIM_RPC_PORT", "8545"))
+# IPFS profile
+SIM_IPFS_ADD_LATENCY_MS = float(os.getenv("SIM_IPFS_ADD_LATENCY_MS", "150"))
+SIM_IPFS_GET_LATENCY_MS = float(os.getenv("SIM_IPFS_GET_LATENCY_MS", "80"))
+SIM_IPFS_BANDWIDTH_KBPS = float(os.getenv("SIM_IPFS_BANDWIDTH_KBPS", "2000"))
+SIM_IPFS_ERROR_RATE = float(os.getenv("SIM_IPFS_ERROR_RATE", "0"))
+SIM_IPFS_PORT = int(os.getenv("SIM_IPFS_PORT", "5001"))
+
+# Same defaults as a fresh Hardhat node, so existing .env files keep working
+SIM_ACCOUNT = "0xf39Fd6e51aad88F6F4ce6aB8827279cffFb92266"
+# Hardhat's published key for that account; transactions are signed locally as in production
+SIM_PRIVATE_KEY = "0xac0974bec39a17e36ba4a6b4d238ff944bacb478cbed5efcae784d7bf4f2ff80"
+SIM_CONTRACT_ADDRESS = "0x5FbDB2315678afecb367f032d93F642f64180aa3"
+BASE_FEE = 1000000000
+PRIORITY_FEE = 1000000000
+
+
+def selector(signature):
+    return bytes(Web3.keccak(text=signature)[:4]).hex()
+
+
+def topic(signature):
+    return "0x" + bytes(Web3.keccak(text=signature)).hex()
+
+
+def to_hex(value):
+    return hex(value)
+
+
+def to_data(raw):
+    return "0x" + bytes(raw).hex()
+
+
+def word(value):
+    return "0x" + encode(["uint256"], [value]).hex()
+
+
+def address_word(address):
+    return "0x" + encode(["address"], [address]).hex()
+
+
+ISSUE = selector("issueCertificate(address,string,string,string,string)")
+UPDATE = selector("updateCertificate(uint256,string,string,string,string)")
+REVOKE = selector("revokeCertificate(uint256)")
+DETAILS = selector("getCertificateDetails(uint256)")
+OWNER_OF = selector("ownerOf(uint256)")
+TOKEN_URI = selector("tokenURI(uint256)")
+IS_VALID = selector("isValid(uint256)")
+OWNER = selector("owner()")
+
+LEAN_ISSUE = selector("issueCertificate(address,bytes32)")
+LEAN_UPDATE = selector("updateCertificate(uint256,bytes32)")
+
+ISSUED_TOPIC = topic("CertificateIssued(uint256,address,string,string,uint256)")
+LEAN_ISSUED_TOPIC = topic("CertificateIssued(uint256,address,bytes32,uint256)")
+UPDATED_TOPIC = topic("CertificateUpdated(uint256)")
+REVOKED_TOPIC = topic("CertificateRevoked(uint256)")
+
+
+class Revert(Exception):
+    pass
+
+
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class LatencyProfile:
+    """
+    Log-normal latency around a median, plus a failure probability
+    """
+    def __init__(self, median_ms, sigma=0.5, error_rate=0.0):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+
+    def delay(self):
+        if self.median_ms <= 0:
+            return 0.0
+        return self.median_ms * math.exp(random.gauss(0, self.sigma)) / 1000.0
+
+    def fails(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+class SimulatedChain:
+    """
+    In-memory chain running the CertificateNFT (or CertificateNFTLean) contract.
+
+    Transactions wait in a mempool until the next block (every block_time
+    seconds, or immediately when block_time is 0), execute when mined and
+    their receipts appear receipt_delay seconds later.
+    """
+    def __init__(self, block_time=SIM_BLOCK_TIME, block_gas_limit=SIM_BLOCK_GAS_LIMIT,
+                 mempool_size=SIM_MEMPOOL_SIZE, receipt_delay=SIM_RECEIPT_DELAY,
+                 chain_id=SIM_CHAIN_ID, contract_mode=SIM_CONTRACT_MODE):
+        self.block_time = block_time
+        self.block_gas_limit = block_gas_limit
+        self.mempool_size = mempool_size
+        self.receipt_delay = receipt_delay
+        self.chain_id = chain_id
+        self.lean = contract_mode == "lean"
+        self.lock = threading.RLock()
+        self.blocks = [self._make_block(0, [], 0)]
+        self.mempool = deque()
+        self.transactions = {}
+        self.receipts = {}
+        self.logs = []
+        self.nonces = {}
+        # Contract storage
+        self.token_counter = 0
+        self.certificates = {}
+        self.owners = {}
+        self.token_uris = {}
+        self.digests = {}
+        self.stop_event = threading.Event()
+        self.miner = None
+
+    def start(self):
+        if self.block_time > 0:
+            self.miner = threading.Thread(target=self._mine_loop, name="sim-miner", daemon=True)
+            self.miner.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _mine_loop(self):
+        while not self.stop_event.wait(self.block_time):
+            try:
+                self.mine()
+            except Exception:
+                traceback.print_exc()
+
+    def _make_block(self, number, tx_hashes, gas_used):
+        parent = self.blocks[-1]["hash"] if number else "0x" + "00" * 32
+        return {
+            "number": number,
+            "hash": "0x" + hashlib.sha256(f"block-{number}-{time.time()}".encode()).hexdigest(),
+            "parentHash": parent,
+            "timestamp": int(time.time()),
+            "transactions": tx_hashes,
+            "gasUsed": gas_used,
+            "minedAt": time.monotonic(),
+        }
+
+    @property
+    def head(self):
+        return self.blocks[-1]["number"]
+
+    # Transactions
+
+    def send_transaction(self, tx):
+        sender = Web3.to_checksum_address(tx.get("from") or SIM_ACCOUNT)
+        with self.lock:
+            if len(self.mempool) >= self.mempool_size:
+                raise RpcError(-32000, "txpool is full")
+            nonce = self.nonces.get(sender, 0)
+            data = tx.get("data") or tx.get("input") or "0x"
+            tx_hash = to_data(Web3.keccak(text=f"{sender}:{nonce}:{data}:{self.chain_id}"))
+            gas = int(tx["gas"], 16) if tx.get("gas") else self.estimate_gas(tx)
+            self._add_transaction(tx_hash, sender, nonce, tx.get("to"), data, gas)
+        if self.block_time <= 0:
+            self.mine()
+        return tx_hash
+
+    def send_raw_transaction(self, raw):
+        """
+        Accept a transaction signed by the client (PRIVATE_KEY set). Nonces must
+        be consecutive: a reused one is "nonce too low", as on a real node.
+        """
+        raw = HexBytes(raw)
+        tx = TypedTransaction.from_bytes(raw).as_dict()
+        sender = Account.recover_transaction(raw)
+        tx_hash = to_data(Web3.keccak(raw))
+        with self.lock:
+            if tx_hash in self.transactions:
+                raise RpcError(-32000, "already known")
+            nonce = self.nonces.get(sender, 0)
+            if tx["nonce"] < nonce:
+                raise RpcError(-32000, "nonce too low")
+            if tx["nonce"] > nonce:
+                raise RpcError(-32000, "nonce too high")
+            if len(self.mempool) >= self.mempool_size:
+                raise RpcError(-32000, "txpool is full")
+            to = Web3.to_checksum_address(tx["to"]) if tx["to"] else None
+            self._add_transaction(tx_hash, sender, nonce, to, to_data(tx["data"]), tx["gas"])
+        if self.block_time <= 0:
+            self.mine()
+        return tx_hash
+
+    def _add_transaction(self, tx_hash, sender, nonce, to, data, gas):
+        self.nonces[sender] = nonce + 1
+        self.transactions[tx_hash] = {
+            "hash": tx_hash, "from": sender, "to": to, "input": data,
+            "nonce": nonce, "gas": gas, "blockNumber": None,
+        }
+        self.mempool.append(tx_hash)
+
+    def estimate_gas(self, tx):
+        # Rough model: base cost, calldata, plus a storage write per 32 bytes of input.
+        # Only good enough to fill blocks; use scripts/benchmark-gas.js for real contract gas
+        data = bytes.fromhex((tx.get("data") or tx.get("input") or "0x")[2:])
+        if not data:
+            return 21000
+        return 21000 + 16 * len(data) + 20000 * (2 + len(data) // 32)
+
+    def mine(self):
+        with self.lock:
+            included = []
+            gas_used = 0
+            while self.mempool:
+                tx = self.transactions[self.mempool[0]]
+                if gas_used + tx["gas"] > self.block_gas_limit and included:
+                    break
+                self.mempool.popleft()
+                included.append(tx)
+                gas_used += tx["gas"]
+            number = self.head + 1
+            block = self._make_block(number, [tx["hash"] for tx in included], gas_used)
+            self.blocks.append(block)
+            cumulative = 0
+            for index, tx in enumerate(included):
+                tx["blockNumber"] = number
+                tx["transactionIndex"] = index
+                status = 1
+                logs = []
+                try:
+                    logs = self.execute(tx, block)
+                except Revert as e:
+                    status = 0
+                    print(f"Simulated transaction {tx['hash']} reverted: {str(e)}")
+                cumulative += tx["gas"]
+                for log_index, log in enumerate(logs):
+                    log.update({
+                        "blockNumber": to_hex(number), "blockHash": block["hash"],
+                        "transactionHash": tx["hash"], "transactionIndex": to_hex(index),
+                        "logIndex": to_hex(len(self.logs) + log_index), "removed": False,
+                    })
+                self.logs.extend(logs)
+                self.receipts[tx["hash"]] = {
+                    "transactionHash": tx["hash"], "transactionIndex": to_hex(index),
+                    "blockHash": block["hash"], "blockNumber": to_hex(number),
+                    "from": tx["from"], "to": tx["to"], "contractAddress": None,
+                    "cumulativeGasUsed": to_hex(cumulative), "gasUsed": to_hex(tx["gas"]),
+                    "effectiveGasPrice": to_hex(BASE_FEE + PRIORITY_FEE),
+                    "logs": logs, "logsBloom": "0x" + "00" * 256,
+                    "status": to_hex(status), "type": "0x2",
+                }
+            return block
+
+    def get_receipt(self, tx_hash):
+        with self.lock:
+            receipt = self.receipts.get(tx_hash)
+            if receipt is None:
+                return None
+            block = self.blocks[int(receipt["blockNumber"], 16)]
+            if time.monotonic() < block["minedAt"] + self.receipt_delay:
+                return None
+            return receipt
+
+    # Contract
+
+    def _require_token(self, token_id):
+        if token_id not in self.owners:
+            raise Revert("Certificate does not exist")
+
+    def execute(self, tx, block):
+        data = bytes.fromhex(tx["input"][2:])
+        method, args = data[:4].hex(), data[4:]
+        if tx["from"] != SIM_ACCOUNT:
+            raise Revert("OwnableUnauthorizedAccount")
+        if self.lean:
+            return self.execute_lean(method, args, block)
+        if method == ISSUE:
+            to, recipient_name, course_name, description, token_uri = decode(
+                ["address", "string", "string", "string", "string"], args)
+            self.token_counter += 1
+            token_id = self.token_counter
+            self.owners[token_id] = Web3.to_checksum_address(to)
+            self.token_uris[token_id] = token_uri
+            self.certificates[token_id] = [recipient_name, course_name, block["timestamp"], description, False]
+            return [{
+                "address": SIM_CONTRACT_ADDRESS,
+                "topics": [ISSUED_TOPIC, word(token_id), address_word(to)],
+                "data": "0x" + encode(["string", "string", "uint256"],
+                                      [recipient_name, course_name, block["timestamp"]]).hex(),
+            }]
+        if method == UPDATE:
+            token_id, recipient_name, course_name, description, token_uri = decode(
+                ["uint256", "string", "string", "string", "string"], args)
+            self._require_token(token_id)
+            if self.certificates[token_id][4]:
+                raise Revert("Certificate is revoked")
+            certificate = self.certificates[token_id]
+            certificate[0], certificate[1], certificate[3] = recipient_name, course_name, description
+            self.token_uris[token_id] = token_uri
+            return [{"address": SIM_CONTRACT_ADDRESS, "topics": [UPDATED_TOPIC, word(token_id)], "data": "0x"}]
+        if method == REVOKE:
+            (token_id,) = decode(["uint256"], args)
+            self._require_token(token_id)
+            if self.certificates[token_id][4]:
+                raise Revert("Certificate already revoked")
+            self.certificates[token_id][4] = True
+            return [{"address": SIM_CONTRACT_ADDRESS, "topics": [REVOKED_TOPIC, word(token_id)], "data": "0x"}]
+        raise Revert(f"Unknown method 0x{method}")
+
+    def execute_lean(self, method, args, block):
+        # Same storage as the full contract, with empty strings where the lean one stores nothing
+        if method == LEAN_ISSUE:
+            to, digest = decode(["address", "bytes32"], args)
+            self.token_counter += 1
+            token_id = self.token_counter
+            self.owners[token_id] = Web3.to_checksum_address(to)
+            self.digests[token_id] = digest
+            self.certificates[token_id] = ["", "", block["timestamp"], "", False]
+            return [{
+                "address": SIM_CONTRACT_ADDRESS,
+                "topics": [LEAN_ISSUED_TOPIC, word(token_id), address_word(to)],
+                "data": "0x" + encode(["bytes32", "uint256"], [digest, block["timestamp"]]).hex(),
+            }]
+        if method == LEAN_UPDATE:
+            token_id, digest = decode(["uint256", "bytes32"], args)
+            self._require_token(token_id)
+            if self.certificates[token_id][4]:
+                raise Revert("Certificate is revoked")
+            self.digests[token_id] = digest
+            return [{"address": SIM_CONTRACT_ADDRESS, "topics": [UPDATED_TOPIC, word(token_id)], "data": "0x"}]
+        if method == REVOKE:
+            (token_id,) = decode(["uint256"], args)
+            self._require_token(token_id)
+            if self.certificates[token_id][4]:
+                raise Revert("Certificate already revoked")
+            self.certificates[token_id][4] = True
+            return [{"address": SIM_CONTRACT_ADDRESS, "topics": [REVOKED_TOPIC, word(token_id)], "data": "0x"}]
+        raise Revert(f"Unknown method 0x{method}")
+
+    def call(self, tx):
+        data = bytes.fromhex((tx.get("data") or tx.get("input") or "0x")[2:])
+        method, args = data[:4].hex(), data[4:]
+        with self.lock:
+            if method == OWNER:
+                return encode(["address"], [SIM_ACCOUNT])
+            (token_id,) = decode(["uint256"], args)
+            self._require_token(token_id)
+            if method == DETAILS and self.lean:
+                certificate = self.certificates[token_id]
+                return encode(["(bytes32,uint64,bool)"], [(self.digests[token_id], certificate[2], certificate[4])])
+            if method == DETAILS:
+                return encode(["(string,string,uint256,string,bool)"], [tuple(self.certificates[token_id])])
+            if method == OWNER_OF:
+                return encode(["address"], [self.owners[token_id]])
+            if method == TOKEN_URI and self.lean:
+                return encode(["string"], ["ipfs://" + cid_from_digest(self.digests[token_id])])
+            if method == TOKEN_URI:
+                return encode(["string"], [self.token_uris[token_id]])
+            if method == IS_VALID:
+                return encode(["bool"], [not self.certificates[token_id][4]])
+        raise Revert(f"Unknown method 0x{method}")
+
+    def get_logs(self, criteria):
+        def block_number(value, default):
+            if value in (None, "latest", "pending", "safe", "finalized"):
+                return default
+            if value == "earliest":
+                return 0
+            return int(value, 16)
+
+        with self.lock:
+            from_block = block_number(criteria.get("fromBlock"), self.head)
+            to_block = block_number(criteria.get("toBlock"), self.head)
+            address = criteria.get("address")
+            addresses = {a.lower() for a in ([address] if isinstance(address, str) else address or [])}
+            topic_filters = criteria.get("topics") or []
+            matches = []
+            for log in self.logs:
+                number = int(log["blockNumber"], 16)
+                if number < from_block or number > to_block:
+                    continue
+                if addresses and log["address"].lower() not in addresses:
+                    continue
+                if not all(
+                    wanted is None or log["topics"][i] in (wanted if isinstance(wanted, list) else [wanted])
+                    for i, wanted in enumerate(topic_filters)
+                    if i < len(log["topics"])
+                ):
+                    continue
+                matches.append(log)
+            return matches
+
+    def get_block(self, tag):
+        with self.lock:
+            if tag in ("latest", "pending", "safe", "finalized"):
+                block = self.blocks[-1]
+            elif tag == "earliest":
+                block = self.blocks[0]
+            else:
+                number = int(tag, 16)
+                if number > self.head:
+                    return None
+                block = self.blocks[number]
+            return {
+                "number": to_hex(block["number"]), "hash": block["hash"], "parentHash": block["parentHash"],
+                "timestamp": to_hex(block["timestamp"]), "gasLimit": to_hex(self.block_gas_limit),
+                "gasUsed": to_hex(block["gasUsed"]), "baseFeePerGas": to_hex(BASE_FEE),
+                "miner": "0x" + "00" * 20, "difficulty": "0x0", "extraData": "0x",
+                "transactions": list(block["transactions"]),
+                "logsBloom": "0x" + "00" * 256, "nonce": "0x" + "00" * 8,
+            }
+
+    # JSON-RPC dispatch
+
+    def handle(self, method, params):
+        if method == "web3_clientVersion":
+            return "nft-certify-simulator/1.0"
+        if method == "net_version":
+            return str(self.chain_id)
+        if method == "eth_chainId":
+            return to_hex(self.chain_id)
+        if method == "eth_blockNumber":
+            return to_hex(self.head)
+        if method == "eth_accounts":
+            return [SIM_ACCOUNT]
+        if method == "eth_gasPrice":
+            return to_hex(BASE_FEE + PRIORITY_FEE)
+        if method == "eth_maxPriorityFeePerGas":
+            return to_hex(PRIORITY_FEE)
+        if method == "eth_getCode":
+            return "0x60806040" if params[0].lower() == SIM_CONTRACT_ADDRESS.lower() else "0x"
+        if method == "eth_getBalance":
+            return to_hex(10 ** 22)
+        if method == "eth_getTransactionCount":
+            with self.lock:
+                sender = Web3.to_checksum_address(params[0])
+                if len(params) > 1 and params[1] == "pending":
+                    return to_hex(self.nonces.get(sender, 0))
+                mined = sum(1 for tx in self.transactions.values()
+                            if tx["from"] == sender and tx["blockNumber"] is not None)
+                return to_hex(mined)
+        if method == "eth_getBlockByNumber":
+            return self.get_block(params[0])
+        if method == "eth_estimateGas":
+            return to_hex(self.estimate_gas(params[0]))
+        if method == "eth_call":
+            try:
+                return to_data(self.call(params[0]))
+            except Revert as e:
+                raise RpcError(3, f"execution reverted: {str(e)}")
+        if method == "eth_sendTransaction":
+            return self.send_transaction(params[0])
+        if method == "eth_sendRawTransaction":
+            return self.send_raw_transaction(params[0])
+        if method == "eth_getTransactionReceipt":
+            return self.get_receipt(params[0])
+        if method == "eth_getTransactionByHash":
+            with self.lock:
+                tx = self.transactions.get(params[0])
+                if tx is None:
+                    return None
+                return {
+                    "hash": tx["hash"], "from": tx["from"], "to": tx["to"], "input": tx["input"],
+                    "nonce": to_hex(tx["nonce"]), "gas": to_hex(tx["gas"]), "value": "0x0",
+                    "blockNumber": to_hex(tx["blockNumber"]) if tx["blockNumber"] is not None else None,
+                }
+        if method == "eth_getLogs":
+            return self.get_logs(params[0])
+        raise RpcError(-32601, f"Method {method} not supported by the simulator")
+
+    def stats(self):
+        with self.lock:
+            return {"head": self.head, "mempool": len(self.mempool), "certificates": len(self.owners)}
+
+
+def read_body(handler):
+    """
+    Read a request body, including chunked uploads (ipfshttpclient streams files)
+    """
+    if handler.headers.get("Transfer-Encoding", "").lower() != "chunked":
+        return handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+    chunks = []
+    while True:
+        size = int(handler.rfile.readline().split(b";", 1)[0].strip() or b"0", 16)
+        if size == 0:
+            handler.rfile.readline()
+            return b"".join(chunks)
+        chunks.append(handler.rfile.read(size))
+        handler.rfile.readline()
+
+
+def make_rpc_handler(chain, profile):
+    class RpcHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = read_body(self)
+            time.sleep(profile.delay())
+            if profile.fails():
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            try:
+                request = json.loads(body)
+            except ValueError:
+                self._reply({"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": "Parse error"}})
+                return
+            if isinstance(request, list):
+                self._reply([self._dispatch(item) for item in request])
+            else:
+                self._reply(self._dispatch(request))
+
+        def _dispatch(self, request):
+            response = {"jsonrpc": "2.0", "id": request.get("id")}
+            try:
+                response["result"] = chain.handle(request.get("method"), request.get("params") or [])
+            except RpcError as e:
+                response["error"] = {"code": e.code, "message": str(e)}
+            except Exception as e:
+                traceback.print_exc()
+                response["error"] = {"code": -32603, "message": str(e)}
+            return response
+
+        def _reply(self, payload):
+            out = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+    return RpcHandler
+
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+
+def cid_v0(content):
+    """
+    CIDv0 ("Qm...") of the raw bytes: base58 of the sha2-256 multihash
+    """
+    return cid_from_digest(hashlib.sha256(content).digest())
+
+
+def cid_from_digest(digest):
+    number = int.from_bytes(b"\x12\x20" + digest, "big")
+    encoded = ""
+    while number:
+        number, remainder = divmod(number, 58)
+        encoded = BASE58_ALPHABET[remainder] + encoded
+    return encoded
+
+
+class SimulatedIpfs:
+    """
+    IPFS daemon stand-in: the /api/v0/add and /api/v0/version endpoints used by
+    ipfshttpclient plus a /ipfs/<cid> gateway, with add/get latency and a
+    bandwidth cap applied to every transfer
+    """
+    def __init__(self, add_latency_ms=SIM_IPFS_ADD_LATENCY_MS, get_latency_ms=SIM_IPFS_GET_LATENCY_MS,
+                 bandwidth_kbps=SIM_IPFS_BANDWIDTH_KBPS, error_rate=SIM_IPFS_ERROR_RATE):
+        self.add_profile = LatencyProfile(add_latency_ms, error_rate=error_rate)
+        self.get_profile = LatencyProfile(get_latency_ms, error_rate=error_rate)
+        self.bandwidth_kbps = bandwidth_kbps
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def transfer_time(self, size):
+        if self.bandwidth_kbps <= 0:
+            return 0.0
+        return size / (self.bandwidth_kbps * 1024 / 8)
+
+    def add(self, content):
+        cid = cid_v0(content)
+        with self.lock:
+            self.objects[cid] = content
+        return cid
+
+    def get(self, cid):
+        with self.lock:
+            return self.objects.get(cid)
+
+    def stats(self):
+        with self.lock:
+            return {"objects": len(self.objects), "bytes": sum(len(o) for o in self.objects.values())}
+
+
+def make_ipfs_handler(ipfs):
+    class IpfsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, body, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            body = read_body(self)
+            path = self.path.split("?", 1)[0]
+            if path == "/api/v0/version":
+                self._reply(200, json.dumps({"Version": "0.7.0", "Commit": "simulator"}).encode())
+                return
+            if path != "/api/v0/add":
+                self._reply(404, b'{"Message": "not found"}')
+                return
+            time.sleep(ipfs.add_profile.delay() + ipfs.transfer_time(len(body)))
+            if ipfs.add_profile.fails():
+                self._reply(503, b'{"Message": "simulated failure"}')
+                return
+            message = email.parser.BytesParser().parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body)
+            lines = []
+            for part in message.get_payload() if message.is_multipart() else []:
+                content = part.get_payload(decode=True) or b""
+                cid = ipfs.add(content)
+                lines.append(json.dumps({"Name": part.get_filename() or cid, "Hash": cid, "Size": str(len(content))}))
+            self._reply(200, "\n".join(lines).encode())
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if not path.startswith("/ipfs/"):
+                self._reply(404, b"not found", "text/plain")
+                return
+            content = ipfs.get(path[len("/ipfs/"):].strip("/"))
+            time.sleep(ipfs.get_profile.delay() + ipfs.transfer_time(len(content or b"")))
+            if ipfs.get_profile.fails():
+                self._reply(503, b"simulated failure", "text/plain")
+            elif content is None:
+                self._reply(404, b"not found", "text/plain")
+            else:
+                self._reply(200, content, "application/octet-stream")
+
+    return IpfsHandler
+
+
+class Simulator:
+    """
+    A simulated chain served by one or more RPC nodes (one per latency entry)
+    plus a simulated IPFS daemon, all on background threads
+    """
+    def __init__(self, rpc_latencies_ms=None, rpc_sigma=SIM_RPC_LATENCY_SIGMA, rpc_error_rate=SIM_RPC_ERROR_RATE,
+                 rpc_port=SIM_RPC_PORT, ipfs_port=SIM_IPFS_PORT, host="127.0.0.1", chain=None, ipfs=None):
+        if rpc_latencies_ms is None:
+            rpc_latencies_ms = [float(v) for v in SIM_RPC_LATENCY_MS.split(",") if v.strip()]
+        self.host = host
+        self.chain = chain or SimulatedChain()
+        self.ipfs = ipfs or SimulatedIpfs()
+        self.servers = []
+        for index, latency in enumerate(rpc_latencies_ms):
+            profile = LatencyProfile(latency, rpc_sigma, rpc_error_rate)
+            port = rpc_port + index if rpc_port else 0
+            self.servers.append(ThreadingHTTPServer((host, port), make_rpc_handler(self.chain, profile)))
+        self.ipfs_server = ThreadingHTTPServer((host, ipfs_port), make_ipfs_handler(self.ipfs))
+
+    @property
+    def rpc_urls(self):
+        return [f"http://{self.host}:{server.server_address[1]}" for server in self.servers]
+
+    @property
+    def ipfs_port(self):
+        return self.ipfs_server.server_address[1]
+
+    @property
+    def ipfs_gateway(self):
+        return f"http://{self.host}:{self.ipfs_port}/ipfs/"
+
+    def start(self):
+        self.chain.start()
+        for server in self.servers + [self.ipfs_server]:
+            threading.Thread(target=server.serve_forever, name="simulator-http", daemon=True).start()
+        print(f"Simulator RPC nodes: {self.rpc_urls}")
+        print(f"Simulator IPFS API: http://{self.host}:{self.ipfs_port} (gateway {self.ipfs_gateway})")
+        print(f"Simulator contract: {SIM_CONTRACT_ADDRESS}, account: {SIM_ACCOUNT}")
+        return self
+
+    def stop(self):
+        self.chain.stop()
+        for server in self.servers + [self.ipfs_server]:
+            server.shutdown()
+            server.server_close()
+
+
+def start_in_process():
+    """
+    Start the simulator and point the contract and IPFS settings of this process at it
+    """
+    import utils.contract
+    import utils.ipfs
+
+    simulator = Simulator().start()
+    os.environ["USE_MOCK_CONTRACT"] = "False"
+    os.environ["NETWORK_RPC_URL"] = simulator.rpc_urls[0]
+    os.environ["NETWORK_RPC_URLS"] = ",".join(simulator.rpc_urls)
+    os.environ["CONTRACT_ADDRESS"] = SIM_CONTRACT_ADDRESS
+    os.environ["PRIVATE_KEY"] = SIM_PRIVATE_KEY
+    os.environ["CONTRACT_MODE"] = "lean" if simulator.chain.lean else "full"
+    utils.ipfs.USE_MOCK_IPFS = False
+    utils.ipfs.IPFS_HOST = simulator.host
+    utils.ipfs.IPFS_PORT = simulator.ipfs_port
+    utils.ipfs.IPFS_GATEWAY = simulator.ipfs_gateway
+    return simulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the latency-injecting chain and IPFS simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--rpc-port", type=int, default=SIM_RPC_PORT, help="first RPC node port")
+    parser.add_argument("--ipfs-port", type=int, default=SIM_IPFS_PORT)
+    parser.add_argument("--latency", default=SIM_RPC_LATENCY_MS,
+                        help="median RPC latency in ms, comma-separated for several nodes")
+    parser.add_argument("--sigma", type=float, default=SIM_RPC_LATENCY_SIGMA, help="log-normal latency spread")
+    parser.add_argument("--error-rate", type=float, default=SIM_RPC_ERROR_RATE)
+    parser.add_argument("--block-time", type=float, default=SIM_BLOCK_TIME, help="seconds, 0 mines instantly")
+    parser.add_argument("--receipt-delay", type=float, default=SIM_RECEIPT_DELAY)
+    parser.add_argument("--contract-mode", choices=("full", "lean"), default=SIM_CONTRACT_MODE)
+    parser.add_argument("--ipfs-add-latency", type=float, default=SIM_IPFS_ADD_LATENCY_MS)
+    parser.add_argument("--ipfs-get-latency", type=float, default=SIM_IPFS_GET_LATENCY_MS)
+    parser.add_argument("--ipfs-bandwidth", type=float, default=SIM_IPFS_BANDWIDTH_KBPS, help="kbit/s, 0 = unlimited")
+    parser.add_argument("--ipfs-error-rate", type=float, default=SIM_IPFS_ERROR_RATE)
+    args = parser.parse_args()
+
+    simulator = Simulator(
+        rpc_latencies_ms=[float(v) for v in args.latency.split(",") if v.strip()],
+        rpc_sigma=args.sigma,
+        rpc_error_rate=args.error_rate,
+        rpc_port=args.rpc_port,
+        ipfs_port=args.ipfs_port,
+        host=args.host,
+        chain=SimulatedChain(block_time=args.block_time, receipt_delay=args.receipt_delay,
+                             contract_mode=args.contract_mode),
+        ipfs=SimulatedIpfs(args.ipfs_add_latency, args.ipfs_get_latency, args.ipfs_bandwidth, args.ipfs_error_rate),
+    ).start()
+    try:
+        while True:
+            time.sleep(10)
+            print(f"Simulator: {json.dumps({'chain': simulator.chain.stats(), 'ipfs': simulator.ipfs.stats()})}")
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
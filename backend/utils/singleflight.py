@@ -0,0 +1,59 @@
+import asyncio
+from collections import defaultdict
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical async calls.
+
+    The first caller for a key runs the upstream call; callers arriving while it
+    is in flight await the same result (or exception) instead of repeating it.
+    Nothing is cached once the call finishes. Keys are tuples whose first item
+    names the kind of call, which is what the counters are grouped by.
+    """
+    def __init__(self):
+        self.inflight = {}
+        self.upstream_calls = defaultdict(int)
+        self.shared = defaultdict(int)
+
+    async def do(self, key, fn, *args, **kwargs):
+        kind = key[0]
+        future = self.inflight.get(key)
+        if future is not None:
+            self.shared[kind] += 1
+            # shield: one waiter giving up must not cancel the call for everyone else
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        self.upstream_calls[kind] += 1
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved so an unshared failure doesn't log "exception never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.inflight[key]
+
+    def stats(self):
+        """
+        Per kind: upstream calls made, and calls saved by sharing an in-flight result
+        """
+        stats = {
+            kind: {"upstreamCalls": self.upstream_calls[kind], "savedCalls": self.shared[kind]}
+            for kind in sorted(set(self.upstream_calls) | set(self.shared))
+        }
+        stats["inFlight"] = len(self.inflight)
+        return stats
+
+
+# Shared group for the certificate read path
+read_flight = SingleFlight()
@@ -0,0 +1,188 @@
+import time
+import hashlib
+import threading
+from collections import defaultdict
+
+# Issuance-rate windows: name -> (bucket seconds, bucket count)
+RATE_WINDOWS = {
+    "lastHour": (60, 60),
+    "lastDay": (3600, 24),
+    "last30Days": (86400, 30),
+}
+
+UNKNOWN_ISSUER = "unknown"
+
+
+def issuer_label(issuer):
+    """
+    Public name for an admission client ID; API keys and IP addresses are
+    replaced by a short hash, since /api/stats is unauthenticated
+    """
+    kind, _, value = (issuer or "").partition(":")
+    if kind in ("key", "ip") and value:
+        return kind + ":" + hashlib.sha256(value.encode()).hexdigest()[:12]
+    return issuer
+
+
+class RateCounter:
+    """
+    Event counts over a sliding window, kept in a fixed ring of time buckets.
+    Counts are exact to one bucket at the window's far edge.
+    """
+    def __init__(self, bucket_seconds, buckets):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        self.counts = [0] * buckets
+        self.bucket_ids = [None] * buckets
+
+    def add(self, timestamp, amount=1):
+        bucket_id = int(timestamp // self.bucket_seconds)
+        if bucket_id <= int(time.time() // self.bucket_seconds) - self.buckets:
+            return
+        slot = bucket_id % self.buckets
+        if self.bucket_ids[slot] != bucket_id:
+            self.bucket_ids[slot] = bucket_id
+            self.counts[slot] = 0
+        self.counts[slot] += amount
+
+    def total(self, now=None):
+        current = int((now or time.time()) // self.bucket_seconds)
+        return sum(
+            count for bucket_id, count in zip(self.bucket_ids, self.counts)
+            if bucket_id is not None and current - self.buckets < bucket_id <= current
+        )
+
+
+class CertificateStats:
+    """
+    Certificate counts kept up to date on every issue, update and revoke.
+
+    Reads cost the same however many certificates exist. Each certificate's
+    course, issuer and revoked flag are remembered so updates and revocations
+    adjust the right counters, and so the same change reported twice (by the
+    API and by the event feed) is only counted once.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.certificates = {}
+        self.total = 0
+        self.revoked = 0
+        self.courses = defaultdict(lambda: {"issued": 0, "revoked": 0})
+        self.issuers = defaultdict(lambda: {"issued": 0, "revoked": 0})
+        self.rates = {name: RateCounter(*window) for name, window in RATE_WINDOWS.items()}
+        self.built_at = None
+
+    def _adjust(self, course, issuer, field, amount):
+        self.courses[course][field] += amount
+        self.issuers[issuer][field] += amount
+        for table, key in ((self.courses, course), (self.issuers, issuer)):
+            if table[key]["issued"] == 0 and table[key]["revoked"] == 0:
+                del table[key]
+
+    def _record_issued(self, certificate_id, course_name, issued_at=None, issuer=None, revoked=False):
+        issuer = issuer_label(issuer)
+        known = self.certificates.get(certificate_id)
+        if known is not None:
+            # Already counted (e.g. from the event feed); fill in the issuer if we just learned it
+            if issuer and known["issuer"] == UNKNOWN_ISSUER:
+                self._move(known, known["course"], issuer)
+            return
+        record = {"course": course_name, "issuer": issuer or UNKNOWN_ISSUER, "revoked": False}
+        self.certificates[certificate_id] = record
+        self.total += 1
+        self._adjust(record["course"], record["issuer"], "issued", 1)
+        self._add_rate(issued_at or time.time())
+        if revoked:
+            self._record_revoked(certificate_id)
+
+    def _record_revoked(self, certificate_id):
+        record = self.certificates.get(certificate_id)
+        if record is None or record["revoked"]:
+            return
+        record["revoked"] = True
+        self.revoked += 1
+        self._adjust(record["course"], record["issuer"], "revoked", 1)
+
+    def _move(self, record, course_name, issuer):
+        # Re-file a certificate under another course and/or issuer
+        self._adjust(record["course"], record["issuer"], "issued", -1)
+        if record["revoked"]:
+            self._adjust(record["course"], record["issuer"], "revoked", -1)
+        record["course"] = course_name
+        record["issuer"] = issuer
+        self._adjust(course_name, issuer, "issued", 1)
+        if record["revoked"]:
+            self._adjust(course_name, issuer, "revoked", 1)
+
+    def _add_rate(self, timestamp):
+        for counter in self.rates.values():
+            counter.add(timestamp)
+
+    def record_issued(self, certificate_id, course_name, issued_at=None, issuer=None):
+        with self.lock:
+            self._record_issued(certificate_id, course_name, issued_at, issuer)
+
+    def record_updated(self, certificate_id, course_name):
+        with self.lock:
+            record = self.certificates.get(certificate_id)
+            # A revoked certificate stays counted where it was revoked
+            if record is not None and not record["revoked"] and record["course"] != course_name:
+                self._move(record, course_name, record["issuer"])
+
+    def record_revoked(self, certificate_id):
+        with self.lock:
+            self._record_revoked(certificate_id)
+
+    def on_certificate_event(self, event):
+        """
+        Broker listener, so certificates issued or revoked outside this API are counted too
+        """
+        data = event["data"]
+        if event["type"] == "issued" and "courseName" in data:
+            self.record_issued(event["certificateId"], data["courseName"], data.get("issueDate"))
+        elif event["type"] == "revoked":
+            self.record_revoked(event["certificateId"])
+
+    def rebuild(self, certificates, issuers=None):
+        """
+        Recompute everything from the source of truth. certificates are
+        list_certificates() entries; issuers maps certificate ID to issuer.
+        """
+        issuers = issuers or {}
+        with self.lock:
+            self.reset()
+            for certificate in certificates:
+                self._record_issued(
+                    certificate["id"],
+                    certificate["course_name"],
+                    certificate.get("issued_at"),
+                    issuers.get(certificate["id"]),
+                    certificate["revoked"],
+                )
+            self.built_at = time.time()
+        print(f"Certificate statistics rebuilt from {len(certificates)} certificates")
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            issuance = {}
+            for name, counter in self.rates.items():
+                count = counter.total(now)
+                hours = counter.bucket_seconds * counter.buckets / 3600
+                issuance[name] = {"count": count, "perHour": round(count / hours, 3)}
+            return {
+                "total": self.total,
+                "revoked": self.revoked,
+                "active": self.total - self.revoked,
+                "courses": {course: dict(counts) for course, counts in self.courses.items()},
+                "issuers": {issuer: dict(counts) for issuer, counts in self.issuers.items()},
+                "issuance": issuance,
+                "builtAt": self.built_at,
+                "generatedAt": now,
+            }
+
+
+certificate_stats = CertificateStats()
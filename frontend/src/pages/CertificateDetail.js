@@ -40,7 +40,7 @@ import {
   Visibility as ViewOnlyIcon
 } from '@mui/icons-material';
 import { Web3Context } from '../context/Web3Context';
-import { getCertificate, revokeCertificate } from '../utils/api';
+import { getCertificate, getCertificateMetadata, revokeCertificate } from '../utils/api';
 import toast from 'react-hot-toast';
 import ImagePlaceholder from '../components/ImagePlaceholder';
 
@@ -69,9 +69,8 @@ const CertificateDetail = () => {
         // Fetch metadata if token URI exists
         if (data.token_uri) {
           try {
-            const metadataUrl = data.token_uri.replace('ipfs://', 'https://ipfs.io/ipfs/');
-            const response = await fetch(metadataUrl);
-            const metadataJson = await response.json();
+            // Resolved by the backend so concurrent viewers share one gateway fetch
+            const metadataJson = await getCertificateMetadata(id);
             setMetadata(metadataJson);
           } catch (err) {
             console.error('Error fetching metadata:', err);
@@ -587,7 +586,7 @@ const CertificateDetail = () => {
                                 Token ID
                               </Typography>
                               <Typography variant="body2" fontFamily="monospace" fontWeight="bold">
-                                #{certificate.id}
+                                #{certificate.token_id ?? certificate.id}
                               </Typography>
                             </Box>
                           </Grid>
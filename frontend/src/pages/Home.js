@@ -1,4 +1,4 @@
-import React, { useContext, useState } from 'react';
+import React, { useContext, useEffect, useState } from 'react';
 import { Link as RouterLink } from 'react-router-dom';
 import { 
   Container, 
@@ -27,6 +27,7 @@ import {
   Verified as VerifiedIcon
 } from '@mui/icons-material';
 import { Web3Context } from '../context/Web3Context';
+import { getStats } from '../utils/api';
 import { motion } from 'framer-motion';
 
 const MotionCard = motion(Card);
@@ -45,6 +46,15 @@ const Home = () => {
   } = useContext(Web3Context);
   
   const [deployError, setDeployError] = useState(null);
+  const [stats, setStats] = useState(null);
+
+  useEffect(() => {
+    if (!isDeployed) return;
+    // Counts come precomputed from the backend, no need to load every certificate
+    getStats()
+      .then(setStats)
+      .catch(() => setStats(null));
+  }, [isDeployed]);
 
   const handleDeployContract = async () => {
     try {
@@ -173,6 +183,37 @@ const Home = () => {
               ))}
             </Stack>
 
+            {isDeployed && stats && (
+              <Stack 
+                direction="row" 
+                spacing={1} 
+                sx={{ 
+                  mb: { xs: 1, md: 1.5 },
+                  flexWrap: 'wrap',
+                  justifyContent: { xs: 'center', md: 'flex-start' } 
+                }}
+              >
+                {[
+                  { label: `${stats.total} issued`, color: "primary" },
+                  { label: `${stats.active} active`, color: "secondary" },
+                  { label: `${stats.revoked} revoked`, color: "error" },
+                  { label: `${stats.issuance.lastDay.count} in the last 24h`, color: "primary" }
+                ].map((stat, index) => (
+                  <Chip
+                    key={index}
+                    label={stat.label}
+                    size="small"
+                    variant="outlined"
+                    sx={{
+                      fontSize: '0.8rem',
+                      color: theme.palette[stat.color].dark,
+                      borderColor: alpha(theme.palette[stat.color].main, 0.3)
+                    }}
+                  />
+                ))}
+              </Stack>
+            )}
+
             {isDeployed && (
               <MotionBox
                 component={motion.div}
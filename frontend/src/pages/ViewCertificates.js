@@ -36,7 +36,7 @@ import {
   ArrowDownward as SortDescIcon
 } from '@mui/icons-material';
 import { Web3Context } from '../context/Web3Context';
-import { getCertificates } from '../utils/api';
+import { getCertificates, getCertificate, subscribeToCertificateEvents } from '../utils/api';
 import toast from 'react-hot-toast';
 import ImagePlaceholder from '../components/ImagePlaceholder';
 
@@ -74,6 +74,38 @@ const ViewCertificates = () => {
       fetchCertificates();
     }
   }, [isDeployed]);
+
+  // Apply live changes instead of reloading the whole list
+  useEffect(() => {
+    if (!isDeployed) {
+      return undefined;
+    }
+
+    const upsertCertificate = async (tokenId) => {
+      try {
+        const certificate = await getCertificate(tokenId);
+        setCertificates(prev => [
+          ...prev.filter(cert => cert.id !== certificate.id),
+          certificate
+        ]);
+      } catch (error) {
+        console.error(`Error loading certificate ${tokenId}:`, error);
+      }
+    };
+
+    return subscribeToCertificateEvents((event) => {
+      if (event.type === 'reset') {
+        // Too far behind to replay missed events
+        fetchCertificates();
+      } else if (event.type === 'revoked') {
+        setCertificates(prev => prev.map(cert =>
+          cert.id === event.certificateId ? { ...cert, revoked: true } : cert
+        ));
+      } else {
+        upsertCertificate(event.certificateId);
+      }
+    });
+  }, [isDeployed]);
   
   // Filter certificates when search or filter changes
   useEffect(() => {
@@ -546,7 +578,7 @@ const ViewCertificates = () => {
                                     Token:
                                   </Typography>
                                   <Typography variant="body2" fontFamily="monospace">
-                                    #{certificate.id}
+                                    #{certificate.token_id ?? certificate.id}
                                   </Typography>
                                 </Box>
                               </Box>
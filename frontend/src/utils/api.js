@@ -30,6 +30,40 @@ export const getCertificate = async (tokenId) => {
   }
 };
 
+export const getCertificateMetadata = async (tokenId) => {
+  try {
+    const response = await api.get(`/api/certificates/${tokenId}/metadata`);
+    return response.data;
+  } catch (error) {
+    console.error(`Error fetching metadata for certificate ${tokenId}:`, error);
+    throw error;
+  }
+};
+
+export const getJob = async (jobId) => {
+  try {
+    const response = await api.get(`/api/jobs/${jobId}`);
+    return response.data;
+  } catch (error) {
+    console.error(`Error fetching job ${jobId}:`, error);
+    throw error;
+  }
+};
+
+// Poll an issuance job until it finishes and return its certificate
+export const waitForJob = async (jobId, interval = 1000) => {
+  for (;;) {
+    const job = await getJob(jobId);
+    if (job.status === 'succeeded') {
+      return job.result;
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Certificate issuance failed');
+    }
+    await new Promise((resolve) => setTimeout(resolve, interval));
+  }
+};
+
 export const createCertificate = async (formData) => {
   try {
     const response = await api.post('/api/certificates', formData, {
@@ -37,6 +71,10 @@ export const createCertificate = async (formData) => {
         'Content-Type': 'multipart/form-data',
       },
     });
+    // 202: issuance was queued as a job; 200: the certificate already existed
+    if (response.status === 202) {
+      return await waitForJob(response.data.id);
+    }
     return response.data;
   } catch (error) {
     console.error('Error creating certificate:', error);
@@ -68,6 +106,26 @@ export const revokeCertificate = async (tokenId) => {
   }
 };
 
+// Live certificate events (server-sent events).
+// EventSource reconnects on its own and sends Last-Event-ID, so only missed
+// events are replayed. Returns a function that closes the stream.
+export const subscribeToCertificateEvents = (onEvent) => {
+  const source = new EventSource(`${API_URL}/api/certificates/stream`);
+  ['issued', 'updated', 'revoked', 'reset'].forEach((type) => {
+    source.addEventListener(type, (message) => {
+      try {
+        onEvent(JSON.parse(message.data));
+      } catch (error) {
+        console.error('Error handling certificate event:', error);
+      }
+    });
+  });
+  source.onerror = (error) => {
+    console.error('Certificate event stream error:', error);
+  };
+  return () => source.close();
+};
+
 // Settings API calls
 export const getSettings = async () => {
   try {
@@ -100,4 +158,15 @@ export const getNetworkInfo = async () => {
   }
 };
 
+// Certificate statistics, kept up to date by the backend
+export const getStats = async () => {
+  try {
+    const response = await api.get('/api/stats');
+    return response.data;
+  } catch (error) {
+    console.error('Error fetching certificate stats:', error);
+    throw error;
+  }
+};
+
 export default api; 
\ No newline at end of file
@@ -0,0 +1,152 @@
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.20;
+
+import "@openzeppelin/contracts/token/ERC721/ERC721.sol";
+import "@openzeppelin/contracts/access/Ownable.sol";
+
+/**
+ * @title CertificateNFTLean
+ * @dev Gas-lean variant of CertificateNFT. Only the sha2-256 digest of the
+ * certificate's IPFS metadata is stored; recipient name, course and
+ * description live in that metadata. tokenURI() rebuilds the CIDv0 from the
+ * digest, so every certificate costs two storage slots on top of the ERC721
+ * owner and balance.
+ */
+contract CertificateNFTLean is ERC721, Ownable {
+    // TokenId counter
+    uint256 private _tokenIdCounter;
+
+    // Mapping from token ID to certificate details
+    mapping(uint256 => CertificateDetails) private _certificates;
+
+    // Certificate details structure, packed into two slots
+    struct CertificateDetails {
+        bytes32 metadataDigest;
+        uint64 issueDate;
+        bool revoked;
+    }
+
+    bytes private constant BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz";
+
+    // Events
+    event CertificateIssued(
+        uint256 indexed tokenId,
+        address indexed recipient,
+        bytes32 metadataDigest,
+        uint256 issueDate
+    );
+
+    event CertificateRevoked(uint256 indexed tokenId);
+    event CertificateUpdated(uint256 indexed tokenId);
+
+    constructor() ERC721("Certificate NFT", "CERT") Ownable(msg.sender) {}
+
+    /**
+     * @dev Issues a new certificate NFT
+     * @param to Recipient address
+     * @param metadataDigest sha2-256 digest of the metadata's CIDv0 ("Qm...")
+     * @return new token ID
+     */
+    function issueCertificate(address to, bytes32 metadataDigest) public onlyOwner returns (uint256) {
+        // Increment the token ID counter
+        _tokenIdCounter++;
+        uint256 newTokenId = _tokenIdCounter;
+
+        _mint(to, newTokenId);
+
+        _certificates[newTokenId] = CertificateDetails({
+            metadataDigest: metadataDigest,
+            issueDate: uint64(block.timestamp),
+            revoked: false
+        });
+
+        emit CertificateIssued(newTokenId, to, metadataDigest, block.timestamp);
+
+        return newTokenId;
+    }
+
+    /**
+     * @dev Points an existing certificate at new metadata
+     * @param tokenId ID of the token to update
+     * @param metadataDigest sha2-256 digest of the new metadata's CIDv0
+     */
+    function updateCertificate(uint256 tokenId, bytes32 metadataDigest) public onlyOwner {
+        _requireOwned(tokenId);
+        require(!_certificates[tokenId].revoked, "Certificate is revoked");
+
+        _certificates[tokenId].metadataDigest = metadataDigest;
+
+        emit CertificateUpdated(tokenId);
+    }
+
+    /**
+     * @dev Revokes a certificate
+     * @param tokenId ID of the token to revoke
+     */
+    function revokeCertificate(uint256 tokenId) public onlyOwner {
+        _requireOwned(tokenId);
+        require(!_certificates[tokenId].revoked, "Certificate already revoked");
+
+        _certificates[tokenId].revoked = true;
+
+        emit CertificateRevoked(tokenId);
+    }
+
+    /**
+     * @dev Checks if a certificate is valid
+     * @param tokenId ID of the token to check
+     * @return bool indicating if certificate is valid
+     */
+    function isValid(uint256 tokenId) public view returns (bool) {
+        _requireOwned(tokenId);
+        return !_certificates[tokenId].revoked;
+    }
+
+    /**
+     * @dev Gets certificate details
+     * @param tokenId ID of the token
+     * @return Certificate details struct
+     */
+    function getCertificateDetails(uint256 tokenId) public view returns (CertificateDetails memory) {
+        _requireOwned(tokenId);
+        return _certificates[tokenId];
+    }
+
+    /**
+     * @dev IPFS URI of the certificate metadata, rebuilt from the stored digest
+     * @param tokenId ID of the token
+     * @return ipfs://Qm... URI
+     */
+    function tokenURI(uint256 tokenId) public view override returns (string memory) {
+        _requireOwned(tokenId);
+        bytes memory multihash = abi.encodePacked(bytes2(0x1220), _certificates[tokenId].metadataDigest);
+        return string(abi.encodePacked("ipfs://", _toBase58(multihash)));
+    }
+
+    /**
+     * @dev Base58 (bitcoin alphabet) encoding; view-only, so the cost is not paid on issuance
+     */
+    function _toBase58(bytes memory source) internal pure returns (bytes memory) {
+        // 34 bytes never need more than 47 base58 digits
+        uint8[] memory digits = new uint8[](47);
+        uint256 length = 1;
+        for (uint256 i = 0; i < source.length; i++) {
+            uint256 carry = uint8(source[i]);
+            for (uint256 j = 0; j < length; j++) {
+                carry += uint256(digits[j]) * 256;
+                digits[j] = uint8(carry % 58);
+                carry = carry / 58;
+            }
+            while (carry > 0) {
+                digits[length] = uint8(carry % 58);
+                length++;
+                carry = carry / 58;
+            }
+        }
+        bytes memory result = new bytes(length);
+        for (uint256 i = 0; i < length; i++) {
+            result[i] = BASE58_ALPHABET[digits[length - 1 - i]];
+        }
+        return result;
+    }
+}
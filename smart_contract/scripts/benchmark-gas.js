@@ -0,0 +1,103 @@
+// Compares the gas used per certificate by CertificateNFT and CertificateNFTLean.
+//
+// Run against the in-process Hardhat network:
+//   npx hardhat run scripts/benchmark-gas.js
+// or against a running node (npx hardhat node):
+//   npx hardhat run scripts/benchmark-gas.js --network localhost
+//
+// BENCHMARK_CERTIFICATES sets how many certificates each contract issues (default 20).
+const hre = require("hardhat");
+
+const COUNT = parseInt(process.env.BENCHMARK_CERTIFICATES || "20", 10);
+
+// Field lengths typical of the certificates issued through the app
+function sampleCertificate(index) {
+  const metadata = JSON.stringify({
+    name: `Certificate: Advanced Smart Contract Development ${index}`,
+    description: "Awarded for successfully completing the twelve-week course including the final project.",
+    image: "ipfs://QmYwAPJzv5CZsnA625s3Xf2nemtYgPpHdWEz79ojWnPbdG",
+    attributes: [
+      { trait_type: "Recipient Name", value: `Alexandra Rodriguez-Smith ${index}` },
+      { trait_type: "Course Name", value: "Advanced Smart Contract Development" },
+      { trait_type: "Issue Date", value: "2024-06-01" },
+    ],
+  });
+  const digest = hre.ethers.sha256(hre.ethers.toUtf8Bytes(metadata));
+  return {
+    recipientName: `Alexandra Rodriguez-Smith ${index}`,
+    courseName: "Advanced Smart Contract Development",
+    description: "Awarded for successfully completing the twelve-week course including the final project.",
+    digest,
+    tokenURI: `ipfs://${hre.ethers.encodeBase58("0x1220" + digest.slice(2))}`,
+  };
+}
+
+async function gasUsed(txPromise) {
+  const tx = await txPromise;
+  const receipt = await tx.wait();
+  return receipt.gasUsed;
+}
+
+function average(values) {
+  return values.reduce((sum, value) => sum + value, 0n) / BigInt(values.length);
+}
+
+async function benchmark(name, issue, update, check) {
+  const Factory = await hre.ethers.getContractFactory(name);
+  const contract = await Factory.deploy();
+  await contract.waitForDeployment();
+  const deployment = await hre.ethers.provider.getTransactionReceipt(contract.deploymentTransaction().hash);
+
+  const [, recipient] = await hre.ethers.getSigners();
+  const issued = [];
+  for (let i = 0; i < COUNT; i++) {
+    issued.push(await gasUsed(issue(contract, recipient.address, sampleCertificate(i))));
+  }
+  const updated = await gasUsed(update(contract, 1n, sampleCertificate(COUNT)));
+  const revoked = await gasUsed(contract.revokeCertificate(2n));
+  await check(contract, sampleCertificate(COUNT));
+
+  return { name, deploy: deployment.gasUsed, issue: average(issued), update: updated, revoke: revoked };
+}
+
+async function main() {
+  console.log(`Issuing ${COUNT} certificates per contract on ${hre.network.name}...`);
+
+  const full = await benchmark(
+    "CertificateNFT",
+    (contract, to, c) => contract.issueCertificate(to, c.recipientName, c.courseName, c.description, c.tokenURI),
+    (contract, tokenId, c) => contract.updateCertificate(tokenId, c.recipientName, c.courseName, c.description, c.tokenURI),
+    async () => {}
+  );
+  const lean = await benchmark(
+    "CertificateNFTLean",
+    (contract, to, c) => contract.issueCertificate(to, c.digest),
+    (contract, tokenId, c) => contract.updateCertificate(tokenId, c.digest),
+    async (contract, c) => {
+      // The URI rebuilt on-chain must match the CID the backend uploaded
+      const uri = await contract.tokenURI(1n);
+      if (uri !== c.tokenURI) {
+        throw new Error(`tokenURI mismatch: ${uri} != ${c.tokenURI}`);
+      }
+    }
+  );
+
+  const blockGasLimit = (await hre.ethers.provider.getBlock("latest")).gasLimit;
+  const rows = {};
+  for (const result of [full, lean]) {
+    rows[result.name] = {
+      "deploy gas": Number(result.deploy),
+      "issue gas (avg)": Number(result.issue),
+      "update gas": Number(result.update),
+      "revoke gas": Number(result.revoke),
+      "issuances per block": Number(blockGasLimit / result.issue),
+    };
+  }
+  console.table(rows);
+  console.log(`Issuance gas: lean uses ${(Number(full.issue) / Number(lean.issue)).toFixed(1)}x less than full`);
+}
+
+main().catch((error) => {
+  console.error(error);
+  process.exitCode = 1;
+});
@@ -7,15 +7,17 @@
 const hre = require("hardhat");
 
 async function main() {
-  console.log("Deploying CertificateNFT contract...");
+  // CONTRACT_MODE=lean deploys the variant storing only a metadata digest on-chain
+  const name = process.env.CONTRACT_MODE === "lean" ? "CertificateNFTLean" : "CertificateNFT";
+  console.log(`Deploying ${name} contract...`);
 
-  const CertificateNFT = await hre.ethers.getContractFactory("CertificateNFT");
+  const CertificateNFT = await hre.ethers.getContractFactory(name);
   const certificateNFT = await CertificateNFT.deploy();
 
   await certificateNFT.waitForDeployment();
 
   const address = await certificateNFT.getAddress();
-  console.log(`CertificateNFT deployed to: ${address}`);
+  console.log(`${name} deployed to: ${address}`);
   return address;
 }
 